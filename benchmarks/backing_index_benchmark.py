@@ -0,0 +1,145 @@
+"""Benchmark cold versus warm startup of the backing ref cache.
+
+A fake vCenter session serves a synthetic inventory of backing VMs. Every
+retrieval call sleeps for a fixed round-trip latency plus a per-object cost,
+which is higher for objects whose extraConfig volume ID is requested since
+vCenter has to serialize the whole extraConfig array for those.
+
+Usage::
+
+    python benchmarks/backing_index_benchmark.py --backings 80000 --changed 500
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+from oslo_vmware import vim_util
+
+from vmwaretool import backing_index
+from vmwaretool import volumeops
+
+
+class FakeSession(object):
+
+    def __init__(self, backings, round_trip, object_cost, extra_config_cost):
+        self._backings = backings
+        self._round_trip = round_trip
+        self._object_cost = object_cost
+        self._extra_config_cost = extra_config_cost
+        self.round_trips = 0
+        about = SimpleNamespace(instanceUuid='vc-1')
+        self.vim = SimpleNamespace(
+            service_content=SimpleNamespace(about=about))
+
+    def _page(self, backings, properties, offset, max_objects):
+        batch = backings[offset:offset + max_objects]
+        cost = self._object_cost
+        if backing_index.VOLUME_ID_PROPERTY in properties:
+            cost += self._extra_config_cost
+        self.round_trips += 1
+        time.sleep(self._round_trip + cost * len(batch))
+
+        objects = []
+        for backing in batch:
+            prop_set = [SimpleNamespace(name=p, val=backing[p])
+                        for p in properties if backing.get(p) is not None]
+            objects.append(SimpleNamespace(obj=backing['ref'],
+                                           propSet=prop_set))
+        token = None
+        if offset + max_objects < len(backings):
+            token = (backings, properties, offset + max_objects, max_objects)
+        return SimpleNamespace(objects=objects, token=token)
+
+    def invoke_api(self, module, method, vim, *args, **kwargs):
+        if method == 'get_objects':
+            _type, max_objects = args
+            return self._page(self._backings,
+                              kwargs['properties_to_collect'], 0, max_objects)
+        if method == 'get_properties_for_a_collection_of_objects':
+            _type, refs, properties = args
+            values = set(ref.value for ref in refs)
+            backings = [b for b in self._backings if b['ref'].value in values]
+            return self._page(backings, properties, 0, kwargs['max_objects'])
+        if method == 'continue_retrieval':
+            result = args[0]
+            return self._page(*result.token) if result.token else None
+        raise AssertionError("unexpected call: %s" % method)
+
+
+def build_backings(count):
+    backings = []
+    for i in range(count):
+        volume_id = 'volume-%08d' % i
+        backings.append({
+            'ref': vim_util.get_moref('vm-%d' % i, 'VirtualMachine'),
+            'name': volume_id,
+            'config.instanceUuid': 'uuid-%08d' % i,
+            'config.changeVersion': '1',
+            backing_index.VOLUME_ID_PROPERTY: SimpleNamespace(
+                value=volume_id)})
+    return backings
+
+
+def timed_startup(session, max_objects, index_file, background=False):
+    vops = volumeops.VMwareVolumeOps(session, max_objects, None, None,
+                                     backing_index_file=index_file)
+    session.round_trips = 0
+    start = time.perf_counter()
+    vops.build_backing_ref_cache(background=background)
+    return time.perf_counter() - start, session.round_trips, vops
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--backings', type=int, default=80000)
+    parser.add_argument('--changed', type=int, default=500)
+    parser.add_argument('--max-objects', type=int, default=1000)
+    parser.add_argument('--round-trip-ms', type=float, default=20.0)
+    parser.add_argument('--object-cost-us', type=float, default=5.0)
+    parser.add_argument('--extra-config-cost-us', type=float, default=60.0)
+    args = parser.parse_args()
+
+    backings = build_backings(args.backings)
+    session = FakeSession(backings, args.round_trip_ms / 1000.0,
+                          args.object_cost_us / 1000000.0,
+                          args.extra_config_cost_us / 1000000.0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index_file = os.path.join(tmp, 'backings.db')
+
+        no_index_time, no_index_trips, _ = timed_startup(
+            session, args.max_objects, None)
+        cold_time, cold_trips, cold = timed_startup(
+            session, args.max_objects, index_file)
+
+        # Simulate config changes of some backings between runs.
+        for backing in backings[:args.changed]:
+            backing['config.changeVersion'] = '2'
+        warm_time, warm_trips, warm = timed_startup(
+            session, args.max_objects, index_file)
+        # The cache is usable as soon as the saved index is loaded.
+        bg_time, _, bg = timed_startup(session, args.max_objects, index_file,
+                                       background=True)
+        bg._backing_index_thread.join()
+
+        assert len(warm._backing_ref_cache) == len(cold._backing_ref_cache)
+        index_size = os.path.getsize(index_file)
+
+    print("backings: %d, changed between runs: %d" % (args.backings,
+                                                      args.changed))
+    print("index file size: %.1f MiB" % (index_size / 1024.0 / 1024.0))
+    print("no index:     %8.1f ms, %5d round trips" % (no_index_time * 1000,
+                                                      no_index_trips))
+    print("cold start:   %8.1f ms, %5d round trips" % (cold_time * 1000,
+                                                      cold_trips))
+    print("warm start:   %8.1f ms, %5d round trips" % (warm_time * 1000,
+                                                      warm_trips))
+    print("warm start with background reconcile: %.1f ms to first lookup"
+          % (bg_time * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Measure memory used by the backing ref cache with tracemalloc.
+
+Builds the backing ref cache from a fake session serving a synthetic
+inventory of backing VMs, once into a plain dict of suds
+ManagedObjectReference objects (the previous representation) and once
+through VMwareVolumeOps.build_backing_ref_cache into BackingRefCache.
+
+Usage::
+
+    python benchmarks/backing_ref_cache_memory.py --backings 100000
+"""
+
+import argparse
+import gc
+import tracemalloc
+from types import SimpleNamespace
+
+from oslo_vmware import vim_util
+
+from vmwaretool import volumeops
+
+
+class FakeSession(object):
+    """Serves pages of backings built on demand, like a real SOAP reply."""
+
+    def __init__(self, count, max_objects):
+        self._count = count
+        self._max_objects = max_objects
+        self.vim = None
+
+    def _page(self, offset):
+        objects = []
+        for i in range(offset, min(offset + self._max_objects, self._count)):
+            volume_id = 'volume-%08d' % i
+            prop_set = [
+                SimpleNamespace(name='name', val=volume_id),
+                SimpleNamespace(name='config.instanceUuid',
+                                val='uuid-%08d' % i),
+                SimpleNamespace(name='config.extraConfig["cinder.volume.id"]',
+                                val=SimpleNamespace(value=volume_id))]
+            objects.append(SimpleNamespace(
+                obj=vim_util.get_moref('vm-%d' % i, 'VirtualMachine'),
+                propSet=prop_set))
+        token = offset + self._max_objects
+        return SimpleNamespace(
+            objects=objects, token=token if token < self._count else None)
+
+    def invoke_api(self, module, method, vim, *args, **kwargs):
+        if method == 'get_objects':
+            return self._page(0)
+        if method == 'continue_retrieval':
+            result = args[0]
+            return self._page(result.token) if result.token else None
+        raise AssertionError("unexpected call: %s" % method)
+
+
+def build_dict_cache(session):
+    cache = {}
+    result = session.invoke_api(vim_util, 'get_objects', None)
+    while result:
+        for backing in result.objects:
+            cache[backing.propSet[0].val] = backing.obj
+        result = session.invoke_api(vim_util, 'continue_retrieval', None,
+                                    result)
+    return cache
+
+
+def measure(func):
+    gc.collect()
+    tracemalloc.start()
+    result = func()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--backings', type=int, default=100000)
+    parser.add_argument('--max-objects', type=int, default=1000)
+    args = parser.parse_args()
+
+    session = FakeSession(args.backings, args.max_objects)
+
+    dict_cache, dict_current, dict_peak = measure(
+        lambda: build_dict_cache(session))
+    count = len(dict_cache)
+    del dict_cache
+
+    def build_compact():
+        vops = volumeops.VMwareVolumeOps(session, args.max_objects, None,
+                                         None)
+        vops.build_backing_ref_cache()
+        return vops._backing_ref_cache
+
+    compact_cache, compact_current, compact_peak = measure(build_compact)
+    assert len(compact_cache) == count
+    assert compact_cache.get('volume-00000001').value == 'vm-1'
+
+    mib = 1024.0 * 1024.0
+    print("backings: %d" % count)
+    print("dict of morefs:   retained %7.1f MiB, peak %7.1f MiB"
+          % (dict_current / mib, dict_peak / mib))
+    print("BackingRefCache:  retained %7.1f MiB, peak %7.1f MiB"
+          % (compact_current / mib, compact_peak / mib))
+
+
+if __name__ == '__main__':
+    main()
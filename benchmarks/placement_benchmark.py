@@ -0,0 +1,133 @@
+"""Benchmark datastore filtering and ranking on a synthetic inventory.
+
+Compares the per-datastore Python path of DatastoreSelector with the
+vectorized DatastorePlacementEngine and checks that both pick the same
+datastore. The vectorized path is only used with a ready datastore mirror,
+which is stubbed here.
+
+Usage::
+
+    python benchmarks/placement_benchmark.py --datastores 10000 --hosts 2000
+"""
+
+import argparse
+import random
+import time
+from types import SimpleNamespace
+
+from oslo_vmware import vim_util
+
+from vmwaretool import datastore
+from vmwaretool import volumeops
+
+
+def build_inventory(ds_count, host_count, mounts_per_ds, seed):
+    rnd = random.Random(seed)
+    host_refs = [vim_util.get_moref('host-%d' % i, 'HostSystem')
+                 for i in range(host_count)]
+    types = ['vmfs', 'nfs', 'vsan', 'vvol', 'nfs41', 'vffs']
+
+    datastores = {}
+    for i in range(ds_count):
+        capacity = rnd.choice([0, 1, 2, 4, 8]) * 1024 ** 4
+        summary = SimpleNamespace(
+            name='ds-%05d' % i,
+            capacity=capacity,
+            freeSpace=int(capacity * rnd.random()),
+            type=rnd.choice(types),
+            accessible=rnd.random() > 0.02,
+            maintenanceMode=rnd.choice(['normal'] * 20 + ['inMaintenance']))
+        mounts = []
+        for host_ref in rnd.sample(host_refs, rnd.randint(1, mounts_per_ds)):
+            mount_info = SimpleNamespace(
+                accessMode=rnd.choice(['readWrite'] * 10 + ['readOnly']),
+                mounted=True,
+                accessible=rnd.random() > 0.01)
+            mounts.append(SimpleNamespace(key=host_ref,
+                                          mountInfo=mount_info))
+        ds_ref = vim_util.get_moref('datastore-%d' % i, 'Datastore')
+        datastores[ds_ref] = {'summary': summary, 'host': mounts}
+
+    cluster = vim_util.get_moref('domain-c1', 'ClusterComputeResource')
+    host_props = {}
+    for host_ref in host_refs:
+        runtime = SimpleNamespace(
+            connectionState=rnd.choice(['connected'] * 30 +
+                                       ['disconnected']),
+            inMaintenanceMode=rnd.random() < 0.03)
+        host_props[host_ref.value] = {'runtime': runtime, 'parent': cluster}
+    return datastores, host_refs, host_props
+
+
+def make_selector(datastores, host_props, vectorized):
+    vops = volumeops.VMwareVolumeOps(None, 100, None, None)
+    mirror = None
+    if vectorized:
+        mirror = SimpleNamespace(is_ready=lambda: True, version='1',
+                                 staleness=0.0)
+    selector = datastore.DatastoreSelector(vops, None, 100, mirror=mirror,
+                                           vectorized=vectorized)
+    selector._get_datastores = lambda: datastores
+    selector._get_hosts_properties = lambda refs: {
+        ref.value: host_props[ref.value] for ref in refs}
+    selector._get_resource_pool = lambda cluster_ref: None
+    return selector
+
+
+def timed(func, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--datastores', type=int, default=10000)
+    parser.add_argument('--hosts', type=int, default=2000)
+    parser.add_argument('--mounts-per-datastore', type=int, default=64)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    datastores, host_refs, host_props = build_inventory(
+        args.datastores, args.hosts, args.mounts_per_datastore, args.seed)
+    valid_hosts = host_refs[:args.hosts // 2]
+    req = {datastore.DatastoreSelector.SIZE_BYTES: 100 * 1024 ** 3,
+           datastore.DatastoreSelector.HARD_AFFINITY_DS_TYPE:
+               ['vmfs', 'nfs', 'vsan']}
+
+    legacy = make_selector(datastores, host_props, vectorized=False)
+    vectorized = make_selector(datastores, host_props, vectorized=True)
+
+    build_time, _engine = timed(
+        lambda: datastore.DatastorePlacementEngine(vectorized._vops,
+                                                   datastores),
+        args.repeat)
+
+    legacy_time, legacy_res = timed(
+        lambda: legacy.select_datastore(req, hosts=valid_hosts), args.repeat)
+    vectorized._get_placement_engine()
+    cached_time, cached_res = timed(
+        lambda: vectorized.select_datastore(req, hosts=valid_hosts),
+        args.repeat)
+
+    assert (cached_res is None) == (legacy_res is None)
+    if cached_res is not None:
+        assert cached_res[2] is legacy_res[2], "selected datastores differ"
+
+    print("inventory: %d datastores, %d hosts" % (args.datastores,
+                                                  args.hosts))
+    print("selected datastore: %s" % (legacy_res[2].name
+                                      if legacy_res else None))
+    print("engine build:                   %8.1f ms" % (build_time * 1000))
+    print("python path:                    %8.1f ms" % (legacy_time * 1000))
+    print("vectorized (cached engine):     %8.1f ms" % (cached_time * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Benchmark per-invocation connection latency with and without the cache.
+
+Every invocation of the tool creates a new session object, as a new process
+would, and authenticates it against a fake vCenter server. Each API call
+sleeps for a fixed round-trip latency; Login additionally sleeps for the
+authentication cost, which is dominated by the SSO token exchange on a real
+vCenter server.
+
+Usage::
+
+    python benchmarks/session_cache_benchmark.py --invocations 50
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import uuid
+from types import SimpleNamespace
+
+import requests
+
+from vmwaretool import session_cache
+
+
+class FakeServer(object):
+
+    def __init__(self, round_trip, login_cost):
+        self.round_trip = round_trip
+        self.login_cost = login_cost
+        self.sessions = {}
+        self.logins = 0
+
+    def call(self, cost=0.0):
+        time.sleep(self.round_trip + cost)
+
+
+class FakeVim(object):
+
+    def __init__(self, server):
+        self._server = server
+        self._service_content = None
+        self.client = SimpleNamespace(
+            cookiejar=requests.cookies.RequestsCookieJar())
+
+    @property
+    def service_content(self):
+        if self._service_content is None:
+            self._server.call()
+            self._service_content = SimpleNamespace(
+                sessionManager='SessionManager')
+        return self._service_content
+
+    def get_http_cookie(self):
+        return self.client.cookiejar.get(session_cache.SESSION_COOKIE)
+
+    def Login(self, session_manager, userName, password, locale):
+        self._server.call(self._server.login_cost)
+        self._server.logins += 1
+        cookie = uuid.uuid4().hex
+        user_session = SimpleNamespace(key=uuid.uuid4().hex,
+                                       userName=userName)
+        self._server.sessions[cookie] = user_session
+        self.client.cookiejar.set(session_cache.SESSION_COOKIE, cookie,
+                                  domain='vc', path='/')
+        return user_session
+
+    def current_session(self):
+        # The real check reads currentSession of the service content's
+        # sessionManager.
+        self.service_content
+        self._server.call()
+        return self._server.sessions.get(self.get_http_cookie())
+
+
+class FakeSession(object):
+
+    def __init__(self, server):
+        self.vim = FakeVim(server)
+        self._session_id = None
+        self._session_username = None
+
+    def _create_session(self):
+        user_session = self.vim.Login(self.vim.service_content.sessionManager,
+                                      userName='admin', password='secret',
+                                      locale='en')
+        self._session_id = user_session.key
+        self._session_username = user_session.userName
+
+
+def _invoke(server, cache):
+    session = FakeSession(server)
+    start = time.monotonic()
+    if cache is None:
+        session._create_session()
+    else:
+        session_cache.login(session, cache, 'vc', 443, 'admin')
+    # The first call made by the tool itself.
+    server.call()
+    return time.monotonic() - start
+
+
+def _run(server, cache, invocations):
+    server.logins = 0
+    latencies = sorted(_invoke(server, cache) for _ in range(invocations))
+    return latencies[len(latencies) // 2], latencies[-1], server.logins
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--invocations', type=int, default=50)
+    parser.add_argument('--round-trip', type=float, default=0.02)
+    parser.add_argument('--login-cost', type=float, default=0.3)
+    args = parser.parse_args()
+
+    server = FakeServer(args.round_trip, args.login_cost)
+    session_cache._get_current_session = (
+        lambda session: session.vim.current_session())
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = session_cache.SessionCache(
+            os.path.join(tmp_dir, session_cache.DEFAULT_FILE_NAME))
+        for name, cache in (('no cache', None), ('session cache', cache)):
+            median, worst, logins = _run(server, cache, args.invocations)
+            print("%-14s median %6.1f ms, max %6.1f ms, %d logins"
+                  % (name, median * 1000, worst * 1000, logins))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Import time regression benchmark for the vmwaretool CLI.
+
+Imports vmwaretool.cli in fresh interpreters with ``-X importtime`` and
+reports the best cumulative import time of the module along with the
+slowest modules it pulled in. Exits with status 1 if the import takes
+longer than the budget or loads a module which should only be imported by
+commands that need it.
+
+Usage::
+
+    python benchmarks/startup_benchmark.py --runs 5 --budget-ms 150
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+
+MODULE = 'vmwaretool.cli'
+
+# Modules which must not be loaded just to parse the command line.
+DEFERRED_MODULES = [
+    'click_completion',
+    'eventlet',
+    'oslo_config',
+    'oslo_log',
+    'oslo_vmware',
+    'pygments',
+    'suds',
+    'urllib3',
+    'yaspin',
+]
+
+
+def _import_times():
+    """Import MODULE in a new interpreter.
+
+    :return: dict of module name to (self, cumulative) import time in us
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import %s' % MODULE],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except ValueError:
+            # header line
+            continue
+        times[fields[2].strip()] = (self_us, cumulative_us)
+    return times
+
+
+def _help_time():
+    start = time.monotonic()
+    subprocess.run([sys.executable, '-m', MODULE, '--help'],
+                   stdout=subprocess.DEVNULL, check=True)
+    return time.monotonic() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=150.0)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    best = None
+    for _ in range(args.runs):
+        times = _import_times()
+        if best is None or times[MODULE][1] < best[MODULE][1]:
+            best = times
+    import_ms = best[MODULE][1] / 1000.0
+    help_ms = min(_help_time() for _ in range(args.runs)) * 1000
+
+    print("import %s: %.1f ms (budget %.1f ms)"
+          % (MODULE, import_ms, args.budget_ms))
+    print("%s --help: %.1f ms" % (MODULE, help_ms))
+    print("slowest modules (self time):")
+    slowest = sorted(best.items(), key=lambda item: item[1][0],
+                     reverse=True)
+    for name, (self_us, _cumulative_us) in slowest[:args.top]:
+        print("  %8.1f ms  %s" % (self_us / 1000.0, name))
+
+    failed = False
+    loaded = sorted(set(name.split('.')[0] for name in best) &
+                    set(DEFERRED_MODULES))
+    if loaded:
+        print("FAIL: deferred modules imported at startup: %s"
+              % ', '.join(loaded))
+        failed = True
+    if import_ms > args.budget_ms:
+        print("FAIL: import time over budget")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""Benchmark suds client construction with and without the WSDL cache.
+
+Each measurement runs in a fresh interpreter, as a new vmwaretool process
+would, and times the construction of the oslo.vmware client a session
+builds: the VIM client (vim.Vim) by default, or the PBM client (pbm.Pbm).
+The VIM WSDL is only served by vCenter, so the VIM client needs either
+--host of a reachable vCenter, from which the WSDL is fetched as in
+production, or --wsdl-url with a local copy of its vimService.wsdl. The PBM
+client uses the WSDL shipped with oslo.vmware.
+
+Usage::
+
+    python benchmarks/wsdl_cache_benchmark.py --host vc.example.com
+    python benchmarks/wsdl_cache_benchmark.py --wsdl-url file:///vim.wsdl
+    python benchmarks/wsdl_cache_benchmark.py --client pbm --runs 5
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def _child(args):
+    from oslo_vmware import pbm
+    from oslo_vmware import vim
+
+    from vmwaretool import wsdl_cache
+
+    def _build():
+        start = time.monotonic()
+        if args.client == 'vim':
+            vim.Vim(host=args.host, port=args.port, wsdl_url=args.wsdl_url,
+                    insecure=True)
+        else:
+            pbm.Pbm(host=args.host, port=args.port, wsdl_url=args.wsdl_url,
+                    insecure=True)
+        return time.monotonic() - start
+
+    if args.cache_dir:
+        cache = wsdl_cache.WsdlCache(args.cache_dir, args.host, args.port)
+        with cache.installed():
+            elapsed = _build()
+    else:
+        elapsed = _build()
+    print(elapsed)
+
+
+def _measure(args, cache_dir):
+    cmd = [sys.executable, __file__, '--child', '--client', args.client,
+           '--host', args.host, '--port', str(args.port)]
+    if args.wsdl_url:
+        cmd += ['--wsdl-url', args.wsdl_url]
+    if cache_dir:
+        cmd += ['--cache-dir', cache_dir]
+    output = subprocess.check_output(cmd, stderr=subprocess.DEVNULL,
+                                     universal_newlines=True)
+    return float(output.split()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--client', choices=['vim', 'pbm'], default='vim')
+    parser.add_argument('--host')
+    parser.add_argument('--port', type=int, default=443)
+    parser.add_argument('--wsdl-url')
+    parser.add_argument('--cache-dir')
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.client == 'vim' and not (args.host or args.wsdl_url):
+        parser.error("the VIM WSDL is only served by vCenter, pass --host "
+                     "or --wsdl-url")
+    if args.client == 'pbm' and args.wsdl_url is None:
+        from oslo_vmware import pbm
+        args.wsdl_url = pbm.get_pbm_wsdl_location('8.0')
+    args.host = args.host or 'vc'
+    if args.child:
+        _child(args)
+        return
+
+    wsdl_url = args.wsdl_url or "https://%s:%d/sdk/vimService.wsdl" % (
+        args.host, args.port)
+    print("%s client, WSDL: %s" % (args.client.upper(), wsdl_url))
+    uncached = [_measure(args, None) for _ in range(args.runs)]
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cold = _measure(args, cache_dir)
+        warm = [_measure(args, cache_dir) for _ in range(args.runs)]
+
+    print("no cache     median %7.1f ms" % (statistics.median(uncached) * 1000))
+    print("cold cache          %7.1f ms" % (cold * 1000))
+    print("warm cache   median %7.1f ms" % (statistics.median(warm) * 1000))
+    print("saved per startup   %7.1f ms"
+          % ((statistics.median(uncached) - statistics.median(warm)) * 1000))
+
+
+if __name__ == '__main__':
+    main()
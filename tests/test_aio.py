@@ -0,0 +1,100 @@
+"""Tests for `vmwaretool.aio`."""
+
+import asyncio
+import threading
+import unittest
+from unittest import mock
+
+from oslo_vmware import vim_util
+
+from vmwaretool import aio
+from vmwaretool import volumeops
+
+
+class AsyncVMwareVolumeOpsTest(unittest.TestCase):
+
+    def setUp(self):
+        self._session = mock.Mock()
+        self._cancelled = threading.Event()
+        self._session.invoke_api.side_effect = self._invoke_api
+        self._vops = volumeops.VMwareVolumeOps(self._session, 100, None,
+                                               None)
+        self._aops = aio.AsyncVMwareVolumeOps(self._vops, self._session,
+                                              max_concurrency=2)
+        self._aops._task_tracker._min_interval = 0.01
+        self._aops._task_tracker._max_interval = 0.01
+        self.addCleanup(self._aops.close)
+        self._loop = asyncio.new_event_loop()
+        self.addCleanup(self._loop.close)
+
+    def _invoke_api(self, module, method, *args, **kwargs):
+        if method == 'Destroy_Task':
+            return vim_util.get_moref('task-%s' % args[0].value, 'Task')
+        if method == 'CancelTask':
+            self._cancelled.set()
+            return
+        if method == 'continue_retrieval':
+            return None
+
+        # Tasks of vm-slow run until they are cancelled.
+        objects = []
+        for ref in args[2]:
+            state = 'success'
+            if ref.value == 'task-vm-slow':
+                state = 'error' if self._cancelled.is_set() else 'running'
+            prop = mock.Mock(val=mock.Mock(
+                state=state,
+                error=mock.Mock(localizedMessage='cancelled', fault=None)))
+            prop.name = 'info'
+            objects.append(mock.Mock(obj=ref, propSet=[prop]))
+        return mock.Mock(objects=objects)
+
+    def test_concurrent_calls(self):
+        backings = [vim_util.get_moref('vm-%d' % i, 'VirtualMachine')
+                    for i in range(5)]
+
+        async def run():
+            await asyncio.gather(*[self._aops.delete_backing(backing)
+                                   for backing in backings])
+
+        self._loop.run_until_complete(run())
+
+    def test_tasks_awaited_on_loop(self):
+        backing = vim_util.get_moref('vm-1', 'VirtualMachine')
+        self._vops._wait_for_task = mock.Mock()
+        self._vops.invalidate_backing = mock.Mock()
+
+        self._loop.run_until_complete(self._aops.delete_backing(backing))
+
+        self._vops._wait_for_task.assert_not_called()
+        self._vops.invalidate_backing.assert_called_once_with(backing)
+
+    def test_calls_from_several_loops(self):
+        backing = vim_util.get_moref('vm-1', 'VirtualMachine')
+
+        async def run():
+            await self._aops.delete_backing(backing)
+
+        self._loop.run_until_complete(run())
+        other_loop = asyncio.new_event_loop()
+        self.addCleanup(other_loop.close)
+        other_loop.run_until_complete(run())
+
+        self.assertEqual(2, len(self._aops._semaphores))
+
+    def test_cancel(self):
+        backing = vim_util.get_moref('vm-slow', 'VirtualMachine')
+
+        async def run():
+            call = asyncio.ensure_future(self._aops.delete_backing(backing))
+            await asyncio.sleep(0.1)
+            call.cancel()
+            await call
+
+        self.assertRaises(asyncio.CancelledError,
+                          self._loop.run_until_complete, run())
+        self.assertTrue(self._cancelled.is_set())
+
+    def test_methods(self):
+        for name in aio.ASYNC_METHODS:
+            self.assertTrue(hasattr(volumeops.VMwareVolumeOps, name), name)
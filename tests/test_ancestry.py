@@ -0,0 +1,67 @@
+"""Tests for `vmwaretool.ancestry`."""
+
+from types import SimpleNamespace
+import unittest
+from unittest import mock
+
+from oslo_vmware import vim_util
+
+from vmwaretool import ancestry
+
+
+def _ref(value, type_):
+    return vim_util.get_moref(value, type_)
+
+
+class AncestryResolverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = _ref('group-d1', 'Folder')
+        self.dc = _ref('datacenter-1', 'Datacenter')
+        self.vm_folder = _ref('group-v1', 'Folder')
+        self.folder = _ref('group-v2', 'Folder')
+        self.vm_1 = _ref('vm-1', 'VirtualMachine')
+        self.vm_2 = _ref('vm-2', 'VirtualMachine')
+        self.parents = [(self.vm_1, self.folder),
+                        (self.vm_2, self.vm_folder),
+                        (self.folder, self.vm_folder),
+                        (self.vm_folder, self.dc),
+                        (self.dc, self.root),
+                        (self.root, None)]
+
+        self.session = mock.Mock()
+        self.session.invoke_api.side_effect = self._invoke_api
+        self.resolver = ancestry.AncestryResolver(self.session, 100)
+
+    def _invoke_api(self, module, method, *args, **kwargs):
+        self.assertEqual('RetrievePropertiesEx', method)
+        objects = []
+        for entity, parent in self.parents:
+            prop_set = []
+            if parent is not None:
+                prop_set.append(SimpleNamespace(name='parent', val=parent))
+            objects.append(SimpleNamespace(obj=entity, propSet=prop_set))
+        return SimpleNamespace(objects=objects, token=None)
+
+    def test_get_parents(self):
+        self.assertEqual(
+            [self.dc, self.dc],
+            self.resolver.get_parents([self.vm_1, self.vm_2], 'Datacenter'))
+        self.assertEqual(1, self.session.invoke_api.call_count)
+        self.assertEqual([self.folder],
+                         self.resolver.get_parents([self.vm_1], 'Folder'))
+        self.assertEqual(2, self.session.invoke_api.call_count)
+
+        # The folder hierarchy is cached, virtual machines are not.
+        self.assertEqual(4, len(self.resolver))
+        self.assertEqual(
+            [self.dc, self.dc, None],
+            self.resolver.get_parents([self.folder, self.dc, None],
+                                      'Datacenter'))
+        self.assertEqual(2, self.session.invoke_api.call_count)
+
+    def test_get_parents_without_ancestor(self):
+        self.assertEqual([None],
+                         self.resolver.get_parents([self.vm_1], 'HostSystem'))
+        self.resolver.invalidate()
+        self.assertEqual(0, len(self.resolver))
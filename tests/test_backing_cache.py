@@ -0,0 +1,41 @@
+"""Tests for `vmwaretool.backing_cache`."""
+
+import unittest
+from unittest import mock
+
+from vmwaretool import backing_cache
+
+
+class BackingCacheTest(unittest.TestCase):
+
+    def test_get(self):
+        cache = backing_cache.BackingCache(max_entries=2)
+        fetch = mock.Mock(side_effect=lambda: [object()])
+
+        value = cache.get('vm-1', fetch)
+        self.assertIs(value, cache.get('vm-1', fetch))
+        cache.get('vm-2', fetch)
+        cache.get('vm-3', fetch)
+        self.assertEqual(2, len(cache))
+        self.assertEqual(3, fetch.call_count)
+
+        # vm-1 was evicted as the least recently used entry.
+        self.assertIsNot(value, cache.get('vm-1', fetch))
+
+    def test_get_expired(self):
+        cache = backing_cache.BackingCache(max_age=0)
+        fetch = mock.Mock(return_value=[])
+        with mock.patch('time.monotonic', side_effect=[0, 1]):
+            cache.get('vm-1', fetch)
+            cache.get('vm-1', fetch)
+        self.assertEqual(2, fetch.call_count)
+
+    def test_get_invalidated_while_fetching(self):
+        cache = backing_cache.BackingCache()
+
+        def fetch():
+            cache.invalidate('vm-1')
+            return []
+
+        cache.get('vm-1', fetch)
+        self.assertEqual(0, len(cache))
@@ -0,0 +1,139 @@
+"""Tests for `vmwaretool.backing_index`."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from oslo_vmware import exceptions
+from oslo_vmware import vim_util
+
+from vmwaretool import backing_index
+
+
+def _prop(name, val):
+    prop = mock.Mock(val=val)
+    prop.name = name
+    return prop
+
+
+def _backing(value, name, change_version, volume_id=None):
+    prop_set = [_prop('name', name),
+                _prop('config.instanceUuid', 'uuid-' + value),
+                _prop('config.changeVersion', change_version)]
+    if volume_id:
+        prop_set.append(_prop(backing_index.VOLUME_ID_PROPERTY,
+                              mock.Mock(value=volume_id)))
+    return mock.Mock(obj=vim_util.get_moref(value, 'VirtualMachine'),
+                     propSet=prop_set)
+
+
+class BackingIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self._path = os.path.join(self._tmp, 'backings.db')
+        self._session = mock.Mock()
+        self._session.vim.service_content.about.instanceUuid = 'vc-1'
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def _index(self):
+        return backing_index.BackingIndex(
+            backing_index.BackingIndexStore(self._path))
+
+    def test_refresh_cold_and_warm(self):
+        self._session.invoke_api.side_effect = [
+            mock.Mock(objects=[_backing('vm-1', 'b1', '1', 'vol-1'),
+                               _backing('vm-2', 'b2', '1', 'vol-2')]),
+            None]
+        index = self._index()
+        self.assertFalse(index.load(self._session))
+        self.assertEqual(2, index.refresh(self._session, 100))
+        self.assertEqual(0o600, os.stat(self._path).st_mode & 0o777)
+
+        # vm-2 changed, vm-1 was deleted and vm-3 is new.
+        self._session.invoke_api.reset_mock()
+        self._session.invoke_api.side_effect = [
+            mock.Mock(objects=[_backing('vm-2', 'b2', '2'),
+                               _backing('vm-3', 'b3', '1')]),
+            None,
+            mock.Mock(objects=[_backing('vm-2', 'b2', '2', 'vol-2b'),
+                               _backing('vm-3', 'b3', '1', 'vol-3')]),
+            None]
+        index = self._index()
+        self.assertTrue(index.load(self._session))
+        self.assertEqual(2, index.refresh(self._session, 100))
+        self.assertEqual(
+            {'vm-2': 'vol-2b', 'vm-3': 'vol-3'},
+            {r.moref_value: r.volume_id for r in index.records()})
+        self._session.invoke_api.assert_any_call(
+            vim_util, 'get_objects', self._session.vim, 'VirtualMachine',
+            100, properties_to_collect=backing_index.RECONCILE_PROPERTIES)
+
+    def test_refresh_backing_deleted_during_reconcile(self):
+        self._session.invoke_api.side_effect = [
+            mock.Mock(objects=[_backing('vm-1', 'b1', '1', 'vol-1')]), None]
+        self._index().refresh(self._session, 100)
+
+        # vm-2 is deleted after it was listed.
+        self._session.invoke_api.reset_mock()
+        self._session.invoke_api.side_effect = [
+            mock.Mock(objects=[_backing('vm-1', 'b1', '2'),
+                               _backing('vm-2', 'b2', '1')]),
+            None,
+            exceptions.ManagedObjectNotFoundException(
+                details={'obj': 'vm-2'}),
+            mock.Mock(objects=[_backing('vm-1', 'b1', '2', 'vol-1b')]),
+            None]
+        index = self._index()
+        self.assertTrue(index.load(self._session))
+        self.assertEqual(1, index.refresh(self._session, 100))
+        self.assertEqual(
+            {'vm-1': 'vol-1b'},
+            {r.moref_value: r.volume_id for r in index.records()})
+        refs = self._session.invoke_api.call_args_list[3][0][4]
+        self.assertEqual(['vm-1'], [ref.value for ref in refs])
+
+    def test_load_other_vcenter(self):
+        self._session.invoke_api.side_effect = [
+            mock.Mock(objects=[_backing('vm-1', 'b1', '1', 'vol-1')]), None]
+        self._index().refresh(self._session, 100)
+
+        self._session.vim.service_content.about.instanceUuid = 'vc-2'
+        self.assertFalse(self._index().load(self._session))
+
+
+class BackingRefCacheTest(unittest.TestCase):
+
+    def test_get(self):
+        cache = backing_index.BackingRefCache()
+        cache.add('b1', 'vm-1', instance_uuid='uuid-1', volume_id='vol-1')
+        cache.add('b2', 'vm-2', instance_uuid='vol-2', volume_id='vol-2')
+
+        ref = cache.get('b1')
+        self.assertEqual('vm-1', ref.value)
+        self.assertEqual('VirtualMachine', ref._type)
+        self.assertEqual('vm-1', cache.get_by_uuid('uuid-1').value)
+        self.assertEqual('vm-1', cache.get_by_volume_id('vol-1').value)
+        self.assertEqual('vm-2', cache.get_by_uuid('vol-2').value)
+        # Volume IDs do not answer instance UUID lookups.
+        self.assertIsNone(cache.get_by_uuid('vol-1'))
+        self.assertIsNone(cache.get('b3'))
+
+        cache.remove('vm-1')
+        self.assertEqual(1, len(cache))
+        self.assertIsNone(cache.get('b1'))
+        self.assertIsNone(cache.get_by_volume_id('vol-1'))
+
+    def test_get_by_shared_volume_id(self):
+        cache = backing_index.BackingRefCache()
+        cache.add('b1', 'vm-1', instance_uuid='vol-1', volume_id='vol-1')
+        cache.add('c1', 'vm-2', instance_uuid='uuid-2', volume_id='vol-1')
+
+        self.assertEqual('vm-1', cache.get_by_uuid('vol-1').value)
+        self.assertIsNone(cache.get_by_volume_id('vol-1'))
+        cache.remove('vm-1')
+        self.assertEqual('vm-2', cache.get_by_volume_id('vol-1').value)
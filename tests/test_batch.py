@@ -0,0 +1,85 @@
+"""Tests for `vmwaretool.batch`."""
+
+import threading
+import time
+import unittest
+from unittest import mock
+
+from vmwaretool import batch
+
+
+class BatchExecutorTest(unittest.TestCase):
+
+    def test_run(self):
+        lock = threading.Lock()
+        in_flight = {}
+        max_in_flight = {}
+
+        def delete_backing(backing):
+            host = 'host-%d' % (backing % 2)
+            with lock:
+                in_flight[host] = in_flight.get(host, 0) + 1
+                max_in_flight[host] = max(max_in_flight.get(host, 0),
+                                          in_flight[host])
+            time.sleep(0.01)
+            with lock:
+                in_flight[host] -= 1
+            if backing == 3:
+                raise ValueError(backing)
+            return backing
+
+        vops = mock.Mock(delete_backing=delete_backing)
+        operations = [batch.BatchOperation('delete_backing', (i,),
+                                           host='host-%d' % (i % 2))
+                      for i in range(10)]
+
+        results, stats = batch.BatchExecutor(
+            vops, max_workers=4, per_host_limit=1).run(operations)
+
+        self.assertEqual({'host-0': 1, 'host-1': 1}, max_in_flight)
+        self.assertEqual([0, 1, 2, None, 4, 5, 6, 7, 8, 9],
+                         [r.result for r in results])
+        self.assertIsInstance(results[3].error, ValueError)
+        self.assertEqual(10, stats.count)
+        self.assertEqual(1, stats.failed)
+        self.assertGreater(stats.ops_per_second, 0)
+        self.assertLessEqual(stats.p50, stats.p95)
+
+    def test_run_generator(self):
+        first_done = threading.Event()
+        taken = []
+
+        def delete_backing(backing):
+            if backing == 0:
+                first_done.set()
+            return backing
+
+        def operations():
+            for i in range(5):
+                if i == 1:
+                    # The first operation runs while later ones are
+                    # still being produced.
+                    self.assertTrue(first_done.wait(5))
+                taken.append(i)
+                yield batch.BatchOperation('delete_backing', (i,),
+                                           host='host-1')
+
+        vops = mock.Mock(delete_backing=delete_backing)
+        results, stats = batch.BatchExecutor(
+            vops, max_workers=2, per_host_limit=1).run(operations())
+
+        self.assertEqual(list(range(5)), [r.result for r in results])
+        self.assertEqual(list(range(5)), taken)
+        self.assertEqual(5, stats.count)
+
+    def test_run_empty(self):
+        results, stats = batch.BatchExecutor(mock.Mock()).run(iter([]))
+
+        self.assertEqual([], results)
+        self.assertEqual(0, stats.count)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(50, batch._percentile(values, 50))
+        self.assertEqual(95, batch._percentile(values, 95))
+        self.assertEqual(0.0, batch._percentile([], 95))
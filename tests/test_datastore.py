@@ -0,0 +1,487 @@
+"""Tests for `vmwaretool.datastore`."""
+
+import threading
+import time
+import unittest
+from unittest import mock
+
+from oslo_vmware import exceptions
+from oslo_vmware import vim_util
+
+from vmwaretool import datastore
+from vmwaretool import exceptions as vmdk_exceptions
+from vmwaretool import volumeops
+
+
+def _profile(name, unique_id):
+    profile = mock.Mock(profileId=mock.Mock(uniqueId=unique_id))
+    profile.name = name
+    return profile
+
+
+def _change(name, val, op='assign'):
+    change = mock.Mock(op=op, val=val)
+    change.name = name
+    return change
+
+
+def _update_set(version, *obj_updates, truncated=False):
+    return mock.Mock(version=version, truncated=truncated,
+                     filterSet=[mock.Mock(objectSet=list(obj_updates))])
+
+
+def _obj_update(value, kind, *changes):
+    return mock.Mock(obj=vim_util.get_moref(value, 'Datastore'), kind=kind,
+                     changeSet=list(changes))
+
+
+class DatastoreMirrorTest(unittest.TestCase):
+
+    def setUp(self):
+        self._session = mock.Mock()
+        self._updates = []
+        self._session.invoke_api.side_effect = self._invoke_api
+        self._mirror = datastore.DatastoreMirror(self._session, 100,
+                                                 wait_seconds=0,
+                                                 retry_interval=0)
+        self.addCleanup(self._mirror.stop)
+
+    def _invoke_api(self, module, method, *args, **kwargs):
+        if method == 'WaitForUpdatesEx':
+            if not self._updates:
+                return None
+            update = self._updates.pop(0)
+            if isinstance(update, Exception):
+                raise update
+            return update
+        if method == 'get_object_properties_dict':
+            return {'summary': 'summary-refetched',
+                    'host': mock.Mock(DatastoreHostMount=['mount-3'])}
+        return mock.Mock()
+
+    def _initial_updates(self):
+        return [_update_set('1',
+                            _obj_update('ds-1', 'enter',
+                                        _change('summary', 'summary-1'),
+                                        _change('host', mock.Mock(
+                                            DatastoreHostMount=['mount-1']))),
+                            truncated=True),
+                _update_set('2',
+                            _obj_update('ds-2', 'enter',
+                                        _change('summary', 'summary-2')))]
+
+    def _summaries(self):
+        return {ds_ref.value: props.get('summary') for ds_ref, props in
+                self._mirror.get_datastores().items()}
+
+    def test_fill(self):
+        self._updates = self._initial_updates()
+        self._mirror._fill()
+
+        self.assertTrue(self._mirror.is_ready())
+        self.assertEqual('2', self._mirror.version)
+        self.assertEqual({'ds-1': 'summary-1', 'ds-2': 'summary-2'},
+                         self._summaries())
+        host_mounts = [props['host'] for ds_ref, props in
+                       self._mirror.get_datastores().items()
+                       if ds_ref.value == 'ds-1'][0]
+        self.assertEqual(['mount-1'], host_mounts)
+
+    def test_apply_update_set(self):
+        self._updates = self._initial_updates()
+        self._mirror._fill()
+
+        self._mirror._apply_update_set(_update_set(
+            '3',
+            _obj_update('ds-1', 'modify', _change('summary', 'summary-1b')),
+            _obj_update('ds-2', 'leave'),
+            # Nested changes cannot be applied and are refetched instead.
+            _obj_update('ds-3', 'enter',
+                        _change('summary.freeSpace', 10))))
+
+        self.assertEqual({'ds-1': 'summary-1b', 'ds-3': 'summary-refetched'},
+                         self._summaries())
+
+    def test_refill_after_error(self):
+        self._updates = self._initial_updates()
+        self._mirror.start()
+        # Errors other than VIM faults must not end the update thread.
+        self._updates = [ValueError('malformed update'),
+                         _update_set('5',
+                                     _obj_update('ds-4', 'enter',
+                                                 _change('summary',
+                                                         'summary-4')))]
+
+        for _ in range(500):
+            if self._mirror.version == '5':
+                break
+            time.sleep(0.01)
+        self.assertEqual({'ds-4': 'summary-4'}, self._summaries())
+        self.assertTrue(self._mirror._thread.is_alive())
+
+    def test_stop_cancels_wait(self):
+        self._updates = self._initial_updates()
+        self._mirror.start()
+
+        self._mirror.stop()
+
+        methods = [c[0][1] for c in self._session.invoke_api.call_args_list]
+        self.assertIn('CancelWaitForUpdates', methods)
+        self.assertEqual('DestroyPropertyCollector', methods[-1])
+
+    @mock.patch.object(datastore.retrieval, 'retrieve_objects')
+    def test_selector_ignores_stale_mirror(self, retrieve_objects):
+        retrieve_objects.return_value = []
+        mirror = mock.Mock(staleness=5)
+        mirror.is_ready.return_value = True
+        selector = datastore.DatastoreSelector(
+            mock.Mock(), self._session, 100, mirror=mirror,
+            mirror_max_staleness=60)
+
+        self.assertIs(mirror.get_datastores.return_value,
+                      selector._get_datastores())
+        mirror.staleness = 61
+        self.assertEqual({}, selector._get_datastores())
+        retrieve_objects.assert_called_once()
+
+
+class DatastoreSelectorProfileTest(unittest.TestCase):
+
+    def setUp(self):
+        self._session = mock.Mock()
+        self._selector = datastore.DatastoreSelector(
+            mock.Mock(), self._session, 100)
+
+    @mock.patch.object(datastore.pbm, 'get_all_profiles')
+    def test_get_profile_id(self, get_all_profiles):
+        get_all_profiles.return_value = [_profile('gold', 'id-1'),
+                                         _profile('silver', 'id-2')]
+
+        self.assertEqual('id-1',
+                         self._selector.get_profile_id('gold').uniqueId)
+        self.assertEqual('id-2',
+                         self._selector.get_profile_id('silver').uniqueId)
+        get_all_profiles.assert_called_once_with(self._session)
+
+    @mock.patch.object(datastore.pbm, 'get_all_profiles')
+    def test_get_profile_id_missing_is_cached(self, get_all_profiles):
+        get_all_profiles.return_value = [_profile('gold', 'id-1')]
+
+        for _ in range(3):
+            self.assertRaises(vmdk_exceptions.ProfileNotFoundException,
+                              self._selector.get_profile_id, 'bronze')
+        get_all_profiles.assert_called_once_with(self._session)
+
+    @mock.patch.object(datastore.pbm, 'filter_hubs_by_profile')
+    @mock.patch.object(datastore.pbm, 'convert_datastores_to_hubs')
+    def test_compliance_cache(self, convert, filter_hubs):
+        convert.side_effect = lambda cf, dss: [mock.Mock(hubId=ds.value)
+                                               for ds in dss]
+        filter_hubs.side_effect = lambda session, hubs, profile_id: [
+            hub for hub in hubs if hub.hubId != 'ds-1']
+        cache = datastore.ProfileComplianceCache(self._session)
+        selector = datastore.DatastoreSelector(
+            mock.Mock(), self._session, 100, compliance_cache=cache)
+        profile_id = mock.Mock(uniqueId='id-1')
+        ds_refs = [vim_util.get_moref('ds-%d' % i, 'Datastore')
+                   for i in range(3)]
+
+        for _ in range(2):
+            filtered = selector._filter_by_profile(
+                {ds_ref: None for ds_ref in ds_refs}, profile_id)
+            self.assertEqual(['ds-0', 'ds-2'],
+                             sorted(ds_ref.value for ds_ref in filtered))
+        self.assertEqual(1, filter_hubs.call_count)
+        self.assertEqual(1, cache.get_stats()['hits'])
+
+        cache.invalidate(profile_id)
+        selector._filter_by_profile({ds_refs[0]: None}, profile_id)
+        self.assertEqual(2, filter_hubs.call_count)
+
+
+class ProfileComplianceCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._session = mock.Mock()
+        self._cache = datastore.ProfileComplianceCache(self._session,
+                                                       refresh_interval=0)
+        self._profile_id = mock.Mock(uniqueId='id-1')
+        self._ds_refs = [vim_util.get_moref('ds-%d' % i, 'Datastore')
+                         for i in range(3)]
+
+    @mock.patch.object(datastore.ProfileComplianceCache, '_query')
+    def test_refresh(self, query):
+        query.return_value = {'ds-0'}
+        self._cache.get_compliant_datastores(self._ds_refs[:2],
+                                             self._profile_id)
+
+        query.return_value = {'ds-1'}
+        self._cache.refresh()
+
+        self.assertEqual(
+            {'ds-1'},
+            self._cache.get_compliant_datastores(self._ds_refs[:2],
+                                                 self._profile_id))
+        self.assertEqual(1, self._cache.get_stats()['refreshes'])
+
+    @mock.patch.object(datastore.ProfileComplianceCache, '_query')
+    def test_refresh_keeps_concurrently_added_datastores(self, query):
+        query.return_value = {'ds-0'}
+        self._cache.get_compliant_datastores(self._ds_refs[:1],
+                                             self._profile_id)
+
+        def _query(datastores, profile_id):
+            # A caller checks another datastore while the refresh queries.
+            query.side_effect = lambda dss, pid: {'ds-2'}
+            self._cache.get_compliant_datastores(self._ds_refs[2:],
+                                                 self._profile_id)
+            return {ds.value for ds in datastores}
+
+        query.side_effect = _query
+        self._cache.refresh()
+
+        query.reset_mock()
+        self.assertEqual(
+            {'ds-0', 'ds-2'},
+            self._cache.get_compliant_datastores(
+                [self._ds_refs[0], self._ds_refs[2]], self._profile_id))
+        query.assert_not_called()
+
+    @mock.patch.object(datastore.ProfileComplianceCache, '_query')
+    def test_refresh_after_invalidate(self, query):
+        query.return_value = {'ds-0'}
+        self._cache.get_compliant_datastores(self._ds_refs[:1],
+                                             self._profile_id)
+
+        def _query(datastores, profile_id):
+            self._cache.invalidate(self._profile_id)
+            return {'ds-0'}
+
+        query.side_effect = _query
+        self._cache.refresh()
+
+        self.assertEqual(0, self._cache.get_stats()['profiles'])
+
+    @mock.patch.object(datastore.ProfileComplianceCache, 'refresh')
+    def test_refresh_thread_survives_errors(self, refresh):
+        refreshed = threading.Event()
+        errors = [ValueError(), exceptions.VimException('error')]
+
+        def _refresh():
+            if errors:
+                raise errors.pop(0)
+            refreshed.set()
+
+        refresh.side_effect = _refresh
+        cache = datastore.ProfileComplianceCache(self._session,
+                                                 refresh_interval=0.01)
+        cache.start()
+        self.addCleanup(cache.stop)
+
+        self.assertTrue(refreshed.wait(5))
+        self.assertEqual([], errors)
+
+    def test_refresh_enabled_by_default(self):
+        cache = datastore.ProfileComplianceCache(self._session)
+        cache.start()
+        self.addCleanup(cache.stop)
+
+        self.assertIsNotNone(cache._thread)
+
+    @mock.patch.object(datastore.ProfileComplianceCache, '_query')
+    def test_refresh_started_on_first_lookup(self, query):
+        query.return_value = set()
+        cache = datastore.ProfileComplianceCache(self._session)
+        self.addCleanup(cache.stop)
+        self.assertIsNone(cache._thread)
+
+        cache.get_compliant_datastores(self._ds_refs, self._profile_id)
+
+        self.assertTrue(cache._thread.is_alive())
+
+    @mock.patch.object(datastore.ProfileComplianceCache, '_query')
+    def test_refresh_not_restarted_after_stop(self, query):
+        query.return_value = set()
+        cache = datastore.ProfileComplianceCache(self._session)
+        cache.get_compliant_datastores(self._ds_refs[:1], self._profile_id)
+        thread = cache._thread
+
+        selector = datastore.DatastoreSelector(
+            mock.Mock(), self._session, 10, compliance_cache=cache)
+        selector.close()
+        cache.get_compliant_datastores(self._ds_refs[1:], self._profile_id)
+
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(cache._thread)
+
+
+class DatastoreSelectorRoundTripTest(unittest.TestCase):
+
+    def _host_mount(self, host):
+        mount_info = mock.Mock(accessMode='readWrite', mounted=True,
+                               accessible=True)
+        return mock.Mock(key=vim_util.get_moref(host, 'HostSystem'),
+                         mountInfo=mount_info)
+
+    def _host_content(self, host):
+        runtime = mock.Mock(connectionState='connected',
+                            inMaintenanceMode=False)
+        return mock.Mock(obj=vim_util.get_moref(host, 'HostSystem'),
+                         propSet=[_change('runtime', runtime),
+                                  _change('parent', 'cluster-1')])
+
+    def test_select_datastore_round_trips(self):
+        summary = mock.Mock(capacity=100, freeSpace=50, type='vmfs',
+                            accessible=True, maintenanceMode='normal')
+        summary.name = 'ds1'
+        datastores = {vim_util.get_moref('ds-1', 'Datastore'): {
+            'summary': summary,
+            'host': [self._host_mount('host-%d' % i) for i in range(3)]}}
+        session = mock.Mock()
+
+        def invoke_api(module, method, *args, **kwargs):
+            if method == 'get_properties_for_a_collection_of_objects':
+                return mock.Mock(objects=[self._host_content('host-%d' % i)
+                                          for i in range(3)],
+                                 token=None)
+            return 'rp'
+
+        session.invoke_api.side_effect = invoke_api
+        selector = datastore.DatastoreSelector(
+            volumeops.VMwareVolumeOps(session, 100, None, None), session,
+            100)
+        selector._get_datastores = mock.Mock(return_value=datastores)
+
+        with mock.patch.object(datastore, 'LOG') as log:
+            host, rp, selected = selector.select_datastore({'sizeBytes': 0})
+
+        self.assertEqual('rp', rp)
+        self.assertIs(summary, selected)
+        # All candidate hosts are fetched with one call, plus one call for
+        # the resource pool.
+        self.assertEqual(
+            ['get_properties_for_a_collection_of_objects',
+             'get_object_property'],
+            [c[0][1] for c in session.invoke_api.call_args_list])
+        self.assertEqual(2, log.debug.call_args_list[-1][0][1]['round_trips'])
+        self.assertIsNone(selector._local.round_trips)
+
+
+@unittest.skipIf(datastore.np is None, "NumPy is not installed")
+class DatastorePlacementEngineTest(unittest.TestCase):
+
+    def _host_mount(self, host, access_mode='readWrite'):
+        mount_info = mock.Mock(accessMode=access_mode, mounted=True,
+                               accessible=True)
+        return mock.Mock(key=vim_util.get_moref(host, 'HostSystem'),
+                         mountInfo=mount_info)
+
+    def _summary(self, name, capacity, free_space, ds_type='vmfs'):
+        summary = mock.Mock(capacity=capacity, freeSpace=free_space,
+                            type=ds_type, accessible=True,
+                            maintenanceMode='normal')
+        summary.name = name
+        return summary
+
+    def setUp(self):
+        self._vops = volumeops.VMwareVolumeOps(None, 100, None, None)
+        self._datastores = {
+            vim_util.get_moref('ds-1', 'Datastore'): {
+                'summary': self._summary('ds1', 100, 10),
+                'host': [self._host_mount('host-1')]},
+            vim_util.get_moref('ds-2', 'Datastore'): {
+                'summary': self._summary('ds2', 100, 50),
+                'host': [self._host_mount('host-1'),
+                         self._host_mount('host-2', 'readOnly')]},
+            vim_util.get_moref('ds-3', 'Datastore'): {
+                'summary': self._summary('ds3', 100, 90),
+                'host': [self._host_mount('host-1'),
+                         self._host_mount('host-2')]},
+            vim_util.get_moref('ds-4', 'Datastore'): {
+                'summary': self._summary('ds4', 100, 99, 'unknown'),
+                'host': [self._host_mount('host-2')]},
+        }
+        runtime = mock.Mock(connectionState='connected',
+                            inMaintenanceMode=False)
+        self._host_props = {'host-1': {'runtime': runtime, 'parent': 'c1'},
+                            'host-2': {'runtime': runtime, 'parent': 'c1'}}
+
+    def _selector(self, vectorized, with_mirror=True):
+        mirror = None
+        if with_mirror:
+            mirror = mock.Mock(version='1', staleness=0)
+            mirror.is_ready.return_value = True
+        selector = datastore.DatastoreSelector(
+            self._vops, mock.Mock(), 100, vectorized=vectorized,
+            mirror=mirror)
+        selector._get_datastores = mock.Mock(return_value=self._datastores)
+        selector._get_hosts_properties = lambda refs: {
+            ref.value: self._host_props[ref.value] for ref in refs}
+        selector._get_resource_pool = lambda cluster_ref: 'rp'
+        return selector
+
+    def _select(self, vectorized, req, hosts=None):
+        return self._selector(vectorized).select_datastore(req, hosts=hosts)
+
+    def test_rank(self):
+        engine = datastore.DatastorePlacementEngine(self._vops,
+                                                    self._datastores)
+        mask = engine.filter(20)
+        ranked = [engine.get_summary(i).name for i in engine.rank(mask)]
+        self.assertEqual(['ds3', 'ds2'], ranked)
+
+    def test_select_matches_python_path(self):
+        host_2 = vim_util.get_moref('host-2', 'HostSystem')
+        for req, hosts in [({'sizeBytes': 0}, None),
+                           ({'sizeBytes': 60}, None),
+                           ({'sizeBytes': 0}, [host_2]),
+                           ({'sizeBytes': 0,
+                             'hardAntiAffinityDatastores': ['ds-3']}, None),
+                           ({'sizeBytes': 0,
+                             'hardAffinityDatastoreTypes': ['nfs']}, None)]:
+            expected = self._select(False, req, hosts)
+            actual = self._select(True, req, hosts)
+            if expected is None:
+                self.assertIsNone(actual)
+            else:
+                # The host is picked at random among the usable ones.
+                self.assertEqual(expected[2].name, actual[2].name)
+                if hosts:
+                    self.assertIn(actual[0].value, [h.value for h in hosts])
+
+    def test_engine_reused_per_mirror_version(self):
+        selector = self._selector(True)
+        for _ in range(2):
+            self.assertEqual(
+                'ds3', selector.select_datastore({'sizeBytes': 0})[2].name)
+        selector._get_datastores.assert_called_once_with()
+
+        selector._mirror.version = '2'
+        selector.select_datastore({'sizeBytes': 0})
+        self.assertEqual(2, selector._get_datastores.call_count)
+
+    def test_python_path_without_mirror(self):
+        selector = self._selector(True, with_mirror=False)
+        selector._get_placement_engine = mock.Mock()
+
+        self.assertEqual(
+            'ds3', selector.select_datastore({'sizeBytes': 0})[2].name)
+        self.assertFalse(selector._get_placement_engine.called)
+
+    def test_select_does_not_modify_engine(self):
+        engine = datastore.DatastorePlacementEngine(self._vops,
+                                                    self._datastores)
+        ranked = engine.rank(engine.filter(0))
+        runtime = mock.Mock(connectionState='connected',
+                            inMaintenanceMode=False)
+        host_1_usable = engine.get_host_usable_mask(
+            {'host-1': {'runtime': runtime, 'parent': 'c1'}})
+        host_2_usable = engine.get_host_usable_mask(
+            {'host-2': {'runtime': runtime, 'parent': 'c1'}})
+
+        self.assertEqual(['host-1'],
+                         [ref.value for ref in
+                          engine.select(ranked, host_1_usable)[1]])
+        self.assertEqual(['host-2'],
+                         [ref.value for ref in
+                          engine.select(ranked, host_2_usable)[1]])
@@ -0,0 +1,93 @@
+"""Tests for `vmwaretool.folder_tree`."""
+
+from types import SimpleNamespace
+import unittest
+from unittest import mock
+
+from oslo_vmware import exceptions
+from oslo_vmware import vim_util
+
+from vmwaretool import folder_tree
+from vmwaretool import volumeops
+
+
+def _folder(value):
+    return vim_util.get_moref(value, 'Folder')
+
+
+def _retrieve_result(folders):
+    objects = []
+    for folder, name, parent in folders:
+        prop_set = [SimpleNamespace(name='name', val=name),
+                    SimpleNamespace(name='parent', val=parent)]
+        objects.append(SimpleNamespace(obj=folder, propSet=prop_set))
+    return SimpleNamespace(objects=objects, token=None)
+
+
+class FolderTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.vm_folder = _folder('group-v1')
+        self.openstack = _folder('group-v2')
+        self.project = _folder('group-v3')
+        self.volumes = _folder('group-v4')
+        self.folders = [(self.openstack, 'OpenStack', self.vm_folder),
+                        (self.project, 'Project (1)', self.openstack),
+                        (self.volumes, 'Volumes', self.project)]
+        self.session = mock.Mock()
+
+    def test_load(self):
+        self.session.invoke_api.return_value = _retrieve_result(self.folders)
+        tree = folder_tree.FolderTree(self.vm_folder)
+        tree.load(self.session, 100)
+
+        self.assertEqual(3, len(tree))
+        self.assertEqual(self.volumes,
+                         tree.get(['OpenStack', 'Project (1)', 'Volumes']))
+        self.assertIsNone(tree.get(['OpenStack', 'Project (2)']))
+        self.assertIs(self.vm_folder, tree.get([]))
+
+    def test_create_vm_inventory_folder(self):
+        vops = volumeops.VMwareVolumeOps(self.session, 100, None, None)
+        vops.get_vmfolder = mock.Mock(return_value=self.vm_folder)
+        datacenter = vim_util.get_moref('datacenter-1', 'Datacenter')
+        project_2 = _folder('group-v5')
+        volumes_2 = _folder('group-v6')
+
+        def invoke_api(vim, method, *args, **kwargs):
+            if method == 'RetrievePropertiesEx':
+                return _retrieve_result(self.folders)
+            self.assertEqual('CreateFolder', method)
+            return {'Project (2)': project_2,
+                    'Volumes': volumes_2}[kwargs['name']]
+
+        self.session.invoke_api.side_effect = invoke_api
+        self.assertEqual(
+            self.volumes,
+            vops.create_vm_inventory_folder(
+                datacenter, ['OpenStack', 'Project (1)', 'Volumes']))
+        self.assertEqual(1, self.session.invoke_api.call_count)
+
+        self.assertEqual(
+            volumes_2,
+            vops.create_vm_inventory_folder(
+                datacenter, ['OpenStack', 'Project (2)', 'Volumes']))
+        self.assertEqual(3, self.session.invoke_api.call_count)
+        self.assertEqual(
+            volumes_2,
+            vops.create_vm_inventory_folder(
+                datacenter, ['OpenStack', 'Project (2)', 'Volumes']))
+        self.assertEqual(3, self.session.invoke_api.call_count)
+
+    def test_create_folder_duplicate_name(self):
+        vops = volumeops.VMwareVolumeOps(self.session, 100, None, None)
+
+        def invoke_api(vim, method, *args, **kwargs):
+            if method == 'CreateFolder':
+                raise exceptions.DuplicateName()
+            return _retrieve_result(self.folders[:1])
+
+        self.session.invoke_api.side_effect = invoke_api
+        self.assertEqual(self.openstack,
+                         vops.create_folder(self.vm_folder, 'OpenStack'))
+        self.assertEqual(2, self.session.invoke_api.call_count)
@@ -0,0 +1,66 @@
+"""Tests for `vmwaretool.inventory`."""
+
+import unittest
+from unittest import mock
+
+from oslo_vmware import vim_util
+
+from vmwaretool import exceptions as vmdk_exceptions
+from vmwaretool import inventory
+
+
+def _prop(name, val):
+    prop = mock.Mock(val=val)
+    prop.name = name
+    return prop
+
+
+def _custom_field(key, name):
+    field = mock.Mock(key=key)
+    field.name = name
+    return field
+
+
+class InventorySnapshotTest(unittest.TestCase):
+
+    def _cluster_content(self, value, name, hosts):
+        host_prop = mock.Mock(ManagedObjectReference=[
+            vim_util.get_moref(h, 'HostSystem') for h in hosts])
+        available = [('CustomFieldDef', [_custom_field(101, 'owner')])]
+        custom = [('CustomFieldValue', [mock.Mock(key=101, value=name)])]
+        return mock.Mock(
+            obj=vim_util.get_moref(value, 'ClusterComputeResource'),
+            propSet=[_prop('name', name),
+                     _prop('host', host_prop),
+                     _prop('availableField', available),
+                     _prop('customValue', custom)])
+
+    def test_build_inventory_snapshot(self):
+        page1 = mock.Mock(objects=[
+            self._cluster_content('domain-c1', 'cls%201', ['host-1'])])
+        page2 = mock.Mock(objects=[
+            self._cluster_content('domain-c2', 'cls-2', ['host-2', 'host-3'])])
+        session = mock.Mock()
+        session.invoke_api.side_effect = [page1, page2, None]
+
+        snapshot = inventory.build_inventory_snapshot(session, 100)
+
+        self.assertEqual(2, len(snapshot))
+        self.assertEqual(3, session.invoke_api.call_count)
+        session.invoke_api.assert_any_call(
+            vim_util, 'get_objects', session.vim, 'ClusterComputeResource',
+            100, properties_to_collect=inventory.CLUSTER_PROPERTIES)
+
+        refs = snapshot.get_cluster_refs(['cls 1', 'cls-2'])
+        self.assertEqual('domain-c1', refs['cls 1'].value)
+        hosts = snapshot.get_cluster_hosts(refs['cls-2'])
+        self.assertEqual(['host-2', 'host-3'], [h.value for h in hosts])
+        self.assertEqual(
+            {'owner': {'value': 'cls-2', 'id': 101}},
+            snapshot.get_cluster_custom_attributes(refs['cls-2']))
+
+        self.assertRaises(vmdk_exceptions.ClusterNotFoundException,
+                          snapshot.get_cluster_refs, ['missing'])
+
+    def test_parse_custom_attributes_unset(self):
+        self.assertIsNone(inventory.parse_custom_attributes(None, []))
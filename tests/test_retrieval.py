@@ -0,0 +1,119 @@
+"""Tests for `vmwaretool.retrieval`."""
+
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from oslo_vmware import vim_util
+
+from vmwaretool import retrieval
+
+
+def _page(token, *objects):
+    return mock.Mock(token=token, objects=list(objects))
+
+
+class IterPagesTest(unittest.TestCase):
+
+    def setUp(self):
+        self._session = mock.Mock()
+
+    def test_iter_objects(self):
+        pages = {'t1': _page('t2', 3, 4), 't2': _page(None, 5)}
+        self._session.invoke_api.side_effect = (
+            lambda module, method, vim, result: pages.get(result.token))
+
+        objects = list(retrieval.iter_objects(self._session,
+                                              _page('t1', 1, 2)))
+        self.assertEqual([1, 2, 3, 4, 5], objects)
+
+    def test_single_page(self):
+        pages = list(retrieval.iter_pages(self._session, _page(None, 1)))
+        self.assertEqual(1, len(pages))
+        self.assertFalse(self._session.invoke_api.called)
+
+    def test_error(self):
+        self._session.invoke_api.side_effect = ValueError
+
+        iterator = retrieval.iter_objects(self._session, _page('t1', 1))
+        self.assertEqual(1, next(iterator))
+        self.assertRaises(ValueError, next, iterator)
+
+    def test_close_cancels_retrieval(self):
+        cancelled = threading.Event()
+
+        def invoke_api(module, method, vim, result):
+            if method == 'cancel_retrieval':
+                cancelled.set()
+                return
+            return _page('t', 0)
+
+        self._session.invoke_api.side_effect = invoke_api
+        iterator = retrieval.iter_pages(self._session, _page('t', 0),
+                                        read_ahead=1)
+        next(iterator)
+        iterator.close()
+
+        self.assertTrue(cancelled.wait(5))
+        self._session.invoke_api.assert_called_with(
+            vim_util, 'cancel_retrieval', self._session.vim, mock.ANY)
+
+
+class PageSizerTest(unittest.TestCase):
+
+    def test_record(self):
+        sizer = retrieval.PageSizer(100, 10, 1000, target_seconds=1.0)
+        props = ['name']
+
+        # 1 ms per object: grows, by at most a factor of 2 per page.
+        sizer.record('VirtualMachine', props, 100, 0.1)
+        self.assertEqual(200, sizer.get_size('VirtualMachine', props))
+        for _ in range(5):
+            sizer.record('VirtualMachine', props, 100, 0.1)
+        self.assertEqual(1000, sizer.get_size('VirtualMachine', props))
+
+        # 50 ms per object for heavy properties.
+        heavy = ['config.hardware.device']
+        for _ in range(5):
+            sizer.record('VirtualMachine', heavy, 100, 5)
+        self.assertEqual(20, sizer.get_size('VirtualMachine', heavy))
+        self.assertEqual(100, sizer.get_size('Datastore', props))
+
+    def test_persist_sizes(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        path = os.path.join(tmp_dir.name, 'sizes', 'page_sizes.json')
+        sizer = retrieval.PageSizer(100, 10, 1000, path=path)
+
+        sizer.record('VirtualMachine', ['name', 'config'], 100, 0.1)
+
+        sizer = retrieval.PageSizer(100, 10, 150, path=path)
+        self.assertEqual(150,
+                         sizer.get_size('VirtualMachine', ['config', 'name']))
+        self.assertEqual(100, sizer.get_size('Datastore', ['name']))
+
+    def test_corrupt_sizes_file(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        path = os.path.join(tmp_dir.name, 'page_sizes.json')
+        with open(path, 'w') as sizes_file:
+            sizes_file.write('{')
+
+        sizer = retrieval.PageSizer(100, 10, 1000, path=path)
+
+        self.assertEqual({}, sizer.get_sizes())
+
+    def test_retrieve_pages(self):
+        session = mock.Mock()
+        session.invoke_api.return_value = _page(None, 1, 2)
+        sizer = retrieval.PageSizer(100, 10, 1000)
+
+        pages = list(retrieval.retrieve_pages(session, 'Datastore', 50,
+                                              ['summary'], page_sizer=sizer))
+
+        self.assertEqual(1, len(pages))
+        session.invoke_api.assert_called_once_with(
+            vim_util, 'get_objects', session.vim, 'Datastore', 100,
+            properties_to_collect=['summary'])
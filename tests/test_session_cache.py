@@ -0,0 +1,92 @@
+"""Tests for `vmwaretool.session_cache`."""
+
+import os
+import stat
+import tempfile
+import unittest
+from unittest import mock
+
+from oslo_vmware import exceptions
+
+from vmwaretool import session_cache
+
+
+class SessionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        super(SessionCacheTest, self).setUp()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = os.path.join(tmp_dir.name, 'config', 'sessions.json')
+        self.cache = session_cache.SessionCache(self.path)
+
+    def test_set_and_get(self):
+        self.assertIsNone(self.cache.get('vc', 443, 'admin'))
+        self.cache.set('vc', 443, 'admin', 'cookie', 'key', 'VSPHERE\\admin')
+
+        entry = self.cache.get('vc', 443, 'admin')
+        self.assertEqual('cookie', entry['cookie'])
+        self.assertEqual('key', entry['session_id'])
+        self.assertIsNone(self.cache.get('vc', 443, 'other'))
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(self.path).st_mode))
+        self.assertEqual(
+            0o700, stat.S_IMODE(os.stat(os.path.dirname(self.path)).st_mode))
+
+        self.cache.remove('vc', 443, 'admin')
+        self.assertIsNone(self.cache.get('vc', 443, 'admin'))
+
+    def test_get_ignores_readable_file(self):
+        self.cache.set('vc', 443, 'admin', 'cookie', 'key', 'admin')
+        os.chmod(self.path, 0o644)
+        self.assertIsNone(self.cache.get('vc', 443, 'admin'))
+
+    def _create_session(self, cookie=None):
+        session = mock.Mock(_session_id=None, _session_username=None)
+        session.vim.get_http_cookie.return_value = cookie
+
+        def _login():
+            session._session_id = 'new-key'
+            session._session_username = 'admin'
+
+        session._create_session.side_effect = _login
+        return session
+
+    @mock.patch.object(session_cache, '_get_current_session')
+    def test_login_with_valid_session(self, get_current_session):
+        self.cache.set('vc', 443, 'admin', 'cookie', 'key', 'admin')
+        get_current_session.return_value = mock.Mock(key='key',
+                                                     userName='admin')
+        session = self._create_session()
+
+        self.assertTrue(session_cache.login(session, self.cache, 'vc', 443,
+                                            'admin'))
+        session.vim.client.cookiejar.set.assert_called_once_with(
+            session_cache.SESSION_COOKIE, 'cookie', domain='vc', path='/')
+        self.assertFalse(session._create_session.called)
+        self.assertEqual('key', session._session_id)
+
+    @mock.patch.object(session_cache, '_get_current_session')
+    def test_login_with_expired_session(self, get_current_session):
+        self.cache.set('vc', 443, 'admin', 'cookie', 'key', 'admin')
+        get_current_session.side_effect = exceptions.VimFaultException(
+            ['NotAuthenticated'], 'not authenticated')
+        session = self._create_session(cookie='new-cookie')
+
+        self.assertFalse(session_cache.login(session, self.cache, 'vc', 443,
+                                             'admin'))
+        session.vim.client.cookiejar.clear.assert_called_once_with()
+        session._create_session.assert_called_once_with()
+        entry = self.cache.get('vc', 443, 'admin')
+        self.assertEqual('new-cookie', entry['cookie'])
+        self.assertEqual('new-key', entry['session_id'])
+
+    @mock.patch.object(session_cache, '_get_current_session')
+    def test_login_without_cached_session(self, get_current_session):
+        session = self._create_session(cookie='new-cookie')
+
+        self.assertFalse(session_cache.login(session, self.cache, 'vc', 443,
+                                             'admin'))
+        self.assertFalse(get_current_session.called)
+        session._create_session.assert_called_once_with()
+        self.assertEqual('new-cookie',
+                         self.cache.get('vc', 443, 'admin')['cookie'])
@@ -0,0 +1,158 @@
+"""Tests for `vmwaretool.sessions`."""
+
+import threading
+import unittest
+from unittest import mock
+
+from oslo_vmware import exceptions
+
+from vmwaretool import sessions
+
+
+class SessionPoolTest(unittest.TestCase):
+
+    def test_acquire(self):
+        create_session = mock.Mock(side_effect=lambda: mock.Mock())
+        pool = sessions.SessionPool(create_session, 2)
+
+        first = pool.acquire()
+        second = pool.acquire()
+        self.assertEqual(2, len(pool))
+        self.assertIsNot(first.session, second.session)
+
+        acquired = []
+        thread = threading.Thread(
+            target=lambda: acquired.append(pool.acquire()))
+        thread.start()
+        pool._release(first)
+        thread.join(5)
+        self.assertIs(first, acquired[0])
+        self.assertEqual(2, create_session.call_count)
+
+    def test_acquire_logs_in_without_lock(self):
+        logging_in = threading.Event()
+        login_done = threading.Event()
+
+        def create_session():
+            if create_session.calls:
+                logging_in.set()
+                login_done.wait(5)
+            create_session.calls += 1
+            return mock.Mock()
+
+        create_session.calls = 0
+        pool = sessions.SessionPool(create_session, 2)
+        first = pool.acquire()
+        pool._release(first)
+
+        thread = threading.Thread(target=pool.acquire)
+        pooled = pool.acquire()
+        thread.start()
+        self.assertTrue(logging_in.wait(5))
+        # The idle session can be borrowed while the second one logs in.
+        pool._release(pooled)
+        self.assertIs(pooled, pool.acquire())
+        login_done.set()
+        thread.join(5)
+        self.assertEqual(2, len(pool))
+
+    def test_acquire_login_error(self):
+        create_session = mock.Mock(side_effect=[mock.Mock(), ValueError()])
+        pool = sessions.SessionPool(create_session, 2)
+        first = pool.acquire()
+
+        self.assertRaises(ValueError, pool.acquire)
+        self.assertEqual(1, len(pool))
+
+        create_session.side_effect = lambda: mock.Mock()
+        self.assertIsNot(first, pool.acquire())
+        self.assertEqual(2, len(pool))
+
+    def test_relogin_idle_session(self):
+        pool = sessions.SessionPool(mock.Mock, 1, max_idle=10)
+        pooled = pool.acquire()
+        pooled.last_used -= 20
+        pool._release(pooled)
+        pooled.last_used -= 20
+
+        pool.acquire()
+        pooled.session.logout.assert_called_once_with()
+        pooled.session._create_session.assert_called_once_with()
+
+
+class PooledSessionTest(unittest.TestCase):
+
+    def test_invoke_api(self):
+        pool = sessions.SessionPool(mock.Mock, 2)
+        session = sessions.PooledSession(pool)
+        primary = pool.acquire()
+        other = pool.acquire()
+        pool._release(primary)
+        pool._release(other)
+        primary = primary.session
+        other = other.session
+        primary.invoke_api.return_value = mock.Mock(token='token-1')
+
+        result = session.invoke_api('module', 'get_objects', session.vim)
+        self.assertEqual('token-1', result.token)
+
+        # Continued on the session which started the retrieval although
+        # the other session is idle first.
+        session.invoke_api('module', 'continue_retrieval', session.vim,
+                           result)
+        primary.invoke_api.assert_called_with(
+            'module', 'continue_retrieval', primary.vim, result)
+        self.assertFalse(other.invoke_api.called)
+
+        session.invoke_api('module', 'get_objects', session.vim)
+        other.invoke_api.assert_called_once_with('module', 'get_objects',
+                                                 other.vim)
+
+    @mock.patch.object(sessions.time, 'monotonic')
+    def test_forget_tokens(self, monotonic):
+        monotonic.return_value = 100
+        pool = sessions.SessionPool(mock.Mock, 1)
+        session = sessions.PooledSession(pool, token_ttl=60)
+        primary = pool.acquire()
+        pool._release(primary)
+        primary.session.invoke_api.side_effect = [
+            mock.Mock(token='token-1'), mock.Mock(token='token-2')]
+
+        session.invoke_api('module', 'get_objects', session.vim)
+        self.assertEqual(['token-1'], list(session._token_sessions))
+
+        monotonic.return_value = 200
+        session.invoke_api('module', 'get_objects', session.vim)
+        self.assertEqual(['token-2'], list(session._token_sessions))
+
+    def test_wait_for_task_releases_session_between_polls(self):
+        pool = sessions.SessionPool(mock.Mock, 1)
+        session = sessions.PooledSession(pool, task_poll_interval=0)
+        primary = pool.acquire()
+        pool._release(primary)
+        primary.session.invoke_api.side_effect = [
+            mock.Mock(state='running'), mock.Mock(state='running'),
+            mock.Mock(state='success')]
+        idle_while_sleeping = []
+
+        def sleep(seconds):
+            # Other callers can borrow the only session between polls.
+            idle_while_sleeping.append(len(pool._idle))
+
+        with mock.patch.object(sessions.time, 'sleep', side_effect=sleep):
+            self.assertEqual('success',
+                             session.wait_for_task('task-1').state)
+        self.assertEqual([1, 1], idle_while_sleeping)
+        self.assertEqual(3, primary.session.invoke_api.call_count)
+
+    def test_wait_for_task_error(self):
+        pool = sessions.SessionPool(mock.Mock, 1)
+        session = sessions.PooledSession(pool, task_poll_interval=0)
+        primary = pool.acquire()
+        pool._release(primary)
+        primary.session.invoke_api.return_value = mock.Mock(
+            state='error', error=mock.Mock(localizedMessage='failed',
+                                           fault=None))
+
+        self.assertRaises(exceptions.VimException,
+                          session.wait_for_task, 'task-1')
@@ -0,0 +1,45 @@
+"""Tests for `vmwaretool.snapshot_index`."""
+
+from types import SimpleNamespace
+import unittest
+
+from vmwaretool import snapshot_index
+
+
+def _tree(name, *children):
+    tree = SimpleNamespace(name=name, snapshot='snapshot-%s' % name,
+                           createTime=None)
+    if children:
+        tree.childSnapshotList = list(children)
+    return tree
+
+
+class SnapshotIndexTest(unittest.TestCase):
+
+    def test_index(self):
+        snapshot_info = SimpleNamespace(rootSnapshotList=[
+            _tree('a', _tree('b', _tree('c')), _tree('d')),
+            _tree('e', _tree('c'))])
+        index = snapshot_index.SnapshotIndex(snapshot_info)
+
+        self.assertEqual(6, len(index))
+        self.assertEqual(['a', 'b', 'c', 'd', 'e', 'c'],
+                         [node.name for node in index])
+        self.assertEqual(['a', 'e'], [node.name for node in index.roots])
+        self.assertEqual(3, index.max_depth)
+        # Snapshots under other roots than the first are found too.
+        self.assertEqual('snapshot-e', index.get('e'))
+        self.assertIsNone(index.get('f'))
+
+        node = index.get_node('c')
+        self.assertEqual(3, node.depth)
+        self.assertEqual('b', node.parent.name)
+        self.assertEqual(['b', 'd'], [child.name for child in
+                                      index.get_node('a').children])
+
+    def test_index_without_snapshots(self):
+        for snapshot_info in (None, SimpleNamespace(rootSnapshotList=None)):
+            index = snapshot_index.SnapshotIndex(snapshot_info)
+            self.assertEqual(0, len(index))
+            self.assertEqual(0, index.max_depth)
+            self.assertNotIn('a', index)
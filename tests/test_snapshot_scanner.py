@@ -0,0 +1,104 @@
+"""Tests for `vmwaretool.snapshot_scanner`."""
+
+import datetime
+from types import SimpleNamespace
+import unittest
+from unittest import mock
+
+from oslo_vmware import vim_util
+
+from vmwaretool import snapshot_scanner
+from vmwaretool import volumeops
+
+
+NOW = datetime.datetime(2024, 6, 1, tzinfo=datetime.timezone.utc)
+
+
+def _tree(name, days_old, *children):
+    tree = SimpleNamespace(name=name, snapshot='snapshot-%s' % name,
+                           createTime=NOW - datetime.timedelta(days=days_old))
+    if children:
+        tree.childSnapshotList = list(children)
+    return tree
+
+
+def _vm(value, host, *roots):
+    prop_set = [SimpleNamespace(name='name', val=value),
+                SimpleNamespace(name='runtime.host',
+                                val=vim_util.get_moref(host, 'HostSystem'))]
+    if roots:
+        prop_set.append(SimpleNamespace(
+            name='snapshot',
+            val=SimpleNamespace(rootSnapshotList=list(roots))))
+    return SimpleNamespace(obj=vim_util.get_moref(value, 'VirtualMachine'),
+                           propSet=prop_set)
+
+
+class ScanStaleSnapshotsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = mock.Mock()
+        self.session.invoke_api.return_value = SimpleNamespace(
+            objects=[
+                _vm('vm-1', 'host-1',
+                    _tree('a', 30, _tree('b', 20, _tree('c', 1)))),
+                _vm('vm-2', 'host-1'),
+                _vm('vm-3', 'host-2', _tree('d', 1), _tree('d', 40))],
+            token=None)
+
+    def _scan(self, **kwargs):
+        return list(snapshot_scanner.scan_stale_snapshots(
+            self.session, 100, now=NOW, **kwargs))
+
+    def test_scan(self):
+        stale = self._scan(max_age=7 * 24 * 3600, max_depth=2)
+
+        self.assertEqual([('vm-1', 'a', ['age'], True),
+                          ('vm-1', 'b', ['age'], True),
+                          ('vm-1', 'c', ['depth'], True),
+                          ('vm-3', 'd', ['age'], False)],
+                         [(s.backing_name, s.name, s.reasons, s.deletable)
+                          for s in stale])
+        self.assertEqual(3, stale[2].depth)
+        self.assertEqual('host-2', stale[3].host.value)
+        self.session.invoke_api.assert_called_once_with(
+            vim_util, 'get_objects', self.session.vim, 'VirtualMachine', 100,
+            properties_to_collect=snapshot_scanner.SCAN_PROPERTIES)
+
+    def test_scan_without_criteria(self):
+        self.assertRaises(ValueError, self._scan)
+
+    def test_delete_stale_snapshots(self):
+        vops = volumeops.VMwareVolumeOps(self.session, 100, None, None)
+        vops.delete_snapshot = mock.Mock()
+
+        results, stats = vops.delete_stale_snapshots(
+            self._scan(max_age=7 * 24 * 3600, max_depth=2))
+
+        # One operation per VM; the ambiguous snapshot of vm-3 is skipped.
+        self.assertEqual(1, stats.count)
+        self.assertEqual('host-1', results[0].operation.host)
+        self.assertEqual(
+            [mock.call(results[0].operation.args[0], name)
+             for name in ['c', 'b', 'a']],
+            vops.delete_snapshot.call_args_list)
+
+    def test_iter_delete_operations(self):
+        stale = self._scan(max_age=7 * 24 * 3600, max_depth=2)
+        consumed = []
+
+        def _stale_snapshots():
+            for snapshot in stale:
+                consumed.append(snapshot.name)
+                yield snapshot
+
+        operations = snapshot_scanner.iter_delete_operations(
+            _stale_snapshots())
+
+        # The operation of vm-1 is yielded once the scan reaches vm-3.
+        operation = next(operations)
+        self.assertEqual(['a', 'b', 'c', 'd'], consumed)
+        self.assertEqual('vm-1', operation.args[0].value)
+        self.assertEqual(['c', 'b', 'a'], operation.args[1])
+        self.assertEqual('host-1', operation.host)
+        self.assertEqual([], list(operations))
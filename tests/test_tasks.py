@@ -0,0 +1,116 @@
+"""Tests for `vmwaretool.tasks`."""
+
+from concurrent import futures
+import unittest
+from unittest import mock
+
+from oslo_vmware import exceptions
+from oslo_vmware import vim_util
+
+from vmwaretool import tasks
+
+
+def _task_content(value, state, error=None):
+    prop = mock.Mock(val=mock.Mock(state=state, error=error))
+    prop.name = 'info'
+    return mock.Mock(obj=vim_util.get_moref(value, 'Task'), propSet=[prop])
+
+
+class TaskTrackerTest(unittest.TestCase):
+
+    def test_submit(self):
+        states = {'task-1': ['running', 'success'],
+                  'task-2': ['error']}
+        session = mock.Mock()
+
+        def invoke_api(module, method, vim, *args, **kwargs):
+            if method == 'continue_retrieval':
+                return None
+            _type, refs, _props = args
+            return mock.Mock(objects=[
+                _task_content(ref.value, states[ref.value].pop(0),
+                              error=mock.Mock(localizedMessage='failed',
+                                              fault=None))
+                for ref in refs])
+
+        session.invoke_api.side_effect = invoke_api
+        tracker = tasks.TaskTracker(session, min_interval=0.01,
+                                    max_interval=0.01)
+
+        future_1 = tracker.submit(vim_util.get_moref('task-1', 'Task'))
+        future_2 = tracker.submit(vim_util.get_moref('task-2', 'Task'))
+
+        self.assertEqual('success', future_1.result(5).state)
+        self.assertRaises(exceptions.VimException, future_2.result, 5)
+        self.assertEqual(0, len(tracker))
+
+    def test_submit_per_task_fallback(self):
+        session = mock.Mock()
+
+        def invoke_api(module, method, vim, *args, **kwargs):
+            if method == 'get_properties_for_a_collection_of_objects':
+                raise exceptions.VimException('invalid task')
+            task = args[0]
+            if task.value == 'task-1':
+                return mock.Mock(state='success')
+            raise exceptions.ManagedObjectNotFoundException()
+
+        session.invoke_api.side_effect = invoke_api
+        tracker = tasks.TaskTracker(session, min_interval=0.01,
+                                    max_interval=0.01)
+
+        future_1 = tracker.submit(vim_util.get_moref('task-1', 'Task'))
+        future_2 = tracker.submit(vim_util.get_moref('task-2', 'Task'))
+
+        self.assertEqual('success', future_1.result(5).state)
+        self.assertRaises(exceptions.ManagedObjectNotFoundException,
+                          future_2.result, 5)
+
+    def test_submit_task_missing_from_results(self):
+        session = mock.Mock()
+
+        def invoke_api(module, method, vim, *args, **kwargs):
+            if method == 'continue_retrieval':
+                return None
+            if method == 'get_object_property':
+                raise exceptions.ManagedObjectNotFoundException()
+            # Tasks which no longer exist are left out of the results.
+            return mock.Mock(objects=[_task_content('task-1', 'success')])
+
+        session.invoke_api.side_effect = invoke_api
+        tracker = tasks.TaskTracker(session, min_interval=0.01,
+                                    max_interval=0.01)
+
+        future_1 = tracker.submit(vim_util.get_moref('task-1', 'Task'))
+        future_2 = tracker.submit(vim_util.get_moref('task-2', 'Task'))
+
+        self.assertEqual('success', future_1.result(5).state)
+        self.assertRaises(exceptions.ManagedObjectNotFoundException,
+                          future_2.result, 5)
+
+    def test_submit_poll_errors(self):
+        session = mock.Mock()
+        session.invoke_api.side_effect = ValueError('malformed')
+        tracker = tasks.TaskTracker(session, min_interval=0.01,
+                                    max_interval=0.01, max_poll_errors=3)
+
+        future = tracker.submit(vim_util.get_moref('task-1', 'Task'))
+
+        self.assertRaises(ValueError, future.result, 5)
+        self.assertEqual(3, session.invoke_api.call_count)
+        self.assertEqual(0, len(tracker))
+
+    def test_wait_timeout(self):
+        session = mock.Mock()
+
+        def invoke_api(module, method, vim, *args, **kwargs):
+            if method == 'continue_retrieval':
+                return None
+            return mock.Mock(objects=[_task_content('task-1', 'running')])
+
+        session.invoke_api.side_effect = invoke_api
+        tracker = tasks.TaskTracker(session, min_interval=0.01,
+                                    max_interval=0.01)
+
+        self.assertRaises(futures.TimeoutError, tracker.wait,
+                          vim_util.get_moref('task-1', 'Task'), timeout=0.05)
@@ -0,0 +1,181 @@
+"""Tests for `vmwaretool.vmware_ops`."""
+
+import contextlib
+import unittest
+from unittest import mock
+
+from oslo_vmware import exceptions
+
+from vmwaretool import datastore
+from vmwaretool import vmware_ops
+
+
+class SetupConnectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self._session = mock.Mock()
+        patcher = mock.patch.object(vmware_ops, '_create_session',
+                                    return_value=self._session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(vmware_ops.volumeops, 'VMwareVolumeOps')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        vmware_ops.CONF.set_override(
+            'vmware_profile_compliance_refresh_interval', 0, group='vmware')
+        self.addCleanup(vmware_ops.CONF.clear_override,
+                        'vmware_profile_compliance_refresh_interval',
+                        group='vmware')
+        vmware_ops.CONF.set_override('vmware_storage_profile', ['gold'],
+                                     group='vmware')
+        self.addCleanup(vmware_ops.CONF.clear_override,
+                        'vmware_storage_profile', group='vmware')
+
+    @mock.patch.object(datastore.DatastoreSelector, 'preload_profile_ids')
+    def test_setup_connection_preloads_profile_ids(self, preload):
+        session, _volumeops, ds_sel = vmware_ops.setup_connection()
+
+        self.assertIs(self._session, session)
+        self.assertIsInstance(ds_sel, datastore.DatastoreSelector)
+        preload.assert_called_once_with()
+
+    @mock.patch.object(datastore.DatastoreSelector, 'preload_profile_ids')
+    def test_setup_connection_preload_error(self, preload):
+        preload.side_effect = exceptions.VimException('error')
+
+        _session, _volumeops, ds_sel = vmware_ops.setup_connection()
+
+        self.assertIsNotNone(ds_sel)
+
+    @mock.patch.object(datastore.DatastoreSelector, 'preload_profile_ids')
+    def test_setup_connection_without_profiles(self, preload):
+        vmware_ops.CONF.set_override('vmware_storage_profile', None,
+                                     group='vmware')
+        type(self._session).pbm = mock.PropertyMock()
+
+        vmware_ops.setup_connection()
+
+        preload.assert_not_called()
+        type(self._session).pbm.assert_not_called()
+
+    @mock.patch.object(datastore.DatastoreSelector, 'preload_profile_ids')
+    def test_setup_connection_without_pbm(self, preload):
+        self._session.pbm = None
+
+        vmware_ops.setup_connection()
+
+        preload.assert_not_called()
+
+    @mock.patch.object(datastore.DatastoreSelector, 'preload_profile_ids')
+    @mock.patch.object(datastore, 'DatastoreMirror')
+    def test_setup_connection_with_mirror(self, mirror_cls, preload):
+        for name in ('vmware_datastore_mirror',
+                     'vmware_vectorized_placement'):
+            vmware_ops.CONF.set_override(name, True, group='vmware')
+            self.addCleanup(vmware_ops.CONF.clear_override, name,
+                            group='vmware')
+        vmware_ops.CONF.set_override('vmware_session_pool_size', 2,
+                                     group='vmware')
+        self.addCleanup(vmware_ops.CONF.clear_override,
+                        'vmware_session_pool_size', group='vmware')
+
+        with mock.patch.object(vmware_ops, '_create_session_pool'):
+            _session, _volumeops, ds_sel = vmware_ops.setup_connection()
+
+        # The mirror gets a session of its own, not one from the pool.
+        mirror_cls.assert_called_once_with(self._session, mock.ANY)
+        mirror = mirror_cls.return_value
+        mirror.start.assert_called_once_with()
+        self.assertIs(mirror, ds_sel.get_mirror())
+        self.assertTrue(ds_sel._vectorized)
+
+        vmware_ops.close_connection(self._session, ds_sel)
+        mirror.stop.assert_called_once_with()
+        mirror.get_session.return_value.logout.assert_called_once_with()
+
+    @mock.patch.object(datastore.DatastoreSelector, 'preload_profile_ids')
+    @mock.patch.object(datastore, 'DatastoreMirror')
+    def test_setup_connection_mirror_error(self, mirror_cls, preload):
+        vmware_ops.CONF.set_override('vmware_datastore_mirror', True,
+                                     group='vmware')
+        self.addCleanup(vmware_ops.CONF.clear_override,
+                        'vmware_datastore_mirror', group='vmware')
+        mirror = mirror_cls.return_value
+        mirror.start.side_effect = exceptions.VimException('error')
+
+        _session, _volumeops, ds_sel = vmware_ops.setup_connection()
+
+        self.assertIsNone(ds_sel.get_mirror())
+        mirror.get_session.return_value.logout.assert_called_once_with()
+
+    def test_close_connection(self):
+        ds_sel = mock.Mock()
+        vmware_ops.close_connection(self._session, ds_sel)
+
+        ds_sel.close.assert_called_once_with()
+        self._session.logout.assert_not_called()
+
+    def test_close_connection_pooled(self):
+        session = mock.Mock(spec=vmware_ops.sessions.PooledSession)
+        ds_sel = mock.Mock()
+        vmware_ops.close_connection(session, ds_sel)
+
+        ds_sel.close.assert_called_once_with()
+        session.logout.assert_called_once_with()
+
+    @mock.patch.object(vmware_ops.pbm, 'get_pbm_wsdl_location')
+    def test_set_pbm_wsdl_loc(self, get_pbm_wsdl_location):
+        self._session.vim.service_content.about.version = '7.0.3'
+        get_pbm_wsdl_location.return_value = 'file:///pbmService.wsdl'
+
+        vmware_ops._set_pbm_wsdl_loc(self._session)
+
+        get_pbm_wsdl_location.assert_called_once_with('7.0.3')
+        self._session.pbm_wsdl_loc_set.assert_called_once_with(
+            'file:///pbmService.wsdl')
+
+
+class CreateSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        vmware_ops.CONF.set_override('vmware_wsdl_cache', True,
+                                     group='vmware')
+        self.addCleanup(vmware_ops.CONF.clear_override, 'vmware_wsdl_cache',
+                        group='vmware')
+
+    @mock.patch.object(vmware_ops, '_connect')
+    @mock.patch.object(vmware_ops.wsdl_cache, 'WsdlCache')
+    def test_create_session_with_wsdl_cache(self, wsdl_cache, connect):
+        installed = []
+
+        @contextlib.contextmanager
+        def _installed():
+            installed.append(True)
+            yield
+            installed.pop()
+
+        wsdl_cache.return_value.installed.side_effect = _installed
+        session = connect.return_value
+        pbm_built_with_cache = []
+        type(session).pbm = mock.PropertyMock(
+            side_effect=lambda: pbm_built_with_cache.append(bool(installed)))
+        vmware_ops.CONF.set_override('vmware_storage_profile', ['gold'],
+                                     group='vmware')
+        self.addCleanup(vmware_ops.CONF.clear_override,
+                        'vmware_storage_profile', group='vmware')
+
+        self.assertIs(session, vmware_ops._create_session())
+
+        self.assertEqual([True], pbm_built_with_cache)
+        wsdl_cache.return_value.update_server_version.assert_called_once_with(
+            session.vim.service_content.about)
+
+    @mock.patch.object(vmware_ops, '_connect')
+    @mock.patch.object(vmware_ops.wsdl_cache, 'WsdlCache')
+    def test_create_session_without_profiles(self, wsdl_cache, connect):
+        session = connect.return_value
+        type(session).pbm = mock.PropertyMock()
+
+        self.assertIs(session, vmware_ops._create_session())
+
+        type(session).pbm.assert_not_called()
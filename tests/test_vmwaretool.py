@@ -3,6 +3,8 @@
 """Tests for `vmwaretool` package."""
 
 
+import subprocess
+import sys
 import unittest
 from click.testing import CliRunner
 
@@ -31,3 +33,13 @@ class TestVmwaretool(unittest.TestCase):
         help_result = runner.invoke(cli.main, ['--help'])
         assert help_result.exit_code == 0
         assert '--help  Show this message and exit.' in help_result.output
+
+    def test_startup_imports(self):
+        """Heavy modules are not imported to parse the command line."""
+        code = ("import sys, vmwaretool.cli; "
+                "print(' '.join(sorted(sys.modules)))")
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         universal_newlines=True)
+        loaded = set(name.split('.')[0] for name in output.split())
+        self.assertFalse(loaded & {'click_completion', 'oslo_vmware',
+                                   'suds', 'eventlet', 'yaspin', 'pygments'})
@@ -0,0 +1,341 @@
+"""Tests for `vmwaretool.volumeops`."""
+
+from concurrent import futures
+from types import SimpleNamespace
+import unittest
+from unittest import mock
+
+from oslo_vmware import exceptions
+from oslo_vmware import vim_util
+
+from vmwaretool import backing_index
+from vmwaretool import volumeops
+
+
+class VolumeOpsBackingCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._session = mock.Mock()
+        self._vops = volumeops.VMwareVolumeOps(self._session, 100, None, None)
+
+    def _invoked_methods(self):
+        return [c[0][1] for c in self._session.invoke_api.call_args_list]
+
+    def test_get_backing_cached(self):
+        self._vops._backing_ref_cache.add('volume-1', 'vm-1',
+                                          instance_uuid='uuid-1',
+                                          volume_id='1')
+        self._vops._set_backing_refs_confirmed()
+
+        self.assertEqual('vm-1', self._vops.get_backing('volume-1',
+                                                        '1').value)
+        self.assertEqual([], self._invoked_methods())
+
+    def test_get_backing_cached_expired(self):
+        self._vops._backing_ref_cache.add('volume-1', 'vm-1',
+                                          instance_uuid='1')
+        self._vops._set_backing_refs_confirmed()
+        self._vops._backing_refs_confirmed_at -= (
+            volumeops.DEFAULT_BACKING_REF_MAX_AGE + 1)
+
+        for _ in range(2):
+            self.assertEqual('vm-1', self._vops.get_backing('volume-1',
+                                                            '1').value)
+        # Checked to exist once, then trusted again.
+        self.assertEqual(['get_object_property'], self._invoked_methods())
+
+    def test_backing_evicted_when_not_found(self):
+        self._vops._backing_ref_cache.add('volume-1', 'vm-1',
+                                          instance_uuid='1')
+        self._vops._set_backing_refs_confirmed()
+        self._session.invoke_api.side_effect = (
+            exceptions.ManagedObjectNotFoundException())
+
+        backing = self._vops.get_backing('volume-1', '1')
+        self.assertRaises(exceptions.ManagedObjectNotFoundException,
+                          self._vops.get_disk_size, backing)
+        self.assertIsNone(self._vops._backing_ref_cache.get_by_uuid('1'))
+
+    def test_get_backing_miss(self):
+        self._session.invoke_api.return_value = [
+            vim_util.get_moref('vm-2', 'VirtualMachine')]
+
+        for _ in range(2):
+            self.assertEqual('vm-2', self._vops.get_backing('volume-2',
+                                                            '2').value)
+        self.assertEqual(['FindAllByUuid'], self._invoked_methods())
+
+        self._vops.delete_backing(vim_util.get_moref('vm-2',
+                                                     'VirtualMachine'))
+        self._session.invoke_api.reset_mock()
+        self._session.invoke_api.return_value = None
+        self.assertIsNone(self._vops.get_backing('volume-2', '2'))
+        self._session.invoke_api.assert_called_once()
+
+    def test_get_backing_stale(self):
+        self._vops._backing_ref_cache.add('volume-1', 'vm-1',
+                                          instance_uuid='1')
+
+        def invoke_api(module, method, *args, **kwargs):
+            if method == 'get_object_property':
+                raise exceptions.ManagedObjectNotFoundException()
+            return [vim_util.get_moref('vm-3', 'VirtualMachine')]
+
+        self._session.invoke_api.side_effect = invoke_api
+        self.assertEqual('vm-3', self._vops.get_backing('volume-1',
+                                                        '1').value)
+        self.assertEqual(['get_object_property', 'FindAllByUuid'],
+                         self._invoked_methods())
+        self.assertEqual('vm-3',
+                         self._vops._backing_ref_cache.get_by_uuid('1').value)
+
+    def test_background_rebuild_keeps_changes(self):
+        def _record(value, name):
+            return backing_index.BackingRecord(value, name, 'uuid-' + value,
+                                               None, '1')
+
+        def refresh(session, max_objects):
+            # A new backing is looked up and a listed one is deleted while
+            # the index is reconciled.
+            self._session.invoke_api.return_value = [
+                vim_util.get_moref('vm-3', 'VirtualMachine')]
+            self._vops.get_backing('b3', 'uuid-vm-3')
+            self._vops.invalidate_backing(
+                vim_util.get_moref('vm-2', 'VirtualMachine'))
+
+        index = mock.Mock()
+        index.load.return_value = True
+        index.records.return_value = [_record('vm-1', 'b1'),
+                                      _record('vm-2', 'b2')]
+        index.refresh.side_effect = refresh
+        self._vops._backing_index = index
+
+        self._vops.build_backing_ref_cache(background=True)
+        self._vops._backing_index_thread.join()
+
+        cache = self._vops._backing_ref_cache
+        self.assertEqual('vm-1', cache.get('b1').value)
+        self.assertIsNone(cache.get('b2'))
+        self.assertEqual('vm-3', cache.get('b3').value)
+        self.assertIsNone(self._vops._backing_ref_changes)
+
+
+class VolumeOpsDeviceCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._session = mock.Mock()
+        self._vops = volumeops.VMwareVolumeOps(self._session, 100, None, None)
+
+    def _create_disk(self, file_name, capacity_in_kb):
+        disk_backing = mock.Mock(fileName=file_name)
+        disk_backing.__class__.__name__ = 'VirtualDiskFlatVer2BackingInfo'
+        disk = mock.Mock(backing=disk_backing, capacityInKB=capacity_in_kb)
+        disk.__class__.__name__ = 'VirtualDisk'
+        return disk
+
+    def test_devices_fetched_once(self):
+        backing = vim_util.get_moref('vm-1', 'VirtualMachine')
+        disk = self._create_disk('[ds1] vm-1/vm-1.vmdk', 1024)
+        self._session.invoke_api.return_value = [disk]
+
+        self.assertEqual('[ds1] vm-1/vm-1.vmdk',
+                         self._vops.get_vmdk_path(backing))
+        self.assertEqual(1024 * 1024, self._vops.get_disk_size(backing))
+        self.assertEqual(disk, self._vops.get_disk_device(
+            backing, '[ds1] vm-1/vm-1.vmdk'))
+        self.assertEqual(1, self._session.invoke_api.call_count)
+
+    def test_devices_invalidated_by_reconfigure(self):
+        backing = vim_util.get_moref('vm-1', 'VirtualMachine')
+        self._session.invoke_api.return_value = [
+            self._create_disk('[ds1] vm-1/vm-1.vmdk', 1024)]
+        self._vops.get_disk_size(backing)
+
+        self._vops.update_backing_uuid(backing, 'uuid-1')
+        self._session.invoke_api.reset_mock()
+        self._session.invoke_api.return_value = [
+            self._create_disk('[ds1] vm-1/vm-1.vmdk', 2048)]
+        self.assertEqual(2048 * 1024, self._vops.get_disk_size(backing))
+        self._session.invoke_api.assert_called_once()
+
+    def test_devices_invalidated_by_extend(self):
+        backing = vim_util.get_moref('vm-1', 'VirtualMachine')
+        self._session.invoke_api.return_value = [
+            self._create_disk('[ds1] vm-1/vm-1.vmdk', 1024)]
+        self._vops.get_disk_size(backing)
+
+        self._vops.extend_virtual_disk(2, '[ds1] vm-1/vm-1.vmdk',
+                                       mock.sentinel.dc_ref)
+        self._session.invoke_api.return_value = [
+            self._create_disk('[ds1] vm-1/vm-1.vmdk', 2048 * 1024)]
+        self.assertEqual(2048 * 1024 * 1024,
+                         self._vops.get_disk_size(backing))
+
+
+class VolumeOpsSnapshotIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self._session = mock.Mock()
+        self._vops = volumeops.VMwareVolumeOps(self._session, 100, None, None)
+        self._vops._wait_for_task = mock.Mock()
+
+    def _snapshot_info(self, *names):
+        roots = []
+        for name in names:
+            root = mock.Mock(snapshot='snapshot-%s' % name,
+                             childSnapshotList=[])
+            # 'name' is a Mock constructor argument, so set it afterwards.
+            root.name = name
+            roots.append(root)
+        return mock.Mock(rootSnapshotList=roots)
+
+    def test_snapshot_index(self):
+        backing = vim_util.get_moref('vm-1', 'VirtualMachine')
+        self._session.invoke_api.return_value = self._snapshot_info('s1',
+                                                                    's2')
+
+        self.assertTrue(self._vops.snapshot_exists(backing))
+        self.assertEqual('snapshot-s1', self._vops.get_snapshot(backing, 's1'))
+        self.assertEqual('snapshot-s2', self._vops.get_snapshot(backing, 's2'))
+        self.assertEqual(1, self._session.invoke_api.call_count)
+
+        self._vops.delete_snapshot(backing, 's2')
+        self._session.invoke_api.reset_mock()
+        self._session.invoke_api.return_value = None
+        self.assertIsNone(self._vops.get_snapshot(backing, 's1'))
+        self.assertFalse(self._vops.snapshot_exists(backing))
+        self._session.invoke_api.assert_called_once()
+
+
+class VolumeOpsReconfigTransactionTest(unittest.TestCase):
+
+    def setUp(self):
+        self._session = mock.Mock()
+        self._session.vim.client.factory.create.side_effect = (
+            lambda type_name: mock.Mock(spec=[]))
+        self._vops = volumeops.VMwareVolumeOps(self._session, 100, None, None)
+        self._disk = SimpleNamespace(backing=SimpleNamespace(uuid='uuid-0'))
+        self._vops._get_disk_device = mock.Mock(return_value=self._disk)
+        self._vops._reconfigure_backing = mock.Mock()
+
+    def test_commit(self):
+        backing = vim_util.get_moref('vm-1', 'VirtualMachine')
+        profile_id = mock.Mock(uniqueId='profile-1')
+
+        with self._vops.reconfigure_transaction(backing) as txn:
+            txn.update_disk_uuid('disk-uuid')
+            txn.update_extra_config({'cinder.volume.id': '1',
+                                     volumeops.BACKING_UUID_KEY: 'uuid-1'})
+            txn.change_profile(profile_id)
+
+        self._vops._reconfigure_backing.assert_called_once()
+        spec = self._vops._reconfigure_backing.call_args[0][1]
+        self.assertEqual('uuid-1', spec.instanceUuid)
+        self.assertEqual(['cinder.volume.id'],
+                         [opt.key for opt in spec.extraConfig])
+        self.assertEqual('profile-1', spec.vmProfile[0].profileId)
+        # Disk UUID and profile changes are merged into one device edit.
+        self.assertEqual(1, len(spec.deviceChange))
+        self.assertEqual('disk-uuid',
+                         spec.deviceChange[0].device.backing.uuid)
+        # The cached device is left as it is.
+        self.assertEqual('uuid-0', self._disk.backing.uuid)
+        self.assertEqual(spec.vmProfile, spec.deviceChange[0].profile)
+        self._vops._get_disk_device.assert_called_once_with(backing)
+
+    def test_abort(self):
+        backing = vim_util.get_moref('vm-1', 'VirtualMachine')
+        self._vops._device_cache.invalidate = mock.Mock()
+
+        with self.assertRaises(ValueError):
+            with self._vops.reconfigure_transaction(backing) as txn:
+                txn.update_disk_uuid('disk-uuid')
+                raise ValueError()
+        self.assertFalse(self._vops._reconfigure_backing.called)
+        self.assertEqual('uuid-0', self._disk.backing.uuid)
+        self.assertFalse(self._vops._device_cache.invalidate.called)
+
+    def test_commit_without_changes(self):
+        backing = vim_util.get_moref('vm-1', 'VirtualMachine')
+        with self._vops.reconfigure_transaction(backing):
+            pass
+        self.assertFalse(self._vops._reconfigure_backing.called)
+
+
+class VolumeOpsCloneBackingsTest(unittest.TestCase):
+
+    def setUp(self):
+        self._session = mock.Mock()
+        # An idle TaskTracker is falsy since it defines __len__.
+        self._tracker = mock.Mock()
+        self._tracker.__len__ = mock.Mock(return_value=0)
+        self._vops = volumeops.VMwareVolumeOps(self._session, 100, None, None,
+                                               task_tracker=self._tracker)
+        self._vops._get_folder = mock.Mock(return_value='folder')
+        self._vops._get_disk_device = mock.Mock()
+        self._vops._get_relocate_spec = mock.Mock()
+        self._vops._create_managed_by_info = mock.Mock()
+        self._session.invoke_api.side_effect = (
+            lambda vim, method, backing, name, **kwargs: name)
+        self._failed = set()
+
+        def submit(task):
+            future = futures.Future()
+            if task in self._failed:
+                future.set_exception(exceptions.VimException('failed'))
+            else:
+                future.set_result(mock.Mock(result='ref-' + task))
+            return future
+
+        self._tracker.submit.side_effect = submit
+        self._ds_1 = vim_util.get_moref('ds-1', 'Datastore')
+        self._ds_2 = vim_util.get_moref('ds-2', 'Datastore')
+        self._backing = vim_util.get_moref('vm-1', 'VirtualMachine')
+
+    def test_clone_backings(self):
+        refs = self._vops.clone_backings(
+            ['c1', 'c2', 'c3'], self._backing, mock.sentinel.snapshot,
+            volumeops.LINKED_CLONE_TYPE, [self._ds_1, self._ds_2, self._ds_1],
+            disk_type='thin', max_in_flight_per_datastore=1)
+
+        self.assertEqual(['ref-c1', 'ref-c2', 'ref-c3'], refs)
+        self.assertEqual(3, self._tracker.submit.call_count)
+        self._vops._get_folder.assert_called_once_with(self._backing)
+        self._vops._get_disk_device.assert_called_once_with(self._backing)
+        self.assertEqual(2, self._vops._get_relocate_spec.call_count)
+
+    def test_clone_backings_error(self):
+        self._failed.add('c2')
+        self._vops.delete_backing = mock.Mock()
+
+        self.assertRaises(
+            exceptions.VimException, self._vops.clone_backings,
+            ['c1', 'c2', 'c3'], self._backing, mock.sentinel.snapshot,
+            volumeops.LINKED_CLONE_TYPE, self._ds_1)
+        # Clones created before the error was noticed are not leaked.
+        self.assertEqual(
+            [mock.call('ref-c1'), mock.call('ref-c3')],
+            self._vops.delete_backing.call_args_list)
+
+    def test_clone_backings_unexpected_error(self):
+        def invoke_api(vim, method, backing, name, **kwargs):
+            if name == 'c2':
+                raise RuntimeError()
+            return name
+
+        self._session.invoke_api.side_effect = invoke_api
+        self._vops.delete_backing = mock.Mock()
+
+        self.assertRaises(
+            RuntimeError, self._vops.clone_backings,
+            ['c1', 'c2', 'c3'], self._backing, mock.sentinel.snapshot,
+            volumeops.LINKED_CLONE_TYPE, self._ds_1)
+        self._vops.delete_backing.assert_called_once_with('ref-c1')
+
+    def test_clone_backings_invalid_limits(self):
+        for kwargs in ({'max_in_flight': 0},
+                       {'max_in_flight_per_datastore': -1}):
+            self.assertRaises(
+                ValueError, self._vops.clone_backings, ['c1'],
+                self._backing, mock.sentinel.snapshot,
+                volumeops.LINKED_CLONE_TYPE, self._ds_1, **kwargs)
@@ -0,0 +1,78 @@
+"""Tests for `vmwaretool.wsdl_cache`."""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from oslo_vmware import service
+
+from vmwaretool import wsdl_cache
+
+
+class WsdlCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        super(WsdlCacheTest, self).setUp()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.base_dir = tmp_dir.name
+
+    def test_installed(self):
+        cache = wsdl_cache.WsdlCache(self.base_dir, 'vc', 443)
+        original_client = service.CompatibilitySudsClient
+        with mock.patch('suds.client.Client.__init__',
+                        return_value=None) as client_init:
+            with cache.installed():
+                self.assertIsNot(original_client,
+                                 service.CompatibilitySudsClient)
+                service.CompatibilitySudsClient('url', cache=None)
+        self.assertIs(original_client, service.CompatibilitySudsClient)
+
+        kwargs = client_init.call_args[1]
+        self.assertEqual(1, kwargs['cachingpolicy'])
+        self.assertIsInstance(kwargs['cache'], wsdl_cache._DefinitionsCache)
+
+    def test_update_server_version(self):
+        cache = wsdl_cache.WsdlCache(self.base_dir, 'vc', 443)
+        unknown_location = cache._location(wsdl_cache._UNKNOWN_VERSION)
+        os.makedirs(unknown_location)
+
+        # Definitions parsed before the version was known are kept.
+        cache.update_server_version(mock.Mock(apiVersion='8.0', build='1'))
+        self.assertFalse(os.path.exists(unknown_location))
+        self.assertTrue(os.path.isdir(cache._location('8.0-1')))
+
+        cache = wsdl_cache.WsdlCache(self.base_dir, 'vc', 443)
+        self.assertEqual('8.0-1', cache._server_version)
+        cache.update_server_version(mock.Mock(apiVersion='8.0', build='2'))
+        self.assertFalse(os.path.exists(cache._location('8.0-1')))
+        self.assertEqual(
+            '8.0-2',
+            wsdl_cache.WsdlCache(self.base_dir, 'vc', 443)._server_version)
+
+    def test_files_private(self):
+        cache = wsdl_cache.WsdlCache(self.base_dir, 'vc', 443)
+        with cache.installed():
+            pass
+        definitions_cache = wsdl_cache._DefinitionsCache(
+            cache._location(wsdl_cache._UNKNOWN_VERSION))
+        definitions_cache.put('wsdl', {'definitions': 1})
+        cache.update_server_version(mock.Mock(apiVersion='8.0', build='1'))
+
+        location = cache._location('8.0-1')
+        for path in (cache._base_dir, location):
+            self.assertEqual(0o700, os.stat(path).st_mode & 0o777)
+        for name in os.listdir(location) + [cache._versions_path()]:
+            path = os.path.join(location, name)
+            self.assertEqual(0o600, os.stat(path).st_mode & 0o777, name)
+
+    def test_ignore_files_accessible_by_others(self):
+        definitions_cache = wsdl_cache._DefinitionsCache(
+            os.path.join(self.base_dir, 'defs'))
+        definitions_cache.put('wsdl', {'definitions': 1})
+        self.assertEqual({'definitions': 1}, definitions_cache.get('wsdl'))
+
+        path = definitions_cache._FileCache__filename('wsdl')
+        os.chmod(path, 0o666)
+        self.assertIsNone(definitions_cache.get('wsdl'))
@@ -0,0 +1,222 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+asyncio interface to volume operations.
+"""
+
+import asyncio
+from concurrent import futures
+import threading
+import weakref
+
+from oslo_log import log as logging
+from oslo_vmware import exceptions
+
+from vmwaretool import tasks
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENCY = 10
+
+# VMwareVolumeOps methods exposed as coroutines by AsyncVMwareVolumeOps.
+ASYNC_METHODS = [
+    # backings
+    'get_backing',
+    'create_backing',
+    'create_backing_disk_less',
+    'delete_backing',
+    'rename_backing',
+    'move_backing_to_folder',
+    'relocate_backing',
+    'clone_backing',
+    'attach_disk_to_backing',
+    'detach_disk_from_backing',
+    # snapshots
+    'create_snapshot',
+    'delete_snapshot',
+    'revert_to_snapshot',
+    # files
+    'create_datastore_folder',
+    'create_virtual_disk',
+    'extend_virtual_disk',
+    'copy_vmdk_file',
+    'move_vmdk_file',
+    'copy_datastore_file',
+    'delete_vmdk_file',
+    'delete_file',
+    # first class disks
+    'create_fcd',
+    'delete_fcd',
+    'clone_fcd',
+    'extend_fcd',
+    'attach_fcd',
+    'detach_fcd',
+    'create_fcd_snapshot',
+    'delete_fcd_snapshot',
+    'create_fcd_from_snapshot',
+    'update_fcd_policy',
+]
+
+
+class _Call(object):
+    """vCenter tasks started by a single facade call."""
+
+    def __init__(self, session):
+        self._session = session
+        self._lock = threading.Lock()
+        self._tasks = []
+        self._cancelled = False
+
+    def add_task(self, task):
+        with self._lock:
+            self._tasks.append(task)
+            cancelled = self._cancelled
+        if cancelled:
+            self._cancel_task(task)
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            pending = list(self._tasks)
+        for task in pending:
+            self._cancel_task(task)
+
+    def _cancel_task(self, task):
+        LOG.debug("Cancelling task: %s.", task)
+        try:
+            self._session.invoke_api(self._session.vim, 'CancelTask', task)
+        except exceptions.VimException:
+            # The task may have completed or not be cancelable.
+            LOG.warning("Unable to cancel task: %s.", task, exc_info=True)
+
+
+class AsyncVMwareVolumeOps(object):
+    """Awaitable versions of the VMwareVolumeOps operations.
+
+    The vSphere API calls of each operation run on a thread pool of
+    max_concurrency workers; at most max_concurrency operations are in
+    flight and the rest wait on a semaphore. The facade may be used from
+    several event loops, each of which gets its own semaphore while they
+    share the thread pool. The vCenter tasks started by all operations are
+    waited for through one shared TaskTracker, whose futures are awaited on
+    the event loop, so no worker is held while a task runs.
+
+    If the awaiting coroutine is cancelled, the vCenter tasks started by the
+    operation are cancelled with CancelTask and the CancelledError is raised
+    once the operation has returned.
+    """
+
+    def __init__(self, vops, session, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        self._vops = vops
+        self._session = session
+        self._max_concurrency = max_concurrency
+        if vops.get_task_tracker() is None:
+            vops.set_task_tracker(tasks.TaskTracker(session))
+        self._task_tracker = vops.get_task_tracker()
+        self._executor = futures.ThreadPoolExecutor(
+            max_workers=max_concurrency)
+        # asyncio primitives are bound to the loop they are first used in.
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._semaphores_lock = threading.Lock()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    async def wait_for_task(self, task):
+        """Wait for a task started by the caller.
+
+        :param task: managed object reference of the task
+        :return: task info upon successful completion of the task
+        """
+        return await asyncio.wrap_future(self._task_tracker.submit(task))
+
+    def _run(self, call, name, args, kwargs):
+        with tasks.observe_submitted_tasks(call.add_task):
+            return getattr(self._vops, name)(*args, **kwargs)
+
+    def _step(self, call, steps, task_info, error):
+        """Run the operation up to the next task it starts.
+
+        :return: tuple of whether the operation is done and either its
+                 result or the task to wait for
+        """
+        with tasks.observe_submitted_tasks(call.add_task):
+            try:
+                if error is None:
+                    return False, steps.send(task_info)
+                return False, steps.throw(error)
+            except StopIteration as e:
+                return True, e.value
+
+    async def _run_steps(self, loop, call, steps):
+        task_info = None
+        error = None
+        while True:
+            done, value = await loop.run_in_executor(
+                self._executor, self._step, call, steps, task_info, error)
+            if done:
+                return value
+            call.add_task(value)
+            try:
+                task_info = await self.wait_for_task(value)
+                error = None
+            except Exception as e:
+                task_info = None
+                error = e
+
+    def _get_semaphore(self, loop):
+        with self._semaphores_lock:
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = asyncio.Semaphore(self._max_concurrency)
+                self._semaphores[loop] = semaphore
+            return semaphore
+
+    async def _call(self, name, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+
+        async with self._get_semaphore(loop):
+            call = _Call(self._session)
+            steps = getattr(getattr(type(self._vops), name), 'steps', None)
+            if steps is None:
+                future = loop.run_in_executor(self._executor, self._run,
+                                              call, name, args, kwargs)
+            else:
+                # Wait for the operation's tasks here rather than on a
+                # worker thread.
+                future = loop.create_task(self._run_steps(
+                    loop, call, steps(self._vops, *args, **kwargs)))
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                LOG.debug("%s cancelled, cancelling its tasks.", name)
+                await loop.run_in_executor(None, call.cancel)
+                try:
+                    await future
+                except Exception:
+                    pass
+                raise
+
+
+def _async_method(name):
+    async def method(self, *args, **kwargs):
+        return await self._call(name, *args, **kwargs)
+
+    method.__name__ = name
+    method.__doc__ = "Awaitable version of VMwareVolumeOps.%s." % name
+    return method
+
+
+for _name in ASYNC_METHODS:
+    setattr(AsyncVMwareVolumeOps, _name, _async_method(_name))
@@ -0,0 +1,160 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Bulk resolution of the inventory ancestors of managed entities.
+"""
+
+import threading
+import time
+
+from oslo_log import log as logging
+from oslo_vmware import vim_util
+
+from vmwaretool import retrieval
+
+
+LOG = logging.getLogger(__name__)
+
+# Types whose parent is looked up on every call since they are moved around
+# by volume operations; the parents of all other entities are cached.
+DEFAULT_UNCACHED_TYPES = ('VirtualMachine',)
+# Folders and datacenters change rarely, but are not immutable.
+DEFAULT_MAX_AGE = 10 * 60
+
+_PARENT_TRAVERSAL = 'parentTraversal'
+
+
+class AncestryResolver(object):
+    """Resolves ancestors of many entities with one property collector call.
+
+    The parent chains of all requested entities are read by a single
+    RetrievePropertiesEx call, which follows the 'parent' property of every
+    ManagedEntity up to the root folder. Parents of entities of any type but
+    uncached_types are kept for max_age seconds, so that the folder and
+    datacenter hierarchy is only fetched once in a while.
+    """
+
+    def __init__(self, session, max_objects,
+                 uncached_types=DEFAULT_UNCACHED_TYPES,
+                 max_age=DEFAULT_MAX_AGE):
+        self._session = session
+        self._max_objects = max_objects
+        self._uncached_types = frozenset(uncached_types)
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        # moref value -> parent moref, or None for the root folder
+        self._parents = {}
+        self._loaded_at = time.monotonic()
+
+    def __len__(self):
+        return len(self._parents)
+
+    def invalidate(self, entity=None):
+        """Forget the parent of the given entity, or of all entities."""
+        with self._lock:
+            if entity is None:
+                self._parents.clear()
+                self._loaded_at = time.monotonic()
+            else:
+                self._parents.pop(entity.value, None)
+
+    def _get_cached_parents(self):
+        with self._lock:
+            if time.monotonic() - self._loaded_at > self._max_age:
+                self._parents.clear()
+                self._loaded_at = time.monotonic()
+            return dict(self._parents)
+
+    @staticmethod
+    def _find(entity, parent_type, parents):
+        """Walk up from entity; return (ancestor, True) or (None, False)."""
+        seen = set()
+        while entity is not None:
+            if entity._type == parent_type:
+                return entity, True
+            if entity.value in seen or entity.value not in parents:
+                return None, False
+            seen.add(entity.value)
+            entity = parents[entity.value]
+        return None, True
+
+    def _needs_fetch(self, entity, parent_type, parents):
+        if entity is None or entity._type == parent_type:
+            return False
+        if entity._type in self._uncached_types:
+            return True
+        return not self._find(entity, parent_type, parents)[1]
+
+    def _fetch_parents(self, entities):
+        """Read the parents of the entities and all their ancestors.
+
+        :return: list of (entity, parent) tuples
+        """
+        cf = self._session.vim.client.factory
+        parent_spec = vim_util.build_traversal_spec(
+            cf, _PARENT_TRAVERSAL, 'ManagedEntity', 'parent', False,
+            [vim_util.build_selection_spec(cf, _PARENT_TRAVERSAL)])
+        object_specs = [vim_util.build_object_spec(cf, entity, [parent_spec])
+                        for entity in entities]
+        property_spec = vim_util.build_property_spec(
+            cf, type_='ManagedEntity', properties_to_collect=['parent'])
+        filter_spec = vim_util.build_property_filter_spec(cf, [property_spec],
+                                                          object_specs)
+        options = cf.create('ns0:RetrieveOptions')
+        options.maxObjects = self._max_objects
+
+        result = self._session.invoke_api(
+            self._session.vim, 'RetrievePropertiesEx',
+            self._session.vim.service_content.propertyCollector,
+            specSet=[filter_spec], options=options)
+
+        parents = []
+        for obj_content in retrieval.iter_objects(self._session, result):
+            props = vim_util.propset_dict(
+                getattr(obj_content, 'propSet', None))
+            parents.append((obj_content.obj, props.get('parent')))
+        return parents
+
+    def get_parents(self, entities, parent_type):
+        """Get the nearest ancestor of the given type of each entity.
+
+        An entity of parent_type is its own ancestor, as in
+        VMwareVolumeOps._get_parent.
+
+        :param entities: list of managed object references
+        :param parent_type: managed object type of the ancestors
+        :return: list of ancestor references, or None where there is no
+                 such ancestor, in the order of entities
+        """
+        parents = self._get_cached_parents()
+        missing = []
+        seen = set()
+        for entity in entities:
+            if (self._needs_fetch(entity, parent_type, parents) and
+                    entity.value not in seen):
+                seen.add(entity.value)
+                missing.append(entity)
+
+        if missing:
+            LOG.debug("Fetching ancestors of %d entities.", len(missing))
+            cached = {}
+            for entity, parent in self._fetch_parents(missing):
+                parents[entity.value] = parent
+                if entity._type not in self._uncached_types:
+                    cached[entity.value] = parent
+            with self._lock:
+                self._parents.update(cached)
+
+        return [self._find(entity, parent_type, parents)[0]
+                if entity is not None else None
+                for entity in entities]
@@ -0,0 +1,84 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Cache of per-backing data such as virtual hardware devices.
+"""
+
+import collections
+import threading
+import time
+
+
+DEFAULT_MAX_ENTRIES = 1000
+# Bounds how long changes made outside of this process go unnoticed.
+DEFAULT_MAX_AGE = 60
+
+
+class BackingCache(object):
+    """Values fetched for the most recently used backings.
+
+    Used for data such as device lists or snapshot indexes, which are read
+    from vCenter often and changed only by a few operations. Entries are
+    dropped explicitly by the operations which change the data of a
+    backing, after max_age seconds, or in least recently used order once
+    there are more than max_entries of them. A value fetched while any
+    entry was invalidated is not cached, since it may predate the change
+    which caused the invalidation.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_age=DEFAULT_MAX_AGE):
+        self._max_entries = max_entries
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        # moref value -> (fetch time, value)
+        self._entries = collections.OrderedDict()
+        self._epoch = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, moref_value, fetch):
+        """Get the value of a backing, fetching it on a miss.
+
+        :param moref_value: value of the backing's managed object reference
+        :param fetch: callable returning the value
+        :return: cached value; callers must not modify it unless they
+                 invalidate the entry afterwards
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(moref_value)
+            if entry is not None and now - entry[0] <= self._max_age:
+                self._entries.move_to_end(moref_value)
+                return entry[1]
+            epoch = self._epoch
+
+        value = fetch()
+        with self._lock:
+            if epoch == self._epoch:
+                self._entries[moref_value] = (now, value)
+                self._entries.move_to_end(moref_value)
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, moref_value):
+        with self._lock:
+            self._epoch += 1
+            self._entries.pop(moref_value, None)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
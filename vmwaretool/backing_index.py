@@ -0,0 +1,364 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Persistent index of volume backings.
+"""
+
+import os
+import sqlite3
+import sys
+import threading
+
+from oslo_log import log as logging
+from oslo_vmware import exceptions
+from oslo_vmware import vim_util
+
+from vmwaretool import retrieval
+
+
+LOG = logging.getLogger(__name__)
+
+VOLUME_ID_PROPERTY = 'config.extraConfig["cinder.volume.id"]'
+FULL_PROPERTIES = ['name', 'config.instanceUuid', 'config.changeVersion',
+                   VOLUME_ID_PROPERTY]
+# Properties fetched for every backing on a warm start. The volume ID is
+# only fetched for backings which are new or whose config changed.
+RECONCILE_PROPERTIES = ['name', 'config.instanceUuid', 'config.changeVersion']
+# Maximum number of backings per bulk volume ID request.
+FETCH_CHUNK_SIZE = 1000
+
+
+class BackingRecord(object):
+    """Identifiers of a single backing VM."""
+
+    __slots__ = ('moref_value', 'name', 'instance_uuid', 'volume_id',
+                 'change_version')
+
+    def __init__(self, moref_value, name, instance_uuid, volume_id,
+                 change_version):
+        self.moref_value = sys.intern(moref_value)
+        self.name = name
+        self.instance_uuid = instance_uuid
+        self.volume_id = volume_id
+        self.change_version = change_version
+
+    @property
+    def ref(self):
+        return vim_util.get_moref(self.moref_value, 'VirtualMachine')
+
+    def as_row(self):
+        return (self.moref_value, self.name, self.instance_uuid,
+                self.volume_id, self.change_version)
+
+
+class BackingRefCache(object):
+    """Compact index of backings by name, instance UUID and volume ID.
+
+    Only the interned moref value string is kept per backing; the suds
+    ManagedObjectReference is rebuilt on lookup.
+    """
+
+    __slots__ = ('_by_name', '_by_uuid', '_by_volume_id', '_keys')
+
+    def __init__(self):
+        self._by_name = {}
+        self._by_uuid = {}
+        self._by_volume_id = {}
+        # moref value -> (name, instance UUID, volume ID), used for eviction
+        self._keys = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def add(self, name, moref_value, instance_uuid=None, volume_id=None):
+        moref_value = sys.intern(moref_value)
+        self.remove(moref_value)
+        self._keys[moref_value] = (name, instance_uuid, volume_id)
+        if name:
+            self._by_name[name] = moref_value
+        if instance_uuid:
+            self._by_uuid[instance_uuid] = moref_value
+        if volume_id:
+            # Clones and templates may carry a copy of the volume ID in their
+            # extraConfig; such volume IDs do not identify a single backing.
+            current = self._by_volume_id.get(volume_id)
+            if current is None:
+                self._by_volume_id[volume_id] = moref_value
+            elif isinstance(current, tuple):
+                self._by_volume_id[volume_id] = current + (moref_value,)
+            else:
+                self._by_volume_id[volume_id] = (current, moref_value)
+
+    @staticmethod
+    def _get_moref(value):
+        if value is None:
+            return None
+        return vim_util.get_moref(value, 'VirtualMachine')
+
+    def get(self, name):
+        """Get the reference to the named backing, or None if not cached."""
+        return self._get_moref(self._by_name.get(name))
+
+    def get_by_uuid(self, uuid):
+        """Get the reference to the backing with the given instance UUID."""
+        return self._get_moref(self._by_uuid.get(uuid))
+
+    def get_by_volume_id(self, volume_id):
+        """Get the reference to the backing with the given volume ID.
+
+        Backings created by old versions of the driver have a random instance
+        UUID and are found by the volume ID in their extraConfig instead.
+        None is returned if more than one backing has the volume ID.
+        """
+        value = self._by_volume_id.get(volume_id)
+        if isinstance(value, tuple):
+            return None
+        return self._get_moref(value)
+
+    def remove(self, moref_value):
+        """Remove all keys of the backing with the given moref value."""
+        keys = self._keys.pop(moref_value, None)
+        if keys is None:
+            return
+        name, instance_uuid, volume_id = keys
+        for index, key in ((self._by_name, name),
+                           (self._by_uuid, instance_uuid)):
+            if key and index.get(key) == moref_value:
+                del index[key]
+
+        current = self._by_volume_id.get(volume_id) if volume_id else None
+        if current == moref_value:
+            del self._by_volume_id[volume_id]
+        elif isinstance(current, tuple) and moref_value in current:
+            rest = tuple(value for value in current if value != moref_value)
+            self._by_volume_id[volume_id] = rest if len(rest) > 1 else rest[0]
+
+
+class BackingIndexStore(object):
+    """SQLite file holding the backing index of a single vCenter server."""
+
+    SCHEMA_VERSION = '1'
+
+    def __init__(self, path):
+        self._path = path
+
+    def _connect(self):
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self._path)
+        os.chmod(self._path, 0o600)
+        conn.execute("CREATE TABLE IF NOT EXISTS meta "
+                     "(key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("CREATE TABLE IF NOT EXISTS backings "
+                     "(moref TEXT PRIMARY KEY, name TEXT, "
+                     "instance_uuid TEXT, volume_id TEXT, "
+                     "change_version TEXT)")
+        return conn
+
+    def load(self, vcenter_uuid):
+        """Load the records saved for the given vCenter server.
+
+        :param vcenter_uuid: instance UUID of the vCenter server
+        :return: list of BackingRecord, or None if there is no usable index
+        """
+        if not os.path.exists(self._path):
+            return None
+
+        conn = self._connect()
+        try:
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+            if (meta.get('schema_version') != self.SCHEMA_VERSION or
+                    meta.get('vcenter_uuid') != vcenter_uuid):
+                LOG.debug("Ignoring backing index: %s saved for another "
+                          "vCenter server or schema.", self._path)
+                return None
+            return [BackingRecord(*row) for row in conn.execute(
+                "SELECT moref, name, instance_uuid, volume_id, "
+                "change_version FROM backings")]
+        finally:
+            conn.close()
+
+    def save(self, vcenter_uuid, records):
+        """Replace the saved index with the given records."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM meta")
+                conn.execute("DELETE FROM backings")
+                conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)",
+                                 [('schema_version', self.SCHEMA_VERSION),
+                                  ('vcenter_uuid', vcenter_uuid)])
+                conn.executemany("INSERT INTO backings VALUES (?, ?, ?, ?, ?)",
+                                 (r.as_row() for r in records))
+        finally:
+            conn.close()
+        LOG.debug("Saved %(count)d records to backing index: %(path)s.",
+                  {'count': len(records), 'path': self._path})
+
+
+def _record_from_object(obj_content):
+    props = vim_util.propset_dict(getattr(obj_content, 'propSet', None))
+    volume_id = props.get(VOLUME_ID_PROPERTY)
+    if volume_id is not None:
+        volume_id = volume_id.value
+    return BackingRecord(obj_content.obj.value,
+                         props.get('name'),
+                         props.get('config.instanceUuid'),
+                         volume_id,
+                         props.get('config.changeVersion'))
+
+
+class BackingIndex(object):
+    """Index of all backing VMs which is persisted between runs.
+
+    On a cold start all backings are retrieved together with their volume ID
+    from extraConfig. On a warm start the saved index is loaded and then
+    reconciled: only name, instance UUID and config change version are
+    retrieved for every backing and the volume ID is fetched in bulk for
+    backings which are new or whose config changed since the index was saved.
+    """
+
+    def __init__(self, store, page_sizer=None):
+        self._store = store
+        self._page_sizer = page_sizer
+        self._lock = threading.Lock()
+        self._records = {}
+        self._loaded = False
+
+    def records(self):
+        return list(self._records.values())
+
+    def load(self, session):
+        """Load the saved index; return True if one was found."""
+        records = self._store.load(self._get_vcenter_uuid(session))
+        if records is None:
+            return False
+        self._records = {r.moref_value: r for r in records}
+        self._loaded = True
+        LOG.debug("Loaded %d records from backing index.", len(records))
+        return True
+
+    def refresh(self, session, max_objects):
+        """Bring the index in sync with vCenter and save it.
+
+        :return: number of backings whose volume ID had to be fetched
+        """
+        with self._lock:
+            if self._loaded:
+                fetched = self._reconcile(session, max_objects)
+            else:
+                fetched = self._build(session, max_objects)
+            self._loaded = True
+            self._store.save(self._get_vcenter_uuid(session),
+                             list(self._records.values()))
+            return fetched
+
+    @staticmethod
+    def _get_vcenter_uuid(session):
+        return session.vim.service_content.about.instanceUuid
+
+    def _retrieve(self, session, max_objects, properties):
+        pages = retrieval.retrieve_pages(session,
+                                         'VirtualMachine',
+                                         max_objects,
+                                         properties_to_collect=properties,
+                                         page_sizer=self._page_sizer)
+        for page in pages:
+            for obj_content in page.objects:
+                yield _record_from_object(obj_content)
+            # Release the page as soon as it is processed.
+            del page.objects[:]
+
+    def _build(self, session, max_objects):
+        records = {}
+        for record in self._retrieve(session, max_objects, FULL_PROPERTIES):
+            records[record.moref_value] = record
+        self._records = records
+        return len(records)
+
+    def _reconcile(self, session, max_objects):
+        records = {}
+        changed = []
+        for record in self._retrieve(session, max_objects,
+                                     RECONCILE_PROPERTIES):
+            old = self._records.get(record.moref_value)
+            if old is not None and old.change_version == record.change_version:
+                record.volume_id = old.volume_id
+            else:
+                changed.append(record)
+            records[record.moref_value] = record
+
+        deleted = self._fetch_volume_ids(session, max_objects, changed)
+        if deleted:
+            changed = [r for r in changed if r.moref_value not in deleted]
+            for value in deleted:
+                del records[value]
+        LOG.debug("Reconciled backing index: %(total)d backings, "
+                  "%(changed)d new or changed, %(removed)d removed.",
+                  {'total': len(records),
+                   'changed': len(changed),
+                   'removed': len(set(self._records) - set(records))})
+        self._records = records
+        return len(changed)
+
+    def _fetch_volume_ids(self, session, max_objects, records):
+        """Fetch the volume IDs of the given records in bulk.
+
+        :return: set of moref values of the records whose backings were
+                 deleted since they were listed
+        """
+        by_value = {r.moref_value: r for r in records}
+        deleted = set()
+        for i in range(0, len(records), FETCH_CHUNK_SIZE):
+            refs = [r.ref for r in records[i:i + FETCH_CHUNK_SIZE]]
+            while refs:
+                try:
+                    self._fetch_chunk(session, max_objects, refs, by_value)
+                    break
+                except exceptions.ManagedObjectNotFoundException as e:
+                    # The fault names one missing object; retry the rest of
+                    # the chunk without it.
+                    value = (e.details or {}).get('obj')
+                    if value not in by_value or value in deleted:
+                        raise
+                    LOG.debug("Backing: %s was deleted during reconcile.",
+                              value)
+                    deleted.add(value)
+                    refs = [ref for ref in refs if ref.value != value]
+        return deleted
+
+    @staticmethod
+    def _fetch_chunk(session, max_objects, refs, by_value):
+        result = session.invoke_api(
+            vim_util,
+            'get_properties_for_a_collection_of_objects',
+            session.vim,
+            'VirtualMachine',
+            refs,
+            [VOLUME_ID_PROPERTY],
+            max_objects=max_objects)
+        while result:
+            for obj_content in result.objects:
+                props = vim_util.propset_dict(
+                    getattr(obj_content, 'propSet', None))
+                volume_id = props.get(VOLUME_ID_PROPERTY)
+                by_value[obj_content.obj.value].volume_id = (
+                    volume_id.value if volume_id is not None else None)
+            result = session.invoke_api(vim_util,
+                                        'continue_retrieval',
+                                        session.vim,
+                                        result)
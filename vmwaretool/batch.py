@@ -0,0 +1,232 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Concurrent execution of batches of volume operations.
+"""
+
+import collections
+from concurrent import futures
+import threading
+import time
+
+from oslo_log import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 10
+
+
+class BatchOperation(object):
+    """A single VMwareVolumeOps call of a batch.
+
+    :param method: name of the VMwareVolumeOps method
+    :param args: positional arguments of the call
+    :param kwargs: keyword arguments of the call
+    :param host: key of the host the operation runs on, used for the
+                 per-host concurrency limit
+    :param datastore: key of the datastore the operation touches, used for
+                      the per-datastore concurrency limit
+    """
+
+    def __init__(self, method, args=(), kwargs=None, host=None,
+                 datastore=None):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.host = host
+        self.datastore = datastore
+
+    def __repr__(self):
+        return "BatchOperation(%s)" % self.method
+
+
+class BatchResult(object):
+    """Outcome of a BatchOperation."""
+
+    def __init__(self, operation, result=None, error=None, elapsed=0.0):
+        self.operation = operation
+        self.result = result
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+
+class BatchStats(object):
+    """Throughput and latency of a batch."""
+
+    def __init__(self, latencies, failed, elapsed):
+        self.count = len(latencies)
+        self.failed = failed
+        self.elapsed = elapsed
+        self.ops_per_second = self.count / elapsed if elapsed > 0 else 0.0
+        latencies = sorted(latencies)
+        self.p50 = _percentile(latencies, 50)
+        self.p95 = _percentile(latencies, 95)
+
+    def __str__(self):
+        return ("%(count)d ops (%(failed)d failed) in %(elapsed).1fs: "
+                "%(rate).1f ops/s, p50 %(p50).2fs, p95 %(p95).2fs" %
+                {'count': self.count,
+                 'failed': self.failed,
+                 'elapsed': self.elapsed,
+                 'rate': self.ops_per_second,
+                 'p50': self.p50,
+                 'p95': self.p95})
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    # nearest-rank percentile
+    rank = -(-percent * len(sorted_values) // 100)
+    return sorted_values[max(rank, 1) - 1]
+
+
+class BatchExecutor(object):
+    """Runs batches of operations with global and per-resource limits.
+
+    Operations are dispatched in order to a pool of max_workers threads, but
+    an operation is held back while per_host_limit operations on its host or
+    per_datastore_limit operations on its datastore are in flight. Later
+    operations on other resources are dispatched meanwhile.
+    """
+
+    def __init__(self, vops, max_workers=DEFAULT_MAX_WORKERS,
+                 per_host_limit=None, per_datastore_limit=None):
+        self._vops = vops
+        self._max_workers = max_workers
+        self._per_host_limit = per_host_limit
+        self._per_datastore_limit = per_datastore_limit
+
+    def _run_one(self, operation):
+        start = time.monotonic()
+        try:
+            result = getattr(self._vops, operation.method)(
+                *operation.args, **operation.kwargs)
+        except Exception as exc:
+            LOG.warning("%(op)s failed: %(exc)s.",
+                        {'op': operation, 'exc': exc})
+            return BatchResult(operation, error=exc,
+                               elapsed=time.monotonic() - start)
+        return BatchResult(operation, result=result,
+                           elapsed=time.monotonic() - start)
+
+    def run(self, operations):
+        """Run the given operations.
+
+        Operations are taken from the iterable as workers become free, so
+        that a generator can keep producing them while earlier ones run. At
+        most max_workers operations held back by a per-resource limit are
+        buffered before the executor waits for running ones to complete.
+
+        :param operations: iterable of BatchOperation
+        :return: tuple of the list of BatchResult, in the order of the
+                 operations, and BatchStats
+        """
+        operations = iter(operations)
+        exhausted = False
+        taken = []
+        results = []
+        pending = collections.deque()
+        in_flight = {}
+        host_count = collections.Counter()
+        ds_count = collections.Counter()
+        done_cond = threading.Condition()
+        done = collections.deque()
+
+        host_limit = self._per_host_limit
+        ds_limit = self._per_datastore_limit
+
+        def _is_ready(operation):
+            if (host_limit and operation.host is not None and
+                    host_count[operation.host] >= host_limit):
+                return False
+            if (ds_limit and operation.datastore is not None and
+                    ds_count[operation.datastore] >= ds_limit):
+                return False
+            return True
+
+        def _on_done(future):
+            with done_cond:
+                done.append(future)
+                done_cond.notify()
+
+        def _collect(wait):
+            with done_cond:
+                while wait and not done:
+                    done_cond.wait()
+                completed = list(done)
+                done.clear()
+
+            for future in completed:
+                index = in_flight.pop(future)
+                operation = taken[index]
+                host_count[operation.host] -= 1
+                ds_count[operation.datastore] -= 1
+                results[index] = future.result()
+
+        start = time.monotonic()
+        with futures.ThreadPoolExecutor(self._max_workers) as executor:
+
+            def _dispatch(index, operation):
+                host_count[operation.host] += 1
+                ds_count[operation.datastore] += 1
+                future = executor.submit(self._run_one, operation)
+                in_flight[future] = index
+                future.add_done_callback(_on_done)
+
+            while True:
+                _collect(wait=False)
+
+                # Dispatch the earliest operations whose resources have room.
+                skipped = collections.deque()
+                while pending and len(in_flight) < self._max_workers:
+                    index, operation = pending.popleft()
+                    if _is_ready(operation):
+                        _dispatch(index, operation)
+                    else:
+                        skipped.append((index, operation))
+                skipped.extend(pending)
+                pending = skipped
+
+                # Take more operations while workers and the buffer have room.
+                while (not exhausted and
+                       len(in_flight) < self._max_workers and
+                       len(pending) < self._max_workers):
+                    operation = next(operations, None)
+                    if operation is None:
+                        exhausted = True
+                        break
+                    index = len(taken)
+                    taken.append(operation)
+                    results.append(None)
+                    if _is_ready(operation):
+                        _dispatch(index, operation)
+                    else:
+                        pending.append((index, operation))
+
+                if not in_flight:
+                    # Operations are only held back by running ones, and
+                    # more are taken while workers are free.
+                    break
+                _collect(wait=True)
+
+        stats = BatchStats([r.elapsed for r in results],
+                           sum(1 for r in results if r.failed),
+                           time.monotonic() - start)
+        LOG.info("Batch completed: %s.", stats)
+        return results, stats
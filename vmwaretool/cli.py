@@ -1,23 +1,19 @@
 """Console script for vmwaretool."""
 import click
-import click_completion
 import logging as python_logging
 import os
-from oslo_config import cfg
-from oslo_log import log as logging
 import sys
-import urllib3
 
 import vmwaretool
 from vmwaretool import utils
-from vmwaretool import vmware_ops
 
-CONF = cfg.CONF
-LOG = logging.getLogger(utils.DOMAIN)
-logging.register_options(CONF)
-
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+# oslo.config, oslo.log and the oslo.vmware/suds stack take most of the
+# startup time, so they are imported by main() rather than here. This keeps
+# --help and shell completion fast.
+CONF = None
+LOG = None
 
+COMPLETE_VAR = '_VMWARETOOL_COMPLETE'
 
 
 def custom_startswith(string, incomplete):
@@ -28,8 +24,16 @@ def custom_startswith(string, incomplete):
     return string.startswith(incomplete)
 
 
-click_completion.core.startswith = custom_startswith
-click_completion.init()
+def init_completion():
+    import click_completion
+
+    click_completion.core.startswith = custom_startswith
+    click_completion.init()
+
+
+# click_completion is only needed when the shell asks for completions.
+if os.environ.get(COMPLETE_VAR):
+    init_completion()
 
 
 @click.command()
@@ -58,6 +62,16 @@ click_completion.init()
 def main(disable_spinner, config_file, loglevel):
     """Console script for vmwaretool."""
     global LOG, CONF
+    from oslo_config import cfg
+    from oslo_log import log as logging
+    import urllib3
+
+    from vmwaretool import vmware_ops
+
+    CONF = cfg.CONF
+    LOG = logging.getLogger(utils.DOMAIN)
+    logging.register_options(CONF)
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
     click.echo("config_file = {}".format(config_file))
     if config_file != utils.DEFAULT_CONFIG_FILE:
@@ -71,17 +85,22 @@ def main(disable_spinner, config_file, loglevel):
 
     # CONF.log_opt_values(LOG, utils.LOG_LEVELS[loglevel])
 
-    session, _volumeops = vmware_ops.setup_connection()
-
-    cluster_name = CONF.vmware.vmware_cluster_name
-    if cluster_name:
-        clusters = _volumeops.get_cluster_refs(cluster_name).values()
-        LOG.info("CLUSTERS {}".format(clusters))
-        for c in clusters:
-            piss = _volumeops.get_cluster_custom_attributes(c)
-            LOG.info("CUSTOM ATTRIBUTES = {}".format(piss))
-            hosts = _volumeops.get_cluster_hosts(c)
-            LOG.info("hosts = {}".format(hosts))
+    session, _volumeops, _ds_sel = vmware_ops.setup_connection()
+    try:
+        cluster_name = CONF.vmware.vmware_cluster_name
+        if cluster_name:
+            # One property collector query for all clusters instead of a
+            # few round trips per cluster.
+            _volumeops.build_inventory_snapshot()
+            clusters = _volumeops.get_cluster_refs(cluster_name).values()
+            LOG.info("CLUSTERS {}".format(clusters))
+            for c in clusters:
+                piss = _volumeops.get_cluster_custom_attributes(c)
+                LOG.info("CUSTOM ATTRIBUTES = {}".format(piss))
+                hosts = _volumeops.get_cluster_hosts(c)
+                LOG.info("hosts = {}".format(hosts))
+    finally:
+        vmware_ops.close_connection(session, _ds_sel)
 
 
 
@@ -18,17 +18,33 @@ Classes and utility methods for datastore selection.
 """
 
 import random
+import threading
+import time
 
 from oslo_log import log as logging
+from oslo_vmware import exceptions
 from oslo_vmware import pbm
 from oslo_vmware import vim_util
 
-from cinder import coordination
-from cinder.volume.drivers.vmware import exceptions as vmdk_exceptions
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from vmwaretool import exceptions as vmdk_exceptions
+from vmwaretool import retrieval
 
 
 LOG = logging.getLogger(__name__)
 
+# Age in seconds beyond which the datastore mirror is not trusted. The mirror
+# is normally in sync at least once per WaitForUpdatesEx wait period.
+DEFAULT_MIRROR_MAX_STALENESS = 120
+# Compliance entries expire after the TTL and are re-evaluated in the
+# background well before that.
+DEFAULT_COMPLIANCE_TTL = 300
+DEFAULT_COMPLIANCE_REFRESH_INTERVAL = 120
+
 
 class DatastoreType(object):
     """Supported datastore types."""
@@ -46,6 +62,672 @@ class DatastoreType(object):
         return DatastoreType._ALL_TYPES
 
 
+class _RoundTripCounter(object):
+    """Number of vCenter calls made by a single datastore selection."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def add(self, count=1):
+        # Page retrievals may be counted from a prefetch thread.
+        with self._lock:
+            self.count += count
+
+
+class DatastoreMirror(object):
+    """In-memory mirror of datastore 'host' and 'summary' properties.
+
+    The mirror is filled once through a dedicated property collector and then
+    kept current by a background thread which applies the incremental
+    property changes returned by WaitForUpdatesEx. It is intended to be
+    long-lived and shared by DatastoreSelector instances so that datastore
+    selection does not page through the whole inventory on every call.
+
+    The session must be a dedicated VMwareAPISession, not a PooledSession:
+    the property collector only exists on the session which created it, and
+    the background thread's long-polling calls would hold a shared session.
+    """
+
+    PROPERTIES = ['host', 'summary']
+
+    def __init__(self, session, max_objects, wait_seconds=30,
+                 retry_interval=5):
+        self._session = session
+        self._max_objects = max_objects
+        self._wait_seconds = wait_seconds
+        self._retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._datastores = {}
+        self._collector = None
+        self._version = None
+        self._last_sync = None
+        self._update_lag = 0.0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def version(self):
+        """Property collector data version of the mirrored state."""
+        return self._version
+
+    @property
+    def staleness(self):
+        """Seconds since the mirror was last known to be in sync."""
+        if self._last_sync is None:
+            return None
+        return time.monotonic() - self._last_sync
+
+    @property
+    def update_lag(self):
+        """Seconds taken to make the most recent update set visible.
+
+        This is measured from the time the WaitForUpdatesEx call which
+        returned the changes was issued to the time the changes were applied
+        to the mirror.
+        """
+        return self._update_lag
+
+    def get_session(self):
+        return self._session
+
+    def is_ready(self):
+        return self._version is not None
+
+    def get_stats(self):
+        return {'version': self._version,
+                'staleness': self.staleness,
+                'update_lag': self._update_lag,
+                'datastores': len(self._datastores)}
+
+    def start(self):
+        """Do the initial fill and start applying incremental updates."""
+        self._fill()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='datastore-mirror',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            # Return from a pending WaitForUpdatesEx instead of waiting for
+            # it to time out.
+            self._cancel_wait()
+            self._thread.join()
+            self._thread = None
+        self._destroy_collector()
+
+    def _cancel_wait(self):
+        collector = self._collector
+        if collector is None:
+            return
+        try:
+            self._session.invoke_api(self._session.vim,
+                                     'CancelWaitForUpdates', collector)
+        except exceptions.VimException:
+            LOG.debug("Error cancelling wait for updates on property "
+                      "collector: %s.", collector, exc_info=True)
+
+    def get_datastores(self):
+        """Return mirrored datastores in the format of _get_datastores.
+
+        The host mount lists are copied since callers may reorder them.
+        """
+        with self._lock:
+            return {ref: {name: (list(val) if name == 'host' else val)
+                          for name, val in props.items()}
+                    for ref, props in self._datastores.values()}
+
+    def _create_collector(self):
+        vim = self._session.vim
+        cf = vim.client.factory
+        collector = self._session.invoke_api(
+            vim, 'CreatePropertyCollector',
+            vim.service_content.propertyCollector)
+
+        traversal_spec = vim_util.build_recursive_traversal_spec(cf)
+        object_spec = vim_util.build_object_spec(
+            cf, vim.service_content.rootFolder, [traversal_spec])
+        property_spec = vim_util.build_property_spec(
+            cf, type_='Datastore', properties_to_collect=self.PROPERTIES)
+        filter_spec = vim_util.build_property_filter_spec(
+            cf, [property_spec], [object_spec])
+        self._session.invoke_api(vim, 'CreateFilter', collector,
+                                 spec=filter_spec, partialUpdates=False)
+        self._collector = collector
+
+    def _destroy_collector(self):
+        if self._collector is None:
+            return
+        try:
+            self._session.invoke_api(self._session.vim,
+                                     'DestroyPropertyCollector',
+                                     self._collector)
+        except exceptions.VimException:
+            LOG.debug("Error destroying property collector: %s.",
+                      self._collector, exc_info=True)
+        self._collector = None
+
+    def _wait_for_updates(self, version, wait_seconds):
+        cf = self._session.vim.client.factory
+        options = cf.create('ns0:WaitOptions')
+        options.maxWaitSeconds = wait_seconds
+        options.maxObjectUpdates = self._max_objects
+        return self._session.invoke_api(self._session.vim,
+                                        'WaitForUpdatesEx',
+                                        self._collector,
+                                        version=version,
+                                        options=options)
+
+    def _fill(self):
+        """Load the full datastore state with a fresh property collector."""
+        LOG.debug("Filling datastore mirror.")
+        self._destroy_collector()
+        self._create_collector()
+        with self._lock:
+            self._datastores = {}
+            self._version = None
+
+        version = ''
+        while True:
+            update_set = self._wait_for_updates(version, 0)
+            if not update_set:
+                break
+            self._apply_update_set(update_set)
+            version = update_set.version
+            if not getattr(update_set, 'truncated', False):
+                break
+
+        with self._lock:
+            self._version = version
+        self._last_sync = time.monotonic()
+        LOG.debug("Datastore mirror filled with %(count)d datastores at "
+                  "version: %(version)s.",
+                  {'count': len(self._datastores), 'version': version})
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                start = time.monotonic()
+                update_set = self._wait_for_updates(self._version,
+                                                    self._wait_seconds)
+                if update_set:
+                    self._apply_update_set(update_set)
+                    with self._lock:
+                        self._version = update_set.version
+                    self._update_lag = time.monotonic() - start
+                    LOG.debug("Datastore mirror updated to version: %s.",
+                              self._version)
+                self._last_sync = time.monotonic()
+            except Exception:
+                # Any error, not only VIM faults, must not end the thread
+                # while the mirror still claims to be ready.
+                LOG.warning("Error waiting for datastore updates; refilling "
+                            "the mirror.", exc_info=True)
+                if self._stop_event.wait(self._retry_interval):
+                    break
+                try:
+                    self._fill()
+                except Exception:
+                    LOG.warning("Error refilling the datastore mirror.",
+                                exc_info=True)
+
+    def _apply_update_set(self, update_set):
+        refetch = []
+        with self._lock:
+            for filter_update in getattr(update_set, 'filterSet', None) or []:
+                for obj_update in filter_update.objectSet:
+                    ds_ref = obj_update.obj
+                    if obj_update.kind == 'leave':
+                        self._datastores.pop(ds_ref.value, None)
+                        continue
+
+                    entry = self._datastores.setdefault(ds_ref.value,
+                                                        (ds_ref, {}))
+                    props = entry[1]
+                    for change in getattr(obj_update, 'changeSet', None) or []:
+                        if not self._apply_change(props, change):
+                            refetch.append(ds_ref)
+                            break
+
+        for ds_ref in refetch:
+            self._refetch(ds_ref)
+
+    @staticmethod
+    def _apply_change(props, change):
+        """Apply a property change; return False if it cannot be applied."""
+        if change.name not in DatastoreMirror.PROPERTIES:
+            # Partial change of a nested or indexed path.
+            return False
+
+        if change.op in ('remove', 'indirectRemove'):
+            props.pop(change.name, None)
+            return True
+
+        val = getattr(change, 'val', None)
+        if change.name == 'host':
+            val = (list(val.DatastoreHostMount)
+                   if hasattr(val, 'DatastoreHostMount') else [])
+        props[change.name] = val
+        return True
+
+    def _refetch(self, ds_ref):
+        LOG.debug("Refetching properties of datastore: %s.", ds_ref)
+        result = self._session.invoke_api(vim_util,
+                                          'get_object_properties_dict',
+                                          self._session.vim,
+                                          ds_ref,
+                                          self.PROPERTIES)
+        if 'host' in result:
+            host = result['host']
+            result['host'] = (list(host.DatastoreHostMount)
+                              if hasattr(host, 'DatastoreHostMount') else [])
+        with self._lock:
+            self._datastores[ds_ref.value] = (ds_ref, result)
+
+
+class DatastorePlacementEngine(object):
+    """Columnar datastore filtering and ranking.
+
+    Capacity, free space, type, maintenance state and accessibility of the
+    datastores are kept in NumPy arrays and host connectivity in boolean
+    datastore x host matrices, so that the filters and the
+    (-len(host), space utilization) ranking of DatastoreSelector run as
+    vectorized operations. Datastores keep the order of the input map, which
+    makes the ranking identical to the one of _select_best_datastore.
+
+    The engine is not modified once built, so that concurrent selections can
+    share it; host usability is passed to select by the caller.
+
+    Requires NumPy.
+    """
+
+    _TYPES = sorted(DatastoreType.get_all_types())
+
+    def __init__(self, vops, datastores):
+        """Build the columns from a map of datastore refs to properties.
+
+        :param vops: VMwareVolumeOps instance
+        :param datastores: map of datastore references to their 'host' and
+                           'summary' properties as returned by
+                           DatastoreSelector._get_datastores
+        """
+        if np is None:
+            raise RuntimeError("NumPy is required for the datastore "
+                               "placement engine.")
+
+        self._refs = []
+        self._props = []
+        for ds_ref, ds_props in datastores.items():
+            self._refs.append(ds_ref)
+            self._props.append(ds_props)
+
+        count = len(self._refs)
+        self._ref_values = np.array([ref.value for ref in self._refs],
+                                    dtype=object)
+        self._names = []
+        present = np.zeros(count, dtype=bool)
+        capacity = np.zeros(count, dtype=np.float64)
+        free_space = np.zeros(count, dtype=np.float64)
+        type_codes = np.full(count, -1, dtype=np.int8)
+        in_maintenance = np.zeros(count, dtype=bool)
+        accessible = np.zeros(count, dtype=bool)
+        mount_count = np.zeros(count, dtype=np.int64)
+
+        type_index = {t: i for i, t in enumerate(self._TYPES)}
+        self._host_refs = []
+        host_index = {}
+        mounted_cells = []
+        usable_cells = []
+        for i, ds_props in enumerate(self._props):
+            summary = ds_props.get('summary')
+            host_mounts = ds_props.get('host')
+            if summary is None or host_mounts is None:
+                self._names.append(None)
+                continue
+
+            present[i] = True
+            self._names.append(summary.name)
+            capacity[i] = summary.capacity
+            free_space[i] = summary.freeSpace
+            type_codes[i] = type_index.get(summary.type.lower(), -1)
+            in_maintenance[i] = vops._in_maintenance(summary)
+            accessible[i] = bool(summary.accessible)
+            mount_count[i] = len(host_mounts)
+            for host_mount in host_mounts:
+                host_ref = host_mount.key
+                j = host_index.get(host_ref.value)
+                if j is None:
+                    j = len(self._host_refs)
+                    host_index[host_ref.value] = j
+                    self._host_refs.append(host_ref)
+                mounted_cells.append((i, j))
+                if vops._is_usable(host_mount.mountInfo):
+                    usable_cells.append((i, j))
+
+        self._host_index = host_index
+        self._present = present
+        self._capacity = capacity
+        self._free_space = free_space
+        self._type_codes = type_codes
+        self._in_maintenance = in_maintenance
+        self._accessible = accessible
+        self._mount_count = mount_count
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self._utilization = 1.0 - (free_space / capacity)
+
+        shape = (count, len(self._host_refs))
+        self._mounted = self._to_matrix(shape, mounted_cells)
+        self._usable_mount = self._to_matrix(shape, usable_cells)
+        self._regex_masks = {}
+        self._regex_lock = threading.Lock()
+
+    @staticmethod
+    def _to_matrix(shape, cells):
+        matrix = np.zeros(shape, dtype=bool)
+        if cells:
+            rows, cols = zip(*cells)
+            matrix[list(rows), list(cols)] = True
+        return matrix
+
+    def __len__(self):
+        return len(self._refs)
+
+    def _host_columns(self, host_refs):
+        cols = [self._host_index[ref.value] for ref in host_refs
+                if ref.value in self._host_index]
+        return np.array(cols, dtype=np.int64)
+
+    def _valid_host_mask(self, valid_host_refs):
+        if not valid_host_refs:
+            return np.ones(len(self._host_refs), dtype=bool)
+        mask = np.zeros(len(self._host_refs), dtype=bool)
+        mask[self._host_columns(valid_host_refs)] = True
+        return mask
+
+    def _regex_mask(self, ds_regex):
+        with self._regex_lock:
+            mask = self._regex_masks.get(ds_regex.pattern)
+            if mask is None:
+                mask = np.array(
+                    [name is not None and bool(ds_regex.match(name))
+                     for name in self._names], dtype=bool)
+                self._regex_masks[ds_regex.pattern] = mask
+        return mask
+
+    def filter(self, size_bytes, hard_anti_affinity_ds=None,
+               hard_affinity_ds_types=None, valid_host_refs=None,
+               ds_regex=None):
+        """Return a boolean mask of datastores passing the filters.
+
+        The filters are those of DatastoreSelector._filter_datastores except
+        for the storage profile filter which needs PBM.
+        """
+        mask = (self._present &
+                (self._capacity != 0) &
+                (self._free_space >= size_bytes) &
+                self._accessible &
+                ~self._in_maintenance &
+                (self._type_codes >= 0))
+
+        if hard_affinity_ds_types is not None:
+            codes = [i for i, t in enumerate(self._TYPES)
+                     if t in hard_affinity_ds_types]
+            mask &= np.isin(self._type_codes, codes)
+
+        if ds_regex:
+            mask &= self._regex_mask(ds_regex)
+
+        if hard_anti_affinity_ds:
+            mask &= ~np.isin(self._ref_values, list(hard_anti_affinity_ds))
+
+        if valid_host_refs:
+            cols = self._host_columns(valid_host_refs)
+            mask &= self._mounted[:, cols].any(axis=1)
+
+        return mask
+
+    def get_datastores(self, mask):
+        """Return the map of datastore refs to properties selected by mask."""
+        return {self._refs[i]: self._props[i] for i in np.flatnonzero(mask)}
+
+    def mask_from_datastores(self, datastores):
+        values = [ref.value for ref in datastores]
+        return np.isin(self._ref_values, values)
+
+    def rank(self, mask):
+        """Return indices of the masked datastores, best first.
+
+        Datastores connected to more hosts come first; ties are broken by
+        lower space utilization.
+        """
+        idx = np.flatnonzero(mask)
+        order = np.lexsort((self._utilization[idx], -self._mount_count[idx]))
+        return idx[order]
+
+    def get_candidate_hosts(self, mask, valid_host_refs=None):
+        """Return hosts with a usable mount of any of the masked datastores."""
+        cols = (self._usable_mount[mask].any(axis=0) &
+                self._valid_host_mask(valid_host_refs))
+        return [self._host_refs[j] for j in np.flatnonzero(cols)]
+
+    def get_host_usable_mask(self, host_prop_map):
+        """Return a boolean mask of hosts which are usable for placement.
+
+        :param host_prop_map: dictionary of host reference value to its
+                              'runtime' and 'parent' properties
+        """
+        host_usable = np.zeros(len(self._host_refs), dtype=bool)
+        for value, props in host_prop_map.items():
+            j = self._host_index.get(value)
+            if j is None:
+                continue
+            runtime = (props or {}).get('runtime')
+            parent = (props or {}).get('parent')
+            host_usable[j] = bool(
+                runtime and parent and
+                runtime.connectionState == 'connected' and
+                not runtime.inMaintenanceMode)
+        return host_usable
+
+    def select(self, ranked, host_usable, valid_host_refs=None):
+        """Select the first ranked datastore having a usable host.
+
+        :param ranked: datastore indices as returned by rank
+        :param host_usable: host mask as returned by get_host_usable_mask
+        :param valid_host_refs: hosts to consider
+        :return: (datastore index, list of usable host refs) or None
+        """
+        if len(ranked) == 0:
+            return None
+        host_mask = host_usable & self._valid_host_mask(valid_host_refs)
+        candidates = self._usable_mount[ranked] & host_mask
+        has_host = candidates.any(axis=1)
+        if not has_host.any():
+            return None
+        pos = int(np.argmax(has_host))
+        hosts = [self._host_refs[j] for j in np.flatnonzero(candidates[pos])]
+        return int(ranked[pos]), hosts
+
+    def get_summary(self, index):
+        return self._props[index]['summary']
+
+
+class ProfileComplianceCache(object):
+    """Cached storage profile x datastore compliance matrix.
+
+    For every profile the cache remembers which datastores were checked
+    against PBM and which of them are compliant, so that repeated checks are
+    local lookups. Entries expire after ttl seconds. A background thread,
+    started when the first entry is cached, re-evaluates all cached profiles
+    every refresh_interval seconds so that entries are kept fresh without
+    blocking callers; a refresh_interval of None or 0 disables it. Call
+    stop() to end the thread.
+    """
+
+    def __init__(self, session, ttl=DEFAULT_COMPLIANCE_TTL,
+                 refresh_interval=DEFAULT_COMPLIANCE_REFRESH_INTERVAL):
+        self._session = session
+        self._ttl = ttl
+        self._refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._hits = 0
+        self._misses = 0
+        self._refreshes = 0
+        self._last_refresh_latency = None
+        self._total_refresh_latency = 0.0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _get_key(profile_id):
+        return getattr(profile_id, 'uniqueId', profile_id)
+
+    def start(self):
+        """Start refreshing cached profiles in the background."""
+        with self._lock:
+            self._stop_event.clear()
+            self._start_thread()
+
+    def _start_thread(self):
+        if not self._refresh_interval or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run,
+                                        name='profile-compliance-refresh',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the refresh thread; it is not restarted by later lookups."""
+        self._stop_event.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+            self._thread = None
+
+    def invalidate(self, profile_id=None):
+        """Drop cached compliance of the given profile or of all profiles."""
+        with self._lock:
+            if profile_id is None:
+                self._entries = {}
+            else:
+                self._entries.pop(self._get_key(profile_id), None)
+
+    def get_stats(self):
+        refreshes = self._refreshes
+        return {'hits': self._hits,
+                'misses': self._misses,
+                'refreshes': refreshes,
+                'profiles': len(self._entries),
+                'last_refresh_latency': self._last_refresh_latency,
+                'avg_refresh_latency': (self._total_refresh_latency /
+                                        refreshes if refreshes else None)}
+
+    def get_compliant_datastores(self, datastores, profile_id,
+                                 on_query=None):
+        """Return values of the given datastores compliant with the profile.
+
+        :param datastores: datastore references
+        :param profile_id: PBM profile ID
+        :param on_query: called without arguments before querying PBM
+        :return: set of compliant datastore reference values
+        """
+        datastores = list(datastores)
+        key = self._get_key(profile_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_fresh(entry):
+                missing = [ds for ds in datastores
+                           if ds.value not in entry['checked']]
+            else:
+                entry = None
+                missing = datastores
+
+            if not missing and entry is not None:
+                self._hits += 1
+                return {ds.value for ds in datastores
+                        if ds.value in entry['compliant']}
+            self._misses += 1
+
+        if on_query is not None:
+            on_query()
+        compliant = self._query(missing, profile_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not self._is_fresh(entry):
+                entry = {'profile_id': profile_id,
+                         'checked': {},
+                         'compliant': set(),
+                         'refreshed_at': time.monotonic()}
+                self._entries[key] = entry
+            for ds in missing:
+                entry['checked'][ds.value] = ds
+            entry['compliant'].update(compliant)
+            if not self._stop_event.is_set():
+                self._start_thread()
+            return {ds.value for ds in datastores
+                    if ds.value in entry['compliant']}
+
+    def _is_fresh(self, entry):
+        return time.monotonic() - entry['refreshed_at'] < self._ttl
+
+    def _query(self, datastores, profile_id):
+        if not datastores:
+            return set()
+        cf = self._session.pbm.client.factory
+        hubs = pbm.convert_datastores_to_hubs(cf, datastores)
+        hubs = pbm.filter_hubs_by_profile(self._session, hubs, profile_id)
+        return {hub.hubId for hub in hubs}
+
+    def refresh(self):
+        """Re-evaluate compliance of all cached profiles.
+
+        Datastores checked while a profile is being refreshed keep their
+        result, and profiles invalidated meanwhile are not brought back.
+        """
+        with self._lock:
+            entries = list(self._entries.items())
+
+        for key, entry in entries:
+            start = time.monotonic()
+            with self._lock:
+                datastores = list(entry['checked'].values())
+            compliant = self._query(datastores, entry['profile_id'])
+            latency = time.monotonic() - start
+            refreshed = {ds.value for ds in datastores}
+            with self._lock:
+                current = self._entries.get(key)
+                if current is not None:
+                    checked = dict(current['checked'])
+                    self._entries[key] = {
+                        'profile_id': current['profile_id'],
+                        'checked': checked,
+                        'compliant': ((current['compliant'] - refreshed) |
+                                      (compliant & checked.keys())),
+                        'refreshed_at': time.monotonic()}
+                self._refreshes += 1
+                self._last_refresh_latency = latency
+                self._total_refresh_latency += latency
+            LOG.debug("Refreshed compliance of %(count)d datastores against "
+                      "profile: %(profile)s in %(latency).3f seconds.",
+                      {'count': len(datastores),
+                       'profile': key,
+                       'latency': latency})
+
+    def _run(self):
+        while not self._stop_event.wait(self._refresh_interval):
+            try:
+                self.refresh()
+            except Exception:
+                # Keep the thread alive; entries expire after the TTL if
+                # refreshes keep failing.
+                LOG.warning("Error refreshing profile compliance cache.",
+                            exc_info=True)
+
+
 class DatastoreSelector(object):
     """Class for selecting datastores which satisfy input requirements."""
 
@@ -56,35 +738,120 @@ class DatastoreSelector(object):
 
     # TODO(vbala) Remove dependency on volumeops.
     def __init__(self, vops, session, max_objects, ds_regex=None,
-                 random_ds=False, random_ds_range=None):
+                 random_ds=False, random_ds_range=None, mirror=None,
+                 vectorized=False, compliance_cache=None,
+                 missing_profile_ttl=30, page_sizer=None,
+                 mirror_max_staleness=DEFAULT_MIRROR_MAX_STALENESS):
         self._vops = vops
         self._session = session
         self._max_objects = max_objects
+        self._page_sizer = page_sizer
         self._ds_regex = ds_regex
         self._profile_id_cache = {}
+        self._missing_profiles = {}
+        self._missing_profile_ttl = missing_profile_ttl
+        self._profile_lock = threading.Lock()
         self._random_ds = random_ds
         self._random_ds_range = random_ds_range
+        self._mirror = mirror
+        self._mirror_max_staleness = mirror_max_staleness
+        self._compliance_cache = compliance_cache
+        self._vectorized = vectorized and np is not None
+        # (mirror version, engine), replaced as a whole
+        self._engine = None
+        # Round trip counter of the selection running on the current thread
+        self._local = threading.local()
+
+    def get_mirror(self):
+        return self._mirror
+
+    def close(self):
+        """Stop the background threads used by the selector.
+
+        The mirror may be shared with other selectors and is stopped by its
+        owner.
+        """
+        if self._compliance_cache is not None:
+            self._compliance_cache.stop()
+
+    def _count_round_trip(self):
+        counter = getattr(self._local, 'round_trips', None)
+        if counter is not None:
+            counter.add()
+
+    def _invoke_api(self, *args, **kwargs):
+        self._count_round_trip()
+        return self._session.invoke_api(*args, **kwargs)
+
+    def _get_invoke_api(self):
+        """Get an invoke_api which counts calls made from any thread."""
+        counter = getattr(self._local, 'round_trips', None)
+
+        def _invoke_api(*args, **kwargs):
+            if counter is not None:
+                counter.add()
+            return self._session.invoke_api(*args, **kwargs)
+
+        return _invoke_api
+
+    def preload_profile_ids(self):
+        """Cache the IDs of all storage profiles with a single PBM query.
+
+        :return: number of profiles found
+        """
+        self._count_round_trip()
+        profiles = pbm.get_all_profiles(self._session)
+
+        # Readers access the cache without locking, so replace it as a whole.
+        profile_id_cache = dict(self._profile_id_cache)
+        for profile in profiles:
+            profile_id_cache[profile.name] = profile.profileId
+        self._profile_id_cache = profile_id_cache
+        self._missing_profiles = {
+            name: expiry for name, expiry in self._missing_profiles.items()
+            if name not in profile_id_cache}
+        LOG.debug("Cached IDs of %d storage profiles.", len(profiles))
+        return len(profiles)
+
+    def _is_known_missing(self, profile_name):
+        expiry = self._missing_profiles.get(profile_name)
+        return expiry is not None and expiry > time.monotonic()
 
-    @coordination.synchronized('vmware-datastore-profile-{profile_name}')
     def get_profile_id(self, profile_name):
         """Get vCenter profile ID for the given profile name.
 
+        Cached IDs are returned without locking. A miss reloads all profile
+        IDs under a lock, and profiles which cannot be found are remembered
+        for missing_profile_ttl seconds.
+
         :param profile_name: profile name
         :return: vCenter profile ID
         :raises ProfileNotFoundException:
         """
-        if profile_name in self._profile_id_cache:
+        profile_id = self._profile_id_cache.get(profile_name)
+        if profile_id is not None:
             LOG.debug("Returning cached ID for profile: %s.", profile_name)
-            return self._profile_id_cache[profile_name]
+            return profile_id
+
+        if not self._is_known_missing(profile_name):
+            with self._profile_lock:
+                # Another thread might have filled the cache while we were
+                # waiting for the lock.
+                profile_id = self._profile_id_cache.get(profile_name)
+                if (profile_id is None and
+                        not self._is_known_missing(profile_name)):
+                    self.preload_profile_ids()
+                    profile_id = self._profile_id_cache.get(profile_name)
+                    if profile_id is None:
+                        self._missing_profiles[profile_name] = (
+                            time.monotonic() + self._missing_profile_ttl)
 
-        profile_id = pbm.get_profile_id_by_name(self._session, profile_name)
         if profile_id is None:
             LOG.error("Storage profile: %s cannot be found in vCenter.",
                       profile_name)
             raise vmdk_exceptions.ProfileNotFoundException(
                 storage_profile=profile_name)
 
-        self._profile_id_cache[profile_name] = profile_id
         LOG.debug("Storage profile: %(name)s resolved to vCenter profile ID: "
                   "%(id)s.",
                   {'name': profile_name,
@@ -93,8 +860,17 @@ class DatastoreSelector(object):
 
     def _filter_by_profile(self, datastores, profile_id):
         """Filter out input datastores that do not match the given profile."""
+        if self._compliance_cache is not None:
+            compliant = self._compliance_cache.get_compliant_datastores(
+                datastores, profile_id, on_query=self._count_round_trip)
+            LOG.debug("Profile compliance cache stats: %s.",
+                      self._compliance_cache.get_stats())
+            return {k: v for k, v in datastores.items()
+                    if k.value in compliant}
+
         cf = self._session.pbm.client.factory
         hubs = pbm.convert_datastores_to_hubs(cf, datastores)
+        self._count_round_trip()
         hubs = pbm.filter_hubs_by_profile(self._session, hubs, profile_id)
         hub_ids = [hub.hubId for hub in hubs]
         return {k: v for k, v in datastores.items() if k.value in hub_ids}
@@ -166,47 +942,86 @@ class DatastoreSelector(object):
                 props = {prop.name: prop.val for prop in prop_set}
         return props
 
+    def _use_mirror(self):
+        """Whether the mirror is filled and was recently in sync."""
+        if self._mirror is None or not self._mirror.is_ready():
+            return False
+        staleness = self._mirror.staleness
+        if staleness is None or staleness > self._mirror_max_staleness:
+            LOG.warning("Datastore mirror is %s seconds stale; querying "
+                        "datastores instead.", staleness)
+            return False
+        return True
+
     def _get_datastores(self):
-        datastores = {}
-        retrieve_result = self._session.invoke_api(
-            vim_util,
-            'get_objects',
-            self._session.vim,
-            'Datastore',
-            self._max_objects,
-            properties_to_collect=['host', 'summary'])
+        if self._use_mirror():
+            LOG.debug("Using datastore mirror: %s.", self._mirror.get_stats())
+            return self._mirror.get_datastores()
 
-        while retrieve_result:
-            if retrieve_result.objects:
-                for obj_content in retrieve_result.objects:
-                    props = self._get_object_properties(obj_content)
-                    if ('host' in props and
-                            hasattr(props['host'], 'DatastoreHostMount')):
-                        props['host'] = props['host'].DatastoreHostMount
-                    datastores[obj_content.obj] = props
-            retrieve_result = self._session.invoke_api(vim_util,
-                                                       'continue_retrieval',
-                                                       self._session.vim,
-                                                       retrieve_result)
+        datastores = {}
+        for obj_content in retrieval.retrieve_objects(
+                self._session,
+                'Datastore',
+                self._max_objects,
+                properties_to_collect=['host', 'summary'],
+                page_sizer=self._page_sizer,
+                invoke_api=self._get_invoke_api()):
+            props = self._get_object_properties(obj_content)
+            if ('host' in props and
+                    hasattr(props['host'], 'DatastoreHostMount')):
+                props['host'] = props['host'].DatastoreHostMount
+            datastores[obj_content.obj] = props
 
         return datastores
 
     def _get_host_properties(self, host_ref):
-        retrieve_result = self._session.invoke_api(vim_util,
-                                                   'get_object_properties',
-                                                   self._session.vim,
-                                                   host_ref,
-                                                   ['runtime', 'parent'])
+        retrieve_result = self._invoke_api(vim_util,
+                                           'get_object_properties',
+                                           self._session.vim,
+                                           host_ref,
+                                           ['runtime', 'parent'])
 
         if retrieve_result:
             return self._get_object_properties(retrieve_result[0])
 
+    def _get_hosts_properties(self, host_refs):
+        """Get 'runtime' and 'parent' of the given hosts in bulk.
+
+        :param host_refs: list of host references
+        :return: dictionary of host reference value to its properties
+        """
+        host_prop_map = {}
+        if not host_refs:
+            return host_prop_map
+
+        retrieve_result = self._invoke_api(
+            vim_util,
+            'get_properties_for_a_collection_of_objects',
+            self._session.vim,
+            'HostSystem',
+            host_refs,
+            ['runtime', 'parent'],
+            max_objects=self._max_objects)
+
+        while retrieve_result:
+            if retrieve_result.objects:
+                for obj_content in retrieve_result.objects:
+                    host_prop_map[obj_content.obj.value] = (
+                        self._get_object_properties(obj_content))
+            if not getattr(retrieve_result, 'token', None):
+                break
+            retrieve_result = self._invoke_api(vim_util,
+                                               'continue_retrieval',
+                                               self._session.vim,
+                                               retrieve_result)
+        return host_prop_map
+
     def _get_resource_pool(self, cluster_ref):
-        return self._session.invoke_api(vim_util,
-                                        'get_object_property',
-                                        self._session.vim,
-                                        cluster_ref,
-                                        'resourcePool')
+        return self._invoke_api(vim_util,
+                                'get_object_property',
+                                self._session.vim,
+                                cluster_ref,
+                                'resourcePool')
 
     def _select_best_datastore(self, datastores, valid_host_refs=None):
 
@@ -220,14 +1035,16 @@ class DatastoreSelector(object):
                                  (summary.freeSpace / float(summary.capacity)))
             return (-len(host), space_utilization)
 
-        host_prop_map = {}
+        valid_host_refs = valid_host_refs or []
+        valid_hosts = [host_ref.value for host_ref in valid_host_refs]
 
-        def _is_host_usable(host_ref):
-            props = host_prop_map.get(host_ref.value)
-            if props is None:
-                props = self._get_host_properties(host_ref)
-                host_prop_map[host_ref.value] = props
+        def _is_candidate(host_mount):
+            if valid_hosts and host_mount.key.value not in valid_hosts:
+                return False
+            return self._vops._is_usable(host_mount.mountInfo)
 
+        def _is_host_usable(host_ref):
+            props = host_prop_map.get(host_ref.value) or {}
             runtime = props.get('runtime')
             parent = props.get('parent')
             if runtime and parent:
@@ -236,16 +1053,11 @@ class DatastoreSelector(object):
             else:
                 return False
 
-        valid_host_refs = valid_host_refs or []
-        valid_hosts = [host_ref.value for host_ref in valid_host_refs]
-
         def _select_host(host_mounts):
             random.shuffle(host_mounts)
             for host_mount in host_mounts:
-                if valid_hosts and host_mount.key.value not in valid_hosts:
-                    continue
-                if (self._vops._is_usable(host_mount.mountInfo) and
-                        _is_host_usable(host_mount.key)):
+                if _is_candidate(host_mount) and _is_host_usable(
+                        host_mount.key):
                     return host_mount.key
 
         sorted_ds_props = sorted(datastores.values(), key=_sort_key)
@@ -255,6 +1067,17 @@ class DatastoreSelector(object):
                 sorted_ds_props = sorted_ds_props[:self._random_ds_range]
             random.shuffle(sorted_ds_props)
 
+        # Fetch properties of all candidate hosts upfront so that the
+        # selection loop below does not need any round trips.
+        candidate_hosts = {}
+        for ds_props in sorted_ds_props:
+            for host_mount in ds_props['host']:
+                if _is_candidate(host_mount):
+                    candidate_hosts.setdefault(host_mount.key.value,
+                                               host_mount.key)
+        host_prop_map = self._get_hosts_properties(
+            list(candidate_hosts.values()))
+
         for ds_props in sorted_ds_props:
             host_ref = _select_host(ds_props['host'])
             if host_ref:
@@ -262,6 +1085,63 @@ class DatastoreSelector(object):
                     host_prop_map[host_ref.value]['parent'])
                 return (host_ref, rp, ds_props['summary'])
 
+    def _get_placement_engine(self):
+        """Get the engine for the current mirror version.
+
+        Only used while the mirror is usable; without it, building the
+        engine on every selection costs more than the Python path.
+        """
+        version = self._mirror.version
+        cached = self._engine
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        engine = DatastorePlacementEngine(self._vops, self._get_datastores())
+        self._engine = (version, engine)
+        return engine
+
+    def _select_datastore_vectorized(self,
+                                     size_bytes,
+                                     profile_id,
+                                     hard_anti_affinity_ds,
+                                     hard_affinity_ds_types,
+                                     valid_host_refs=None):
+        engine = self._get_placement_engine()
+        mask = engine.filter(size_bytes,
+                             hard_anti_affinity_ds=hard_anti_affinity_ds,
+                             hard_affinity_ds_types=hard_affinity_ds_types,
+                             valid_host_refs=valid_host_refs,
+                             ds_regex=self._ds_regex)
+        if mask.any() and profile_id:
+            datastores = self._filter_by_profile(engine.get_datastores(mask),
+                                                 profile_id)
+            mask &= engine.mask_from_datastores(datastores)
+        if not mask.any():
+            return
+
+        ranked = engine.rank(mask)
+        if self._random_ds:
+            LOG.debug('Shuffling best datastore selection.')
+            if self._random_ds_range:
+                ranked = ranked[:self._random_ds_range]
+            ranked = ranked.copy()
+            np.random.shuffle(ranked)
+
+        ranked_mask = np.zeros(len(engine), dtype=bool)
+        ranked_mask[ranked] = True
+        host_prop_map = self._get_hosts_properties(
+            engine.get_candidate_hosts(ranked_mask, valid_host_refs))
+
+        selected = engine.select(ranked,
+                                 engine.get_host_usable_mask(host_prop_map),
+                                 valid_host_refs)
+        if selected:
+            index, host_refs = selected
+            host_ref = random.choice(host_refs)
+            rp = self._get_resource_pool(
+                host_prop_map[host_ref.value]['parent'])
+            return (host_ref, rp, engine.get_summary(index))
+
     def select_datastore(self, req, hosts=None):
         """Selects a datastore satisfying the given requirements.
 
@@ -276,7 +1156,18 @@ class DatastoreSelector(object):
         :return: (host, resourcePool, summary)
         """
         LOG.debug("Using requirements: %s for datastore selection.", req)
+        counter = _RoundTripCounter()
+        self._local.round_trips = counter
+        try:
+            res = self._select_datastore(req, hosts)
+        finally:
+            self._local.round_trips = None
+        LOG.debug("Selected (host, resourcepool, datastore): %(res)s with "
+                  "%(round_trips)d round trips.",
+                  {'res': res, 'round_trips': counter.count})
+        return res
 
+    def _select_datastore(self, req, hosts):
         hard_affinity_ds_types = req.get(
             DatastoreSelector.HARD_AFFINITY_DS_TYPE)
         hard_anti_affinity_datastores = req.get(
@@ -288,16 +1179,20 @@ class DatastoreSelector(object):
         if profile_name is not None:
             profile_id = self.get_profile_id(profile_name)
 
+        if self._vectorized and self._use_mirror():
+            return self._select_datastore_vectorized(
+                size_bytes, profile_id, hard_anti_affinity_datastores,
+                hard_affinity_ds_types, valid_host_refs=hosts)
+
         datastores = self._get_datastores()
-        datastores = self._filter_datastores(datastores,
-                                             size_bytes,
-                                             profile_id,
-                                             hard_anti_affinity_datastores,
-                                             hard_affinity_ds_types,
-                                             valid_host_refs=hosts)
-        res = self._select_best_datastore(datastores, valid_host_refs=hosts)
-        LOG.debug("Selected (host, resourcepool, datastore): %s", res)
-        return res
+        datastores = self._filter_datastores(
+            datastores,
+            size_bytes,
+            profile_id,
+            hard_anti_affinity_datastores,
+            hard_affinity_ds_types,
+            valid_host_refs=hosts)
+        return self._select_best_datastore(datastores, valid_host_refs=hosts)
 
     def is_datastore_compliant(self, datastore, profile_name):
         """Check if the datastore is compliant with given profile.
@@ -0,0 +1,120 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+In-memory tree of the VM inventory folders of a datacenter.
+"""
+
+import threading
+
+from oslo_log import log as logging
+from oslo_vmware import vim_util
+from six.moves import urllib
+
+from vmwaretool import retrieval
+
+
+LOG = logging.getLogger(__name__)
+
+_CHILD_TRAVERSAL = 'folderChildTraversal'
+
+
+def fetch_folders(session, folder, max_objects, recursive=True):
+    """Read the names and parents of the folders below a folder.
+
+    :param session: VMwareAPISession
+    :param folder: reference to the folder to start from
+    :param max_objects: maximum number of objects per retrieval batch
+    :param recursive: whether to read all descendant folders or only the
+                      immediate child folders
+    :return: list of (folder, name, parent) tuples; names are unquoted
+    """
+    cf = session.vim.client.factory
+    select_set = []
+    if recursive:
+        select_set.append(vim_util.build_selection_spec(cf, _CHILD_TRAVERSAL))
+    child_spec = vim_util.build_traversal_spec(
+        cf, _CHILD_TRAVERSAL, 'Folder', 'childEntity', False, select_set)
+    object_spec = vim_util.build_object_spec(cf, folder, [child_spec])
+    object_spec.skip = True
+    # Only folders are collected; virtual machines met by the traversal are
+    # not returned.
+    property_spec = vim_util.build_property_spec(
+        cf, type_='Folder', properties_to_collect=['name', 'parent'])
+    filter_spec = vim_util.build_property_filter_spec(cf, [property_spec],
+                                                      [object_spec])
+    options = cf.create('ns0:RetrieveOptions')
+    options.maxObjects = max_objects
+
+    result = session.invoke_api(session.vim, 'RetrievePropertiesEx',
+                                session.vim.service_content.propertyCollector,
+                                specSet=[filter_spec], options=options)
+    folders = []
+    for obj_content in retrieval.iter_objects(session, result):
+        props = vim_util.propset_dict(getattr(obj_content, 'propSet', None))
+        name = urllib.parse.unquote(props.get('name', ''))
+        folders.append((obj_content.obj, name, props.get('parent')))
+    return folders
+
+
+class FolderTree(object):
+    """Folders below the VM folder of a datacenter, indexed by parent and name.
+
+    The tree is loaded with one retrieval and then kept up to date with the
+    folders created or found by the caller.
+    """
+
+    def __init__(self, root):
+        self._root = root
+        self._lock = threading.Lock()
+        # parent folder value -> {child name: child folder}
+        self._children = {}
+
+    def __len__(self):
+        return sum(len(children) for children in self._children.values())
+
+    @property
+    def root(self):
+        return self._root
+
+    def load(self, session, max_objects):
+        """Replace the tree with the folders currently in vCenter."""
+        folders = fetch_folders(session, self._root, max_objects)
+        children = {}
+        for folder, name, parent in folders:
+            if parent is not None:
+                children.setdefault(parent.value, {})[name] = folder
+        with self._lock:
+            self._children = children
+        LOG.debug("Loaded %(count)d folders below %(root)s.",
+                  {'count': len(folders), 'root': self._root})
+
+    def get_child(self, parent, name):
+        """Get the child folder of a folder by name, or None."""
+        with self._lock:
+            return self._children.get(parent.value, {}).get(name)
+
+    def get(self, path_comp):
+        """Get the folder at the given path below the root, or None.
+
+        :param path_comp: path components as a list
+        """
+        folder = self._root
+        for name in path_comp:
+            folder = self.get_child(folder, name)
+            if folder is None:
+                return None
+        return folder
+
+    def add(self, parent, name, folder):
+        with self._lock:
+            self._children.setdefault(parent.value, {})[name] = folder
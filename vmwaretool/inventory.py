@@ -0,0 +1,144 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Point-in-time snapshot of the vCenter compute inventory.
+"""
+
+from oslo_log import log as logging
+from oslo_vmware import vim_util
+from six.moves import urllib
+
+from vmwaretool import exceptions as vmdk_exceptions
+from vmwaretool import retrieval
+
+
+LOG = logging.getLogger(__name__)
+
+CLUSTER_PROPERTIES = ['name', 'availableField', 'customValue', 'host']
+
+
+def parse_custom_attributes(available_fields, custom_values):
+    """Map custom attribute names to their values.
+
+    :param available_fields: 'availableField' property of a managed entity
+    :param custom_values: 'customValue' property of a managed entity
+    :return: Dictionary of attribute name to {'value': ..., 'id': ...}, or
+             None if either property is unset
+    """
+    if not available_fields or not custom_values:
+        return None
+
+    custom_fields = {}
+    for field in available_fields:
+        for v in field[1]:
+            custom_fields[v.key] = v.name
+
+    custom_attributes = {}
+    for val in custom_values:
+        for i in val[1]:
+            custom_attributes[custom_fields[i.key]] = {"value": i.value,
+                                                       'id': i.key}
+    return custom_attributes
+
+
+class ClusterInfo(object):
+    """Properties of a single compute cluster."""
+
+    def __init__(self, ref, name, custom_attributes, hosts):
+        self.ref = ref
+        self.name = name
+        self.custom_attributes = custom_attributes
+        self.hosts = hosts
+
+    def __repr__(self):
+        return "ClusterInfo(%s, %s, hosts=%d)" % (self.name, self.ref.value,
+                                                  len(self.hosts))
+
+
+class InventorySnapshot(object):
+    """Clusters, their custom attributes and hosts as seen at build time."""
+
+    def __init__(self, clusters):
+        self._clusters = {c.name: c for c in clusters}
+        self._clusters_by_ref = {c.ref.value: c for c in clusters}
+
+    def __len__(self):
+        return len(self._clusters)
+
+    def get_clusters(self):
+        return list(self._clusters.values())
+
+    def get_cluster_refs(self, names):
+        """Get references to given clusters.
+
+        :param names: list of cluster names
+        :return: Dictionary of cluster names to references
+        :raises: ClusterNotFoundException
+        """
+        clusters_ref = {}
+        for name in names:
+            if name not in self._clusters:
+                LOG.error("Compute cluster: %s not found.", name)
+                raise vmdk_exceptions.ClusterNotFoundException(cluster=name)
+            clusters_ref[name] = self._clusters[name].ref
+        return clusters_ref
+
+    def has_cluster(self, cluster):
+        return cluster.value in self._clusters_by_ref
+
+    def get_cluster_custom_attributes(self, cluster):
+        return self._clusters_by_ref[cluster.value].custom_attributes
+
+    def get_cluster_hosts(self, cluster):
+        return list(self._clusters_by_ref[cluster.value].hosts)
+
+
+def _cluster_info_from_object(obj_content):
+    props = vim_util.propset_dict(getattr(obj_content, 'propSet', None))
+    name = urllib.parse.unquote(props.get('name', ''))
+
+    hosts = []
+    host_prop = props.get('host')
+    if host_prop and getattr(host_prop, 'ManagedObjectReference', None):
+        hosts.extend(host_prop.ManagedObjectReference)
+
+    custom_attributes = parse_custom_attributes(props.get('availableField'),
+                                                props.get('customValue'))
+    return ClusterInfo(obj_content.obj, name, custom_attributes, hosts)
+
+
+def build_inventory_snapshot(session, max_objects, page_sizer=None):
+    """Build an inventory snapshot with a single property collector query.
+
+    All clusters together with their custom attributes and host lists are
+    fetched through one RetrievePropertiesEx call over the recursive
+    inventory traversal spec. Large inventories are paged in batches of
+    max_objects.
+
+    :param session: VMwareAPISession
+    :param max_objects: maximum number of objects per retrieval batch
+    :param page_sizer: optional PageSizer choosing the batch size instead
+    :return: InventorySnapshot
+    """
+    LOG.debug("Building inventory snapshot.")
+    clusters = []
+    for obj_content in retrieval.retrieve_objects(
+            session,
+            'ClusterComputeResource',
+            max_objects,
+            properties_to_collect=CLUSTER_PROPERTIES,
+            page_sizer=page_sizer):
+        clusters.append(_cluster_info_from_object(obj_content))
+
+    LOG.debug("Inventory snapshot has %d clusters.", len(clusters))
+    return InventorySnapshot(clusters)
@@ -0,0 +1,302 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Prefetching iteration over paged property collector results.
+"""
+
+import functools
+import json
+import os
+import queue
+import threading
+import time
+
+from oslo_log import log as logging
+from oslo_vmware import vim_util
+
+
+LOG = logging.getLogger(__name__)
+
+# Number of pages retrieved ahead of the one being processed.
+DEFAULT_READ_AHEAD = 2
+# Interval in seconds at which a blocked worker checks for cancellation.
+_PUT_TIMEOUT = 0.1
+DEFAULT_PAGE_SIZES_FILE_NAME = 'page_sizes.json'
+
+
+class PageSizer(object):
+    """Tunes maxObjects per object type and property set.
+
+    The size used for the next retrieval of an object type and property set
+    is derived from the time per object measured for its previous pages, so
+    that a page takes about target_seconds to retrieve. Wide retrievals of
+    small properties get larger pages and heavy properties such as
+    config.hardware.device get smaller ones. The size changes by at most a
+    factor of two per page and stays within [min_size, max_size].
+
+    vCenter applies the maxObjects of RetrievePropertiesEx to all the
+    ContinueRetrievePropertiesEx calls of a retrieval, so a size learned
+    from a page takes effect on the next retrieval of the same object type
+    and property set. If a path is given, learned sizes are saved there
+    whenever they change and loaded again by later runs, so that they
+    start with the sizes learned before.
+    """
+
+    def __init__(self, initial_size, min_size, max_size, target_seconds=1.0,
+                 path=None):
+        self._initial_size = min(max(initial_size, min_size), max_size)
+        self._min_size = min_size
+        self._max_size = max_size
+        self._target_seconds = target_seconds
+        self._path = path
+        self._lock = threading.Lock()
+        self._sizes = self._load() if path else {}
+
+    @staticmethod
+    def _key(obj_type, properties):
+        return obj_type, tuple(sorted(properties or ()))
+
+    def _load(self):
+        try:
+            with open(self._path) as sizes_file:
+                entries = json.load(sizes_file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            LOG.warning("Ignoring unreadable page sizes file %s.",
+                        self._path, exc_info=True)
+            return {}
+
+        sizes = {}
+        if not isinstance(entries, list):
+            entries = []
+        for entry in entries:
+            try:
+                key = self._key(entry['type'], entry['properties'])
+                size = int(entry['size'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            sizes[key] = min(max(size, self._min_size), self._max_size)
+        LOG.debug("Loaded %(count)d page sizes from %(path)s.",
+                  {'count': len(sizes), 'path': self._path})
+        return sizes
+
+    def _save(self, sizes):
+        entries = [{'type': obj_type, 'properties': list(properties),
+                    'size': size}
+                   for (obj_type, properties), size in sorted(sizes.items())]
+        directory = os.path.dirname(self._path)
+        tmp_path = "%s.%d.tmp" % (self._path, os.getpid())
+        try:
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(tmp_path, 'w') as sizes_file:
+                json.dump(entries, sizes_file)
+            os.replace(tmp_path, self._path)
+        except OSError:
+            # Sizes are learned again by the next run.
+            LOG.warning("Error saving page sizes to %s.", self._path,
+                        exc_info=True)
+
+    def get_size(self, obj_type, properties):
+        return self._sizes.get(self._key(obj_type, properties),
+                               self._initial_size)
+
+    def get_sizes(self):
+        return dict(self._sizes)
+
+    def record(self, obj_type, properties, count, elapsed):
+        """Record the retrieval of a page.
+
+        :param obj_type: managed object type
+        :param properties: names of the retrieved properties
+        :param count: number of objects in the page
+        :param elapsed: time in seconds taken to retrieve the page
+        """
+        if not count or elapsed <= 0:
+            return
+
+        key = self._key(obj_type, properties)
+        seconds_per_object = elapsed / count
+        with self._lock:
+            size = self._sizes.get(key, self._initial_size)
+            ideal = self._target_seconds / seconds_per_object
+            new_size = int(min(max(ideal, size / 2.0), size * 2.0))
+            new_size = min(max(new_size, self._min_size), self._max_size)
+            self._sizes[key] = new_size
+            if self._path and new_size != size:
+                self._save(self._sizes)
+
+        if new_size != size:
+            LOG.info("Page size for %(type)s %(props)s changed from "
+                     "%(old)d to %(new)d (%(ms).2f ms per object).",
+                     {'type': obj_type,
+                      'props': list(key[1]),
+                      'old': size,
+                      'new': new_size,
+                      'ms': seconds_per_object * 1000})
+
+
+class _Failure(object):
+
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def _page_size(retrieve_result):
+    return len(retrieve_result.objects or []) if retrieve_result else 0
+
+
+def iter_pages(session, retrieve_result, read_ahead=DEFAULT_READ_AHEAD,
+               invoke_api=None, page_callback=None):
+    """Iterate over the pages of a RetrievePropertiesEx result.
+
+    While the caller processes a page, the following pages are retrieved
+    with ContinueRetrievePropertiesEx on a worker thread, at most read_ahead
+    of them ahead of the caller. If the caller stops iterating early, the
+    worker stops and the remaining results are cancelled.
+
+    :param session: VMwareAPISession
+    :param retrieve_result: result of the initial RetrievePropertiesEx call
+    :param read_ahead: maximum number of pages retrieved ahead
+    :param invoke_api: callable used instead of session.invoke_api
+    :param page_callback: called with the number of objects and retrieval
+                          time of every page retrieved
+    :raises: exception raised by a page retrieval
+    """
+    if not retrieve_result:
+        return
+    if not getattr(retrieve_result, 'token', None):
+        yield retrieve_result
+        return
+
+    invoke_api = invoke_api or session.invoke_api
+    pages = queue.Queue(maxsize=max(read_ahead, 1))
+    stop = threading.Event()
+
+    def _put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=_PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _fetch():
+        result = retrieve_result
+        try:
+            while result:
+                start = time.monotonic()
+                result = invoke_api(vim_util, 'continue_retrieval',
+                                    session.vim, result)
+                if page_callback is not None and result:
+                    page_callback(_page_size(result),
+                                  time.monotonic() - start)
+                # None marks the last page.
+                if not _put(result):
+                    break
+        except Exception as exc:
+            _put(_Failure(exc))
+            return
+
+        if result and stop.is_set():
+            try:
+                invoke_api(vim_util, 'cancel_retrieval', session.vim, result)
+            except Exception:
+                LOG.debug("Error cancelling retrieval.", exc_info=True)
+
+    worker = threading.Thread(target=_fetch, name='retrieval-prefetch')
+    worker.daemon = True
+    worker.start()
+    try:
+        yield retrieve_result
+        while True:
+            item = pages.get()
+            if isinstance(item, _Failure):
+                raise item.exc
+            if not item:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def iter_objects(session, retrieve_result, read_ahead=DEFAULT_READ_AHEAD,
+                 invoke_api=None):
+    """Iterate over the ObjectContent items of a paged result.
+
+    See iter_pages for the prefetching behaviour.
+    """
+    for page in iter_pages(session, retrieve_result, read_ahead=read_ahead,
+                           invoke_api=invoke_api):
+        if page.objects:
+            for obj_content in page.objects:
+                yield obj_content
+
+
+def retrieve_pages(session, obj_type, max_objects, properties_to_collect=None,
+                   page_sizer=None, read_ahead=DEFAULT_READ_AHEAD,
+                   invoke_api=None):
+    """Retrieve properties of all objects of a type, page by page.
+
+    :param session: VMwareAPISession
+    :param obj_type: managed object type
+    :param max_objects: maximum number of objects per page, unless a
+                        page_sizer is given
+    :param properties_to_collect: names of the properties to retrieve
+    :param page_sizer: PageSizer choosing the page size
+    :param read_ahead: maximum number of pages retrieved ahead
+    :param invoke_api: callable used instead of session.invoke_api
+    :return: iterator over the result pages
+    """
+    invoke_api = invoke_api or session.invoke_api
+    page_callback = None
+    if page_sizer is not None:
+        max_objects = page_sizer.get_size(obj_type, properties_to_collect)
+        page_callback = functools.partial(page_sizer.record, obj_type,
+                                          properties_to_collect)
+        LOG.debug("Retrieving %(type)s in pages of %(size)d objects.",
+                  {'type': obj_type, 'size': max_objects})
+
+    start = time.monotonic()
+    retrieve_result = invoke_api(vim_util,
+                                 'get_objects',
+                                 session.vim,
+                                 obj_type,
+                                 max_objects,
+                                 properties_to_collect=properties_to_collect)
+    if page_callback is not None and retrieve_result:
+        page_callback(_page_size(retrieve_result), time.monotonic() - start)
+
+    return iter_pages(session, retrieve_result, read_ahead=read_ahead,
+                      invoke_api=invoke_api, page_callback=page_callback)
+
+
+def retrieve_objects(session, obj_type, max_objects,
+                     properties_to_collect=None, page_sizer=None,
+                     read_ahead=DEFAULT_READ_AHEAD, invoke_api=None):
+    """Retrieve properties of all objects of a type.
+
+    See retrieve_pages for the parameters.
+
+    :return: iterator over the ObjectContent items
+    """
+    pages = retrieve_pages(session, obj_type, max_objects,
+                           properties_to_collect=properties_to_collect,
+                           page_sizer=page_sizer, read_ahead=read_ahead,
+                           invoke_api=invoke_api)
+    for page in pages:
+        if page.objects:
+            for obj_content in page.objects:
+                yield obj_content
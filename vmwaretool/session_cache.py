@@ -0,0 +1,172 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Cache of vCenter session cookies shared between runs.
+"""
+
+import json
+import os
+import stat
+import threading
+import time
+
+from oslo_log import log as logging
+from oslo_vmware import exceptions
+from oslo_vmware import vim_util
+
+
+LOG = logging.getLogger(__name__)
+
+SESSION_COOKIE = 'vmware_soap_session'
+DEFAULT_FILE_NAME = 'sessions.json'
+
+
+class SessionCache(object):
+    """Session cookies persisted in a file readable only by its owner.
+
+    Entries are keyed by vCenter host, port and user name. A file which is
+    not owned by the current user or is accessible by others is ignored,
+    since anyone able to read a cookie can act as that user.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(host, port, username):
+        return "%s@%s:%s" % (username, host, port)
+
+    def _read(self):
+        try:
+            fd = os.open(self._path, os.O_RDONLY)
+        except FileNotFoundError:
+            return {}
+        with os.fdopen(fd) as cache_file:
+            st = os.fstat(cache_file.fileno())
+            if (st.st_uid != os.getuid() or
+                    st.st_mode & (stat.S_IRWXG | stat.S_IRWXO)):
+                LOG.warning("Ignoring session cache %s since it is "
+                            "accessible by other users.", self._path)
+                return {}
+            try:
+                return json.load(cache_file)
+            except ValueError:
+                LOG.warning("Ignoring corrupt session cache %s.", self._path)
+                return {}
+
+    def _write(self, entries):
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        tmp_path = "%s.%d.tmp" % (self._path, os.getpid())
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            with os.fdopen(fd, 'w') as cache_file:
+                json.dump(entries, cache_file)
+            os.replace(tmp_path, self._path)
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def get(self, host, port, username):
+        """Get the cached session of a user, or None."""
+        with self._lock:
+            return self._read().get(self._key(host, port, username))
+
+    def set(self, host, port, username, cookie, session_id, session_username):
+        """Cache the session of a user.
+
+        :param cookie: value of the vmware_soap_session cookie
+        :param session_id: key of the vCenter UserSession
+        :param session_username: userName of the vCenter UserSession
+        """
+        with self._lock:
+            entries = self._read()
+            entries[self._key(host, port, username)] = {
+                'cookie': cookie,
+                'session_id': session_id,
+                'session_username': session_username,
+                'saved_at': time.time(),
+            }
+            self._write(entries)
+
+    def remove(self, host, port, username):
+        with self._lock:
+            entries = self._read()
+            if entries.pop(self._key(host, port, username), None):
+                self._write(entries)
+
+
+def _get_current_session(session):
+    # Reading currentSession needs no privilege and returns nothing for an
+    # unauthenticated client. It is called on vim directly since
+    # invoke_api would log in again on NotAuthenticated.
+    return vim_util.get_object_property(
+        session.vim, session.vim.service_content.sessionManager,
+        'currentSession', skip_op_id=True)
+
+
+def _restore_session(session, entry, host):
+    session.vim.client.cookiejar.set(SESSION_COOKIE, entry['cookie'],
+                                     domain=host, path='/')
+    try:
+        current = _get_current_session(session)
+    except exceptions.VimException:
+        LOG.debug("Error validating cached session.", exc_info=True)
+        current = None
+    if current is None or current.key != entry['session_id']:
+        session.vim.client.cookiejar.clear()
+        return False
+
+    # VMwareAPISession has no public way of adopting an existing session.
+    session._session_id = current.key
+    session._session_username = current.userName
+    return True
+
+
+def login(session, cache, host, port, username):
+    """Authenticate a session created with create_session=False.
+
+    The cached session of the user is reused if vCenter still considers it
+    valid, which costs one property read instead of a Login. Otherwise the
+    session logs in and its cookie replaces the cached one.
+
+    :param session: VMwareAPISession which has not logged in
+    :param cache: SessionCache
+    :return: True if the cached session was reused
+    """
+    entry = None
+    try:
+        entry = cache.get(host, port, username)
+    except (OSError, ValueError):
+        LOG.warning("Error reading session cache.", exc_info=True)
+
+    if entry and _restore_session(session, entry, host):
+        LOG.debug("Reusing cached session for %(user)s@%(host)s.",
+                  {'user': username, 'host': host})
+        return True
+    if entry:
+        LOG.debug("Cached session for %(user)s@%(host)s has expired.",
+                  {'user': username, 'host': host})
+
+    session._create_session()
+    try:
+        cache.set(host, port, username, session.vim.get_http_cookie(),
+                  session._session_id, session._session_username)
+    except OSError:
+        LOG.warning("Error writing session cache.", exc_info=True)
+    return False
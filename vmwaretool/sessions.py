@@ -0,0 +1,298 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Pool of vCenter API sessions.
+"""
+
+import collections
+import contextlib
+import threading
+import time
+
+from oslo_log import log as logging
+from oslo_vmware import exceptions
+from oslo_vmware import vim_util
+
+
+LOG = logging.getLogger(__name__)
+
+# vCenter terminates sessions idle for 30 minutes by default.
+DEFAULT_MAX_IDLE = 20 * 60
+DEFAULT_HEALTH_CHECK_INTERVAL = 5 * 60
+# Retrievals which are neither continued nor cancelled within this number of
+# seconds are forgotten.
+DEFAULT_TOKEN_TTL = 10 * 60
+DEFAULT_TASK_POLL_INTERVAL = 0.5
+
+
+class _PooledSession(object):
+
+    def __init__(self, session):
+        self.session = session
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.last_checked = self.created
+
+
+class SessionPool(object):
+    """Pool of authenticated VMwareAPISession objects.
+
+    Sessions are created lazily up to size and handed out one caller at a
+    time. Before a session is handed out it logs in again if it has been
+    idle for more than max_idle seconds, since vCenter may be about to
+    expire it, or if it is older than max_age seconds. A session which has
+    not been checked for health_check_interval seconds is checked with
+    SessionIsActive and logs in again if it is no longer active.
+    """
+
+    def __init__(self, create_session, size, max_idle=DEFAULT_MAX_IDLE,
+                 max_age=None,
+                 health_check_interval=DEFAULT_HEALTH_CHECK_INTERVAL):
+        self._create_session = create_session
+        self._size = size
+        self._max_idle = max_idle
+        self._max_age = max_age
+        self._health_check_interval = health_check_interval
+        self._cond = threading.Condition()
+        self._idle = collections.deque()
+        self._count = 0
+        self._primary = None
+
+    def __len__(self):
+        return self._count
+
+    def get_primary_session(self):
+        """Get the first session of the pool, creating it if needed."""
+        with self._cond:
+            if self._primary is None:
+                self._primary = self._new_session()
+                self._idle.append(self._primary)
+            return self._primary.session
+
+    def _new_session(self):
+        self._count += 1
+        try:
+            return _PooledSession(self._create_session())
+        except Exception:
+            self._count -= 1
+            raise
+
+    def _needs_relogin(self, pooled, now):
+        if self._max_idle and now - pooled.last_used > self._max_idle:
+            LOG.debug("Session idle for %d seconds, logging in again.",
+                      now - pooled.last_used)
+            return True
+        if self._max_age and now - pooled.created > self._max_age:
+            LOG.debug("Session is %d seconds old, logging in again.",
+                      now - pooled.created)
+            return True
+        if (self._health_check_interval and
+                now - pooled.last_checked > self._health_check_interval):
+            pooled.last_checked = now
+            if not pooled.session.is_current_session_active():
+                LOG.info("Session is no longer active, logging in again.")
+                return True
+        return False
+
+    def _relogin(self, pooled):
+        try:
+            pooled.session.logout()
+        except Exception:
+            LOG.debug("Error logging out expired session.", exc_info=True)
+        # VMwareAPISession has no public method to log in again. A new
+        # session object would come with a new suds client, while the
+        # primary session's vim is handed out by PooledSession.vim and
+        # used to build specs, so the existing object logs in again.
+        pooled.session._create_session()
+        pooled.created = pooled.last_checked = time.monotonic()
+
+    def _take_idle(self, preferred):
+        if preferred is None:
+            return self._idle.popleft() if self._idle else None
+        for pooled in self._idle:
+            if pooled.session is preferred:
+                self._idle.remove(pooled)
+                return pooled
+        return None
+
+    def acquire(self, preferred=None):
+        """Borrow a session, waiting for one to be released if needed.
+
+        :param preferred: session to wait for instead of any idle one
+        """
+        with self._cond:
+            while True:
+                pooled = self._take_idle(preferred)
+                if pooled is not None:
+                    break
+                if preferred is None and self._count < self._size:
+                    # Reserve the slot and log in without holding the lock,
+                    # so that other callers can use the idle sessions.
+                    self._count += 1
+                    LOG.debug("Creating session %d of %d.", self._count,
+                              self._size)
+                    break
+                self._cond.wait()
+
+        if pooled is None:
+            try:
+                pooled = _PooledSession(self._create_session())
+            except Exception:
+                with self._cond:
+                    self._count -= 1
+                    self._cond.notify_all()
+                raise
+            return pooled
+
+        try:
+            if self._needs_relogin(pooled, time.monotonic()):
+                self._relogin(pooled)
+        except Exception:
+            self._release(pooled)
+            raise
+        return pooled
+
+    def _release(self, pooled):
+        pooled.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(pooled)
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def session(self, preferred=None):
+        """Context manager borrowing a session for the duration of a block.
+
+        :param preferred: session to wait for instead of any idle one
+        """
+        pooled = self.acquire(preferred)
+        try:
+            yield pooled.session
+        finally:
+            self._release(pooled)
+
+    def logout(self):
+        with self._cond:
+            idle = list(self._idle)
+        for pooled in idle:
+            pooled.session.logout()
+
+
+class PooledSession(object):
+    """Drop-in replacement for VMwareAPISession backed by a SessionPool.
+
+    Every invoke_api call borrows a session from the pool, so concurrent
+    callers such as VMwareVolumeOps and DatastoreSelector workers do not
+    contend on one suds client. The vim attribute belongs to the pool's
+    primary session; it is used to build specs and is replaced by the
+    borrowed session's vim when passed to invoke_api. Paged retrievals are
+    continued on the session which started them, since retrieval tokens are
+    only valid in their own session. Tokens of retrievals which are neither
+    continued nor cancelled are forgotten after token_ttl seconds.
+
+    Tasks are waited for by reading their info every task_poll_interval
+    seconds, each read borrowing a session, so that long running tasks do
+    not hold on to sessions of the pool.
+    """
+
+    _RESULT_METHODS = ('continue_retrieval', 'cancel_retrieval')
+
+    def __init__(self, pool, token_ttl=DEFAULT_TOKEN_TTL,
+                 task_poll_interval=DEFAULT_TASK_POLL_INTERVAL):
+        self._pool = pool
+        self._primary = pool.get_primary_session()
+        self._token_ttl = token_ttl
+        self._task_poll_interval = task_poll_interval
+        self._token_lock = threading.Lock()
+        # token -> (session, expiry), in order of expiry
+        self._token_sessions = collections.OrderedDict()
+
+    @property
+    def vim(self):
+        return self._primary.vim
+
+    @property
+    def pbm(self):
+        return self._primary.pbm
+
+    @property
+    def pool(self):
+        return self._pool
+
+    def _swap(self, session, value):
+        if value is None:
+            return value
+        if value is self._primary.vim:
+            return session.vim
+        if value is self._primary.pbm:
+            return session.pbm
+        return value
+
+    def _invoke(self, session, module, method, args, kwargs):
+        module = self._swap(session, module)
+        args = [self._swap(session, arg) for arg in args]
+        result = session.invoke_api(module, method, *args, **kwargs)
+        token = getattr(result, 'token', None)
+        if token:
+            now = time.monotonic()
+            with self._token_lock:
+                self._evict_tokens(now)
+                self._token_sessions[token] = (session,
+                                               now + self._token_ttl)
+        return result
+
+    def _evict_tokens(self, now):
+        while self._token_sessions:
+            token, (_session, expiry) = next(
+                iter(self._token_sessions.items()))
+            if expiry > now:
+                break
+            LOG.debug("Forgetting retrieval token: %s which was not "
+                      "continued.", token)
+            del self._token_sessions[token]
+
+    def invoke_api(self, module, method, *args, **kwargs):
+        preferred = None
+        if method in self._RESULT_METHODS and len(args) > 1:
+            token = getattr(args[1], 'token', None)
+            with self._token_lock:
+                preferred, _expiry = self._token_sessions.pop(token,
+                                                              (None, None))
+
+        with self._pool.session(preferred) as session:
+            return self._invoke(session, module, method, args, kwargs)
+
+    def wait_for_task(self, task):
+        """Wait for the given task to complete.
+
+        :param task: managed object reference of the task
+        :return: task info upon successful completion of the task
+        :raises: VimException or a subclass translated from the task fault
+        """
+        LOG.debug("Waiting for the task: %s to complete.", task)
+        while True:
+            task_info = self.invoke_api(vim_util, 'get_object_property',
+                                        self.vim, task, 'info',
+                                        skip_op_id=True)
+            if task_info.state == 'success':
+                LOG.debug("Task: %s completed successfully.", task)
+                return task_info
+            if task_info.state == 'error':
+                raise exceptions.translate_fault(task_info.error)
+            time.sleep(self._task_poll_interval)
+
+    def is_current_session_active(self):
+        with self._pool.session() as session:
+            return session.is_current_session_active()
+
+    def logout(self):
+        self._pool.logout()
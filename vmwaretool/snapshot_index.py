@@ -0,0 +1,91 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Index of the snapshot tree of a backing.
+"""
+
+
+class SnapshotNode(object):
+    """A snapshot in the snapshot tree of a backing."""
+
+    __slots__ = ('name', 'snapshot', 'create_time', 'parent', 'children',
+                 'depth')
+
+    def __init__(self, name, snapshot, create_time, parent):
+        self.name = name
+        self.snapshot = snapshot
+        self.create_time = create_time
+        self.parent = parent
+        self.children = []
+        # Number of snapshots from the root of the tree, which is at depth 1.
+        self.depth = parent.depth + 1 if parent is not None else 1
+
+
+class SnapshotIndex(object):
+    """Snapshots of a backing indexed by name.
+
+    Built from a single read of the backing's 'snapshot' property
+    (VirtualMachineSnapshotInfo). Snapshot names need not be unique; a name
+    maps to the first snapshot with that name in depth-first order of the
+    trees, as found by walking the trees from their roots.
+    """
+
+    __slots__ = ('_roots', '_by_name', '_nodes')
+
+    def __init__(self, snapshot_info):
+        self._roots = []
+        self._by_name = {}
+        self._nodes = []
+
+        root_list = getattr(snapshot_info, 'rootSnapshotList', None) or []
+        stack = [(tree, None) for tree in reversed(root_list)]
+        while stack:
+            tree, parent = stack.pop()
+            node = SnapshotNode(tree.name, tree.snapshot,
+                                getattr(tree, 'createTime', None), parent)
+            if parent is None:
+                self._roots.append(node)
+            else:
+                parent.children.append(node)
+            self._nodes.append(node)
+            self._by_name.setdefault(node.name, node)
+            # childSnapshotList is missing when a snapshot has no children.
+            children = getattr(tree, 'childSnapshotList', None) or []
+            stack.extend((child, node) for child in reversed(children))
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def __iter__(self):
+        """Iterate over all snapshots in depth-first order."""
+        return iter(self._nodes)
+
+    @property
+    def roots(self):
+        return list(self._roots)
+
+    @property
+    def max_depth(self):
+        return max((node.depth for node in self._nodes), default=0)
+
+    def get_node(self, name):
+        """Get the snapshot node with the given name, or None."""
+        return self._by_name.get(name)
+
+    def get(self, name):
+        """Get the reference to the snapshot with the given name, or None."""
+        node = self._by_name.get(name)
+        return node.snapshot if node is not None else None
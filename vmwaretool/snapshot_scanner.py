@@ -0,0 +1,195 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Inventory-wide scan for old snapshots and deep snapshot chains.
+"""
+
+import datetime
+
+from oslo_log import log as logging
+from oslo_vmware import vim_util
+
+from vmwaretool import batch
+from vmwaretool import retrieval
+from vmwaretool import snapshot_index
+
+
+LOG = logging.getLogger(__name__)
+
+SCAN_PROPERTIES = ['name', 'runtime.host', 'snapshot']
+
+REASON_AGE = 'age'
+REASON_DEPTH = 'depth'
+
+
+class StaleSnapshot(object):
+    """A snapshot found by scan_stale_snapshots.
+
+    :param backing: reference to the VM owning the snapshot
+    :param backing_name: name of the VM
+    :param host: reference to the host of the VM, or None
+    :param node: snapshot_index.SnapshotNode of the snapshot
+    :param reasons: list of REASON_AGE and REASON_DEPTH
+    :param deletable: whether the snapshot name is unique on the VM, so that
+                      it can be deleted by name
+    """
+
+    __slots__ = ('backing', 'backing_name', 'host', 'node', 'reasons',
+                 'deletable')
+
+    def __init__(self, backing, backing_name, host, node, reasons,
+                 deletable):
+        self.backing = backing
+        self.backing_name = backing_name
+        self.host = host
+        self.node = node
+        self.reasons = reasons
+        self.deletable = deletable
+
+    @property
+    def name(self):
+        return self.node.name
+
+    @property
+    def create_time(self):
+        return self.node.create_time
+
+    @property
+    def depth(self):
+        return self.node.depth
+
+    def __repr__(self):
+        return ("StaleSnapshot(%s of %s: %s)" %
+                (self.name, self.backing_name, ', '.join(self.reasons)))
+
+
+def _as_utc(create_time):
+    if create_time.tzinfo is None:
+        # vCenter reports times in UTC.
+        return create_time.replace(tzinfo=datetime.timezone.utc)
+    return create_time
+
+
+def _find_stale(index, cutoff, max_depth):
+    names = {}
+    for node in index:
+        names[node.name] = names.get(node.name, 0) + 1
+
+    for node in index:
+        reasons = []
+        if (cutoff is not None and node.create_time is not None and
+                _as_utc(node.create_time) < cutoff):
+            reasons.append(REASON_AGE)
+        if max_depth is not None and node.depth > max_depth:
+            reasons.append(REASON_DEPTH)
+        if reasons:
+            yield node, reasons, names[node.name] == 1
+
+
+def scan_stale_snapshots(session, max_objects, max_age=None, max_depth=None,
+                         page_sizer=None, now=None):
+    """Find old snapshots and deep snapshot chains of all VMs.
+
+    The names, hosts and snapshot trees of all VMs are read with paged
+    retrievals, and the matching snapshots are yielded while the following
+    pages are still being retrieved.
+
+    :param session: VMwareAPISession
+    :param max_objects: maximum number of VMs per page, unless a page_sizer
+                        is given
+    :param max_age: report snapshots created more than max_age seconds ago
+    :param max_depth: report snapshots deeper than max_depth in their tree,
+                      where root snapshots are at depth 1
+    :param page_sizer: retrieval.PageSizer choosing the page size
+    :param now: current time as an aware datetime, for testing
+    :return: iterator over StaleSnapshot, grouped by VM and in depth-first
+             order within a VM
+    """
+    if max_age is None and max_depth is None:
+        raise ValueError("max_age or max_depth must be given.")
+
+    cutoff = None
+    if max_age is not None:
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        cutoff = now - datetime.timedelta(seconds=max_age)
+
+    pages = retrieval.retrieve_pages(session,
+                                     'VirtualMachine',
+                                     max_objects,
+                                     properties_to_collect=SCAN_PROPERTIES,
+                                     page_sizer=page_sizer)
+    vm_count = 0
+    stale_count = 0
+    for page in pages:
+        for obj_content in page.objects or []:
+            vm_count += 1
+            props = vim_util.propset_dict(
+                getattr(obj_content, 'propSet', None))
+            # The property is unset on VMs without snapshots.
+            if not props.get('snapshot'):
+                continue
+
+            index = snapshot_index.SnapshotIndex(props['snapshot'])
+            for node, reasons, unique in _find_stale(index, cutoff,
+                                                     max_depth):
+                stale_count += 1
+                yield StaleSnapshot(obj_content.obj, props.get('name'),
+                                    props.get('runtime.host'), node, reasons,
+                                    unique)
+
+        # Release the page as soon as it is processed.
+        if page.objects:
+            del page.objects[:]
+    LOG.debug("Found %(stale)d stale snapshots on %(vms)d VMs.",
+              {'stale': stale_count, 'vms': vm_count})
+
+
+def _delete_operation(stale, names):
+    # Delete in reverse depth-first order, children before parents.
+    names.reverse()
+    host = stale.host.value if stale.host is not None else None
+    return batch.BatchOperation('delete_snapshots', (stale.backing, names),
+                                host=host)
+
+
+def iter_delete_operations(stale_snapshots):
+    """Group stale snapshots into one delete_snapshots operation per VM.
+
+    Snapshots of a VM are deleted one after the other, since vCenter runs
+    one snapshot task per VM at a time. Snapshots whose name is not unique
+    on their VM are skipped, as delete_snapshot looks snapshots up by name.
+    The snapshots of a VM must be consecutive, as yielded by
+    scan_stale_snapshots; the operation of a VM is yielded as soon as the
+    next VM is reached, so that it can run while the scan goes on.
+
+    :param stale_snapshots: iterable of StaleSnapshot grouped by VM
+    :return: iterator over batch.BatchOperation keyed by the host of the VM
+    """
+    current = None
+    names = []
+    for stale in stale_snapshots:
+        if not stale.deletable:
+            LOG.warning("Not deleting snapshot: %(name)s of backing: "
+                        "%(backing)s, its name is not unique.",
+                        {'name': stale.name, 'backing': stale.backing})
+            continue
+
+        if (current is not None and
+                stale.backing.value != current.backing.value):
+            yield _delete_operation(current, names)
+            names = []
+        current = stale
+        names.append(stale.name)
+
+    if current is not None:
+        yield _delete_operation(current, names)
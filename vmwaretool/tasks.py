@@ -0,0 +1,223 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Tracking of many vCenter tasks with batched polling.
+"""
+
+from concurrent import futures
+import contextlib
+import threading
+
+from oslo_log import log as logging
+from oslo_vmware import exceptions
+from oslo_vmware import vim_util
+
+
+LOG = logging.getLogger(__name__)
+
+# Number of consecutive failed polls after which the waiters are failed.
+DEFAULT_MAX_POLL_ERRORS = 5
+
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def observe_submitted_tasks(callback):
+    """Call callback with every task submitted by the current thread.
+
+    :param callback: callable taking the task moref
+    """
+    previous = getattr(_local, 'on_submit', None)
+    _local.on_submit = callback
+    try:
+        yield
+    finally:
+        _local.on_submit = previous
+
+
+class TaskTracker(object):
+    """Waits for any number of vCenter tasks from a single thread.
+
+    The info of all in-flight tasks is read with one PropertyCollector call
+    per poll. The poll interval starts at min_interval whenever a task is
+    submitted or completes and doubles up to max_interval while nothing
+    changes, so short tasks are noticed quickly without hammering vCenter
+    with long running ones. If max_poll_errors polls in a row fail, the
+    tasks being polled are failed with the last error.
+    """
+
+    def __init__(self, session, min_interval=0.1, max_interval=1.0,
+                 max_poll_errors=DEFAULT_MAX_POLL_ERRORS):
+        self._session = session
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._max_poll_errors = max_poll_errors
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = {}
+        self._thread = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def submit(self, task):
+        """Start tracking the given task.
+
+        :param task: managed object reference of the task
+        :return: Future which is resolved with the task info on success, or
+                 the translated task fault on error, or the last poll error
+                 if the task could not be polled; cancelling the Future
+                 does not cancel the task
+        """
+        on_submit = getattr(_local, 'on_submit', None)
+        if on_submit is not None:
+            on_submit(task)
+
+        future = futures.Future()
+        with self._lock:
+            self._pending.setdefault(task.value, (task, []))[1].append(future)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='task-tracker')
+                self._thread.daemon = True
+                self._thread.start()
+        self._wakeup.set()
+        LOG.debug("Tracking task: %s.", task)
+        return future
+
+    def wait(self, task, timeout=None):
+        """Wait for the given task to complete.
+
+        :param task: managed object reference of the task
+        :param timeout: maximum number of seconds to wait, or None to wait
+                        until the task completes
+        :return: task info upon successful completion of the task
+        :raises: VimException, VimFaultException, VimAttributeException,
+                 VimSessionOverLoadException, VimConnectionException,
+                 concurrent.futures.TimeoutError
+        """
+        return self.submit(task).result(timeout)
+
+    def _run(self):
+        interval = self._min_interval
+        errors = 0
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._thread = None
+                    return
+                tasks = [task for task, _ in self._pending.values()]
+
+            try:
+                completed = self._poll(tasks)
+                errors = 0
+            except Exception as exc:
+                LOG.exception("Error polling %d tasks.", len(tasks))
+                errors += 1
+                completed = errors >= self._max_poll_errors
+                if completed:
+                    LOG.error("Failing %(count)d tasks after %(errors)d "
+                              "failed polls.",
+                              {'count': len(tasks), 'errors': errors})
+                    errors = 0
+                    for task in tasks:
+                        self._complete(task.value, exc=exc)
+
+            if completed:
+                interval = self._min_interval
+            else:
+                interval = min(interval * 2, self._max_interval)
+
+            if self._wakeup.wait(interval):
+                self._wakeup.clear()
+                interval = self._min_interval
+
+    def _poll(self, tasks):
+        """Poll the given tasks; return True if any of them completed."""
+        completed = False
+        try:
+            task_infos = self._get_task_infos(tasks)
+        except exceptions.VimException:
+            LOG.debug("Error reading info of %d tasks, polling them one by "
+                      "one.", len(tasks), exc_info=True)
+            task_infos = {}
+
+        # A single invalid task fails the whole batch, and tasks which no
+        # longer exist are left out of its results; poll those tasks on
+        # their own to fail only the futures of the broken ones.
+        for task in tasks:
+            if task.value in task_infos:
+                continue
+            try:
+                task_infos[task.value] = self._session.invoke_api(
+                    vim_util, 'get_object_property', self._session.vim,
+                    task, 'info', skip_op_id=True)
+            except exceptions.VimException as exc:
+                LOG.exception("Error occurred while reading info of "
+                              "task: %s.", task)
+                self._complete(task.value, exc=exc)
+                completed = True
+
+        for value, task_info in task_infos.items():
+            if task_info is None or task_info.state in ['queued', 'running']:
+                continue
+            if task_info.state == 'success':
+                LOG.debug("Task: %s completed successfully.", value)
+                self._complete(value, result=task_info)
+            else:
+                self._complete(value, exc=self._get_task_fault(value,
+                                                               task_info))
+            completed = True
+        return completed
+
+    @staticmethod
+    def _get_task_fault(value, task_info):
+        try:
+            return exceptions.translate_fault(task_info.error)
+        except Exception as exc:
+            LOG.exception("Error translating the fault of task: %s.", value)
+            return exceptions.VimException(
+                "Task: %s failed with an unreadable error." % value,
+                cause=exc)
+
+    def _get_task_infos(self, tasks):
+        task_infos = {}
+        result = self._session.invoke_api(
+            vim_util,
+            'get_properties_for_a_collection_of_objects',
+            self._session.vim,
+            'Task',
+            tasks,
+            ['info'],
+            max_objects=len(tasks))
+        while result:
+            for obj_content in result.objects or []:
+                props = vim_util.propset_dict(
+                    getattr(obj_content, 'propSet', None))
+                task_infos[obj_content.obj.value] = props.get('info')
+            result = self._session.invoke_api(vim_util,
+                                              'continue_retrieval',
+                                              self._session.vim,
+                                              result)
+        return task_infos
+
+    def _complete(self, value, result=None, exc=None):
+        with self._lock:
+            _task, waiters = self._pending.pop(value, (None, []))
+        for future in waiters:
+            if not future.set_running_or_notify_cancel():
+                continue
+            if exc is not None:
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
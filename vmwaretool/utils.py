@@ -1,31 +1,24 @@
-import asyncio
 import contextlib
 import json
 import os
 import random
-import traceback
-import yaspin
 import colorsys
 from pathlib import Path
 from logging import NullHandler
 import logging as py_logging
 
-from oslo_config import cfg
-from oslo_log import log as logging
 
-
-CONF = cfg.CONF
 DOMAIN = "vmwaretool"
 home = str(Path.home())
 DEFAULT_CONFIG_DIR = "{}/.config/vmwaretool/".format(home)
 DEFAULT_CONFIG_FILE = "{}/.config/vmwaretool/vmwaretool.conf".format(home)
 
 LOG_LEVELS = {
-    "CRITICAL": logging.CRITICAL,
-    "ERROR": logging.ERROR,
-    "WARNING": logging.WARNING,
-    "INFO": logging.INFO,
-    "DEBUG": logging.DEBUG,
+    "CRITICAL": py_logging.CRITICAL,
+    "ERROR": py_logging.ERROR,
+    "WARNING": py_logging.WARNING,
+    "INFO": py_logging.INFO,
+    "DEBUG": py_logging.DEBUG,
 }
 
 def setup_logging():
@@ -37,7 +30,8 @@ def setup_logging():
     * logging.set_defaults (optional)
     * logging.setup
     """
-
+    from oslo_config import cfg
+    from oslo_log import log as logging
 
     # Optional step to set new defaults if necessary for
     # * logging_context_format_string
@@ -80,7 +74,7 @@ def setup_logging():
 
     # Required step to register common, logging and generic configuration
     # variables
-    logging.setup(CONF, DOMAIN)
+    logging.setup(cfg.CONF, DOMAIN)
 
 
 class Spinner:
@@ -98,6 +92,8 @@ class Spinner:
         if cls.enabled:
             if len(args) < 1:  # second positional arg is text
                 kwargs.setdefault("text", "Spinning up...")
+            import yaspin
+
             sp = yaspin.yaspin(*args, **kwargs)
             if cls.random:
                 sp = getattr(sp, random.choice(cls.random_spinners))
@@ -107,6 +103,8 @@ class Spinner:
 
     @classmethod
     def verify_spinners_present(cls, name):
+        import yaspin
+
         y = yaspin.yaspin()
         for spinner in cls.random_spinners:
             if not hasattr(y, spinner):
@@ -1,3 +1,5 @@
+import os
+import re
 
 from oslo_config import cfg
 from oslo_log import log as logging
@@ -7,11 +9,20 @@ from oslo_vmware import image_transfer
 from oslo_vmware import pbm
 from oslo_vmware import vim_util
 
+from vmwaretool import datastore
+from vmwaretool import retrieval
+from vmwaretool import session_cache
+from vmwaretool import sessions
+from vmwaretool import tasks
+from vmwaretool import utils
 from vmwaretool import volumeops
+from vmwaretool import wsdl_cache
 
 EXTENSION_KEY = 'org.openstack.storage'
 EXTENSION_TYPE = 'volume'
 
+LOG = logging.getLogger(__name__)
+
 
 vmdk_opts = [
     cfg.StrOpt('vmware_host_ip',
@@ -131,13 +142,114 @@ vmdk_opts = [
                'datastores, and vmware_random_datastore_range is set to 5 '
                'Then it will filter in 5 datastores prior to randomizing '
                'the datastores to pick from.'),
+    cfg.StrOpt('vmware_backing_index_file',
+               help='Path of a local file in which the index of volume '
+                    'backings is persisted between runs. If set, the index '
+                    'is loaded on startup and only backings which changed '
+                    'since the last run are fetched from vCenter server.'),
+    cfg.BoolOpt('vmware_adaptive_page_size',
+                default=False,
+                help='If True, the number of objects retrieved per batch is '
+                     'tuned per object type and property set from the '
+                     'measured retrieval time, starting from '
+                     'vmware_max_objects_retrieval.'),
+    cfg.IntOpt('vmware_adaptive_page_size_min',
+               default=20,
+               min=1,
+               help='Lower bound of the adaptive batch size.'),
+    cfg.IntOpt('vmware_adaptive_page_size_max',
+               default=2000,
+               min=1,
+               help='Upper bound of the adaptive batch size.'),
+    cfg.FloatOpt('vmware_adaptive_page_target_time',
+                 default=1.0,
+                 help='Time in seconds a batch retrieval should take when '
+                      'vmware_adaptive_page_size is enabled.'),
+    cfg.StrOpt('vmware_adaptive_page_size_file',
+               default=os.path.join(utils.DEFAULT_CONFIG_DIR,
+                                    retrieval.DEFAULT_PAGE_SIZES_FILE_NAME),
+               help='Path of the file in which adaptive batch sizes are '
+                    'saved, so that later runs start with the sizes learned '
+                    'before. The batch size of a retrieval is fixed when it '
+                    'starts, so learned sizes apply to the next retrieval of '
+                    'the same object type and properties.'),
+    cfg.BoolOpt('vmware_batch_task_polling',
+                default=False,
+                help='If True, all in-flight vCenter tasks are polled '
+                     'together by a single thread with one property '
+                     'collector call, starting at a short interval which '
+                     'backs off to vmware_task_poll_interval.'),
+    cfg.IntOpt('vmware_session_pool_size',
+               default=1,
+               min=1,
+               help='Number of vCenter sessions used concurrently. If '
+                    'greater than 1, API calls borrow a session from a '
+                    'pool so that parallel workers do not share a single '
+                    'session.'),
+    cfg.IntOpt('vmware_session_max_idle',
+               default=sessions.DEFAULT_MAX_IDLE,
+               help='Pooled sessions idle for longer than this number of '
+                    'seconds log in again before they are used, ahead of '
+                    'the vCenter server session timeout.'),
+    cfg.BoolOpt('vmware_session_cache',
+                default=False,
+                help='If True, the vCenter session cookie is saved in '
+                     'vmware_session_cache_file and reused by later runs '
+                     'while the session is still valid, instead of logging '
+                     'in again. Ignored if vmware_session_pool_size is '
+                     'greater than 1.'),
+    cfg.StrOpt('vmware_session_cache_file',
+               default=os.path.join(utils.DEFAULT_CONFIG_DIR,
+                                    session_cache.DEFAULT_FILE_NAME),
+               help='Path of the file holding cached session cookies. It '
+                    'is created readable only by its owner.'),
+    cfg.BoolOpt('vmware_wsdl_cache',
+                default=False,
+                help='If True, the parsed vCenter WSDL is saved in '
+                     'vmware_wsdl_cache_dir and loaded by later runs instead '
+                     'of parsing the WSDL again. Entries are invalidated '
+                     'when the vCenter server version changes.'),
+    cfg.StrOpt('vmware_wsdl_cache_dir',
+               default=os.path.join(utils.DEFAULT_CONFIG_DIR, 'wsdl'),
+               help='Directory holding the parsed WSDL cache.'),
+    cfg.IntOpt('vmware_profile_compliance_ttl',
+               default=datastore.DEFAULT_COMPLIANCE_TTL,
+               min=0,
+               help='Time in seconds for which the storage profile '
+                    'compliance of datastores is cached.'),
+    cfg.IntOpt('vmware_profile_compliance_refresh_interval',
+               default=datastore.DEFAULT_COMPLIANCE_REFRESH_INTERVAL,
+               min=0,
+               help='Interval in seconds at which cached storage profile '
+                    'compliance is refreshed in the background. 0 disables '
+                    'the background refresh.'),
+    cfg.BoolOpt('vmware_datastore_mirror',
+                default=False,
+                help='If True, datastore selection reads the datastores from '
+                     'an in-memory mirror kept current by a background '
+                     'thread with WaitForUpdatesEx, instead of retrieving '
+                     'them on every selection. The mirror logs in with a '
+                     'dedicated vCenter session, not a pooled one, since '
+                     'property collectors belong to the session which '
+                     'created them.'),
+    cfg.IntOpt('vmware_datastore_mirror_max_staleness',
+               default=datastore.DEFAULT_MIRROR_MAX_STALENESS,
+               min=1,
+               help='Age in seconds beyond which the datastore mirror is '
+                    'not used and datastores are retrieved instead.'),
+    cfg.BoolOpt('vmware_vectorized_placement',
+                default=False,
+                help='If True, datastores are filtered and ranked with numpy '
+                     'arrays built from the datastore mirror. Requires '
+                     'vmware_datastore_mirror and numpy; otherwise the '
+                     'regular selection is used.'),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(vmdk_opts, group='vmware')
 
 
-def _create_session():
+def _connect(use_cache=False):
     ip = CONF.vmware.vmware_host_ip
     port = CONF.vmware.vmware_host_port
     username = CONF.vmware.vmware_host_username
@@ -158,15 +270,159 @@ def _create_session():
                                    cacert=ca_file,
                                    insecure=insecure,
                                    pool_size=pool_size,
-                                   op_id_prefix='c-vol')
+                                   op_id_prefix='c-vol',
+                                   create_session=not use_cache)
+    _set_pbm_wsdl_loc(session)
+    if use_cache:
+        cache = session_cache.SessionCache(
+            CONF.vmware.vmware_session_cache_file)
+        session_cache.login(session, cache, ip, port, username)
+    return session
+
+
+def _set_pbm_wsdl_loc(session):
+    vc_version = (CONF.vmware.vmware_host_version or
+                  session.vim.service_content.about.version)
+    pbm_wsdl_loc = pbm.get_pbm_wsdl_location(vc_version)
+    if not pbm_wsdl_loc:
+        LOG.warning("No PBM WSDL found for vCenter version: %s, storage "
+                    "profiles are not available.", vc_version)
+        return
+    session.pbm_wsdl_loc_set(pbm_wsdl_loc)
+
+
+def _uses_storage_profiles():
+    return bool(CONF.vmware.vmware_storage_profile)
+
+
+def _build_pbm_client(session):
+    """Build the PBM client, which oslo.vmware otherwise builds on first use.
+
+    :return: whether PBM is available
+    """
+    if session.pbm is None:
+        LOG.debug("PBM is not available, storage profiles are not used.")
+        return False
+    return True
+
+
+def _preload_profile_ids(session, ds_sel):
+    if not _build_pbm_client(session):
+        return
+    try:
+        ds_sel.preload_profile_ids()
+    except exceptions.VimException:
+        # Profile IDs are loaded on first use instead.
+        LOG.warning("Error preloading storage profile IDs.", exc_info=True)
+
+
+def _create_session(use_cache=False):
+    if not CONF.vmware.vmware_wsdl_cache:
+        return _connect(use_cache=use_cache)
+
+    cache = wsdl_cache.WsdlCache(CONF.vmware.vmware_wsdl_cache_dir,
+                                 CONF.vmware.vmware_host_ip,
+                                 CONF.vmware.vmware_host_port)
+    with cache.installed():
+        session = _connect(use_cache=use_cache)
+        if _uses_storage_profiles():
+            # Build the PBM client while the cache is installed so that its
+            # WSDL is not parsed either.
+            _build_pbm_client(session)
+    cache.update_server_version(session.vim.service_content.about)
     return session
 
 
+def _create_session_pool():
+    pool = sessions.SessionPool(
+        _create_session,
+        CONF.vmware.vmware_session_pool_size,
+        max_idle=CONF.vmware.vmware_session_max_idle)
+    return sessions.PooledSession(
+        pool, task_poll_interval=CONF.vmware.vmware_task_poll_interval)
+
+
+def _create_datastore_mirror(max_objects):
+    # The mirror's property collector only exists on the session which
+    # created it, so the mirror cannot use pooled sessions, and its long
+    # polling calls would hold a shared one.
+    mirror = datastore.DatastoreMirror(_create_session(), max_objects)
+    try:
+        mirror.start()
+    except exceptions.VimException:
+        LOG.warning("Error filling the datastore mirror; datastores are "
+                    "retrieved on every selection.", exc_info=True)
+        mirror.stop()
+        mirror.get_session().logout()
+        return None
+    return mirror
+
+
 def setup_connection():
-    session = _create_session()
+    if CONF.vmware.vmware_session_pool_size > 1:
+        session = _create_session_pool()
+    else:
+        session = _create_session(
+            use_cache=CONF.vmware.vmware_session_cache)
     max_objects = CONF.vmware.vmware_max_objects_retrieval
     random_ds = CONF.vmware.vmware_select_random_best_datastore
     random_ds_range = CONF.vmware.vmware_random_datastore_range
-    _volumeops = volumeops.VMwareVolumeOps(session, max_objects, EXTENSION_KEY, EXTENSION_TYPE)
+    page_sizer = None
+    if CONF.vmware.vmware_adaptive_page_size:
+        page_sizer = retrieval.PageSizer(
+            max_objects,
+            CONF.vmware.vmware_adaptive_page_size_min,
+            CONF.vmware.vmware_adaptive_page_size_max,
+            target_seconds=CONF.vmware.vmware_adaptive_page_target_time,
+            path=CONF.vmware.vmware_adaptive_page_size_file)
+    task_tracker = None
+    if CONF.vmware.vmware_batch_task_polling:
+        task_tracker = tasks.TaskTracker(
+            session, max_interval=CONF.vmware.vmware_task_poll_interval)
+    _volumeops = volumeops.VMwareVolumeOps(
+        session, max_objects, EXTENSION_KEY, EXTENSION_TYPE,
+        backing_index_file=CONF.vmware.vmware_backing_index_file,
+        page_sizer=page_sizer,
+        task_tracker=task_tracker)
+
+    ds_regex = None
+    if CONF.vmware.vmware_datastore_regex:
+        ds_regex = re.compile(CONF.vmware.vmware_datastore_regex)
+    compliance_cache = datastore.ProfileComplianceCache(
+        session,
+        ttl=CONF.vmware.vmware_profile_compliance_ttl,
+        refresh_interval=(
+            CONF.vmware.vmware_profile_compliance_refresh_interval))
+    mirror = None
+    if CONF.vmware.vmware_datastore_mirror:
+        mirror = _create_datastore_mirror(max_objects)
+    ds_sel = datastore.DatastoreSelector(
+        _volumeops, session, max_objects, ds_regex=ds_regex,
+        random_ds=random_ds, random_ds_range=random_ds_range,
+        mirror=mirror,
+        vectorized=CONF.vmware.vmware_vectorized_placement,
+        compliance_cache=compliance_cache, page_sizer=page_sizer,
+        mirror_max_staleness=(
+            CONF.vmware.vmware_datastore_mirror_max_staleness))
+    if _uses_storage_profiles():
+        # Otherwise profile IDs are loaded by the first get_profile_id, so
+        # runs which do not use profiles never build the PBM client.
+        _preload_profile_ids(session, ds_sel)
+
+    return (session, _volumeops, ds_sel)
+
+
+def close_connection(session, ds_sel):
+    """Stop the background work started for a connection.
 
-    return (session, _volumeops)
+    Pooled sessions and the datastore mirror's session are logged out as
+    well; a single session is kept alive since it may be reused from the
+    session cache.
+    """
+    ds_sel.close()
+    mirror = ds_sel.get_mirror()
+    if mirror is not None:
+        mirror.stop()
+        mirror.get_session().logout()
+    if isinstance(session, sessions.PooledSession):
+        session.logout()
@@ -17,7 +17,13 @@
 Implements operations on volumes residing on VMware datastores.
 """
 
+import collections
+from concurrent import futures
+import copy
+import functools
 import json
+import threading
+import time
 
 from oslo_log import log as logging
 from oslo_utils import units
@@ -27,7 +33,17 @@ from oslo_vmware import vim_util
 import six
 from six.moves import urllib
 
+from vmwaretool import ancestry
+from vmwaretool import backing_cache
+from vmwaretool import backing_index
+from vmwaretool import batch
 from vmwaretool import exceptions as vmdk_exceptions
+from vmwaretool import folder_tree
+from vmwaretool import inventory
+from vmwaretool import retrieval
+from vmwaretool import snapshot_index
+from vmwaretool import snapshot_scanner
+from vmwaretool import tasks
 
 
 LOG = logging.getLogger(__name__)
@@ -71,6 +87,24 @@ def split_datastore_path(datastore_path):
     return (datastore_name.strip(), folder_path.strip(), file_name.strip())
 
 
+def _waits_for_tasks(steps):
+    """Turn a generator method which yields vCenter tasks into a method.
+
+    The generator yields the reference of every task it starts and is sent
+    the task info once the task completes, or has the task's error thrown
+    into it. The returned method waits for each task in turn and returns
+    the generator's return value. The generator function is kept as the
+    steps attribute, so that callers such as the asyncio facade can wait
+    for the tasks themselves.
+    """
+    @functools.wraps(steps)
+    def method(self, *args, **kwargs):
+        return self._run_steps(steps(self, *args, **kwargs))
+
+    method.steps = steps
+    return method
+
+
 class VirtualDiskPath(object):
     """Class representing paths of files comprising a virtual disk."""
 
@@ -283,40 +317,278 @@ class ControllerType(object):
                                    ControllerType.PARA_VIRTUAL]
 
 
+class ReconfigTransaction(object):
+    """Changes to a backing VM applied by a single ReconfigVM_Task.
+
+    The changes are collected into one VirtualMachineConfigSpec and applied
+    by commit, or when leaving the transaction's with block without an
+    exception. Changes to the disk device, such as a new disk UUID and
+    profile, are merged into one device edit.
+    """
+
+    def __init__(self, vops, backing):
+        self._vops = vops
+        self._backing = backing
+        self._cf = vops._session.vim.client.factory
+        self._spec = self._cf.create('ns0:VirtualMachineConfigSpec')
+        self._device_changes = []
+        self._disk_spec = None
+        self._extra_config = {}
+        self._changed = False
+        self._done = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+        return False
+
+    def _get_disk_spec(self):
+        if self._disk_spec is None:
+            self._disk_spec = self._cf.create('ns0:VirtualDeviceConfigSpec')
+            # Edit a copy; the cached device is shared with other callers.
+            self._disk_spec.device = copy.deepcopy(
+                self._vops._get_disk_device(self._backing))
+            self._disk_spec.operation = 'edit'
+            self._device_changes.append(self._disk_spec)
+        return self._disk_spec
+
+    def update_disk_uuid(self, disk_uuid):
+        """Change the UUID of the backing's disk."""
+        self._get_disk_spec().device.backing.uuid = disk_uuid
+        self._changed = True
+
+    def update_extra_config(self, extra_config):
+        """Write the given key-value pairs to the backing's extra-config.
+
+        The BACKING_UUID_KEY entry, if any, changes the instance UUID.
+        """
+        extra_config = dict(extra_config)
+        if BACKING_UUID_KEY in extra_config:
+            self._spec.instanceUuid = extra_config.pop(BACKING_UUID_KEY)
+        self._extra_config.update(extra_config)
+        self._changed = True
+
+    def change_profile(self, profile_id):
+        """Change the storage profile of the backing and its disk.
+
+        The current profile is removed if profile_id is None.
+        """
+        if profile_id is None:
+            vm_profile = self._cf.create('ns0:VirtualMachineEmptyProfileSpec')
+        else:
+            vm_profile = self._cf.create(
+                'ns0:VirtualMachineDefinedProfileSpec')
+            vm_profile.profileId = profile_id.uniqueId
+
+        self._spec.vmProfile = [vm_profile]
+        self._get_disk_spec().profile = [vm_profile]
+        self._changed = True
+
+    def update_uuid(self, uuid):
+        """Change the instance UUID of the backing."""
+        self._spec.instanceUuid = uuid
+        self._changed = True
+
+    def add_device_change(self, device_spec):
+        """Add a VirtualDeviceConfigSpec to the transaction."""
+        self._device_changes.append(device_spec)
+        self._changed = True
+
+    def commit(self):
+        """Apply the collected changes, if any, with one reconfigure."""
+        if self._done:
+            return
+        self._done = True
+        if not self._changed:
+            return
+        if self._extra_config:
+            self._spec.extraConfig = (
+                self._vops._get_extra_config_option_values(
+                    self._extra_config))
+        if self._device_changes:
+            self._spec.deviceChange = self._device_changes
+        self._vops._reconfigure_backing(self._backing, self._spec)
+
+    def abort(self):
+        """Discard the collected changes."""
+        self._done = True
+
+
+# Cached backing references confirmed to exist within this number of
+# seconds are returned without asking vCenter.
+DEFAULT_BACKING_REF_MAX_AGE = 300
+
+
 class VMwareVolumeOps(object):
     """Manages volume operations."""
 
-    def __init__(self, session, max_objects, extension_key, extension_type):
+    def __init__(self, session, max_objects, extension_key, extension_type,
+                 backing_index_file=None, page_sizer=None,
+                 task_tracker=None,
+                 backing_ref_max_age=DEFAULT_BACKING_REF_MAX_AGE):
         self._session = session
         self._max_objects = max_objects
+        self._page_sizer = page_sizer
+        self._task_tracker = task_tracker
         self._extension_key = extension_key
         self._extension_type = extension_type
-        self._folder_cache = {}
-        self._backing_ref_cache = {}
+        self._folder_trees = {}
+        self._folder_trees_lock = threading.Lock()
+        self._backing_ref_cache = backing_index.BackingRefCache()
+        # Changes made to the cache while it is rebuilt in the background,
+        # as (moref value, (name, instance UUID) or None if removed), or
+        # None if no rebuild is running.
+        self._backing_ref_changes = None
+        self._backing_ref_lock = threading.Lock()
+        self._backing_ref_max_age = backing_ref_max_age
+        # Time at which all cached backing references were last known to
+        # exist, or None, and times of references confirmed since then.
+        self._backing_refs_confirmed_at = None
+        self._backing_refs_checked = {}
+        self._device_cache = backing_cache.BackingCache()
+        self._snapshot_cache = backing_cache.BackingCache()
+        self._ancestry = ancestry.AncestryResolver(session, max_objects)
         self._vmx_version = None
+        self._inventory = None
+        self._backing_index = None
+        self._backing_index_thread = None
+        if backing_index_file:
+            self._backing_index = backing_index.BackingIndex(
+                backing_index.BackingIndexStore(backing_index_file),
+                page_sizer=page_sizer)
+
+    def _wait_for_task(self, task):
+        """Wait for the given task through the task tracker, if any.
+
+        :param task: managed object reference of the task
+        :return: task info upon successful completion of the task
+        """
+        if self._task_tracker is not None:
+            return self._task_tracker.wait(task)
+        return self._session.wait_for_task(task)
+
+    def _run_steps(self, steps):
+        """Run a generator of a _waits_for_tasks method to completion."""
+        task_info = None
+        error = None
+        while True:
+            try:
+                if error is None:
+                    task = steps.send(task_info)
+                else:
+                    task = steps.throw(error)
+            except StopIteration as e:
+                return e.value
+            try:
+                task_info = self._wait_for_task(task)
+                error = None
+            except Exception as e:
+                task_info = None
+                error = e
 
     def set_vmx_version(self, vmx_version):
         self._vmx_version = vmx_version
 
+    def get_task_tracker(self):
+        return self._task_tracker
+
+    def set_task_tracker(self, task_tracker):
+        self._task_tracker = task_tracker
+
     def get_backing(self, name, backing_uuid):
         """Get the backing based on name or uuid.
 
+        The backing ref cache is consulted first, by instance UUID, volume ID
+        and then name. A cached reference is returned without asking vCenter
+        if it was confirmed to exist within backing_ref_max_age seconds;
+        older ones are checked with one property read. vCenter is searched
+        by UUID only if the backing is not cached or the cached reference is
+        stale. References which are found to no longer exist by later device
+        or snapshot reads are evicted as well.
+
         :param name: Name of the backing
         :param backing_uuid: UUID of the backing
         :return: Managed object reference to the backing
         """
 
-        ref = self.get_backing_by_uuid(backing_uuid)
-        if not ref:
-            # old version of the driver might have created this backing and
-            # hence cannot be queried by uuid
+        ref = (self._backing_ref_cache.get_by_uuid(backing_uuid) or
+               self._backing_ref_cache.get_by_volume_id(backing_uuid) or
+               self._backing_ref_cache.get(name))
+        if ref and not self._is_backing_ref_confirmed(ref):
+            if self._backing_exists(ref):
+                self._backing_refs_checked[ref.value] = time.monotonic()
+            else:
+                LOG.debug("Cached ref: %(ref)s for %(name)s is stale.",
+                          {'ref': ref, 'name': name})
+                self.invalidate_backing(ref)
+                ref = None
+
+        if ref:
             LOG.debug("Returning cached ref for %s.", name)
-            ref = self._backing_ref_cache.get(name)
+        else:
+            ref = self.get_backing_by_uuid(backing_uuid)
+            if ref:
+                self._add_backing_ref(name, ref.value, backing_uuid)
+                self._backing_refs_checked[ref.value] = time.monotonic()
 
         LOG.debug("Backing (%(name)s, %(uuid)s) ref: %(ref)s.",
                   {'name': name, 'uuid': backing_uuid, 'ref': ref})
         return ref
 
+    def _is_backing_ref_confirmed(self, backing):
+        # Individual checks are cleared whenever all references are
+        # confirmed, so they are never older than the whole cache.
+        confirmed_at = self._backing_refs_checked.get(
+            backing.value, self._backing_refs_confirmed_at)
+        return (confirmed_at is not None and
+                time.monotonic() - confirmed_at <= self._backing_ref_max_age)
+
+    def _set_backing_refs_confirmed(self):
+        self._backing_refs_confirmed_at = time.monotonic()
+        self._backing_refs_checked = {}
+
+    def _backing_exists(self, backing):
+        try:
+            self._session.invoke_api(vim_util, 'get_object_property',
+                                     self._session.vim, backing, 'name')
+        except exceptions.ManagedObjectNotFoundException:
+            return False
+        return True
+
+    def _get_backing_property(self, backing, property_name):
+        try:
+            return self._session.invoke_api(vim_util, 'get_object_property',
+                                            self._session.vim, backing,
+                                            property_name)
+        except exceptions.ManagedObjectNotFoundException:
+            # The backing may have been returned from the ref cache.
+            self.invalidate_backing(backing)
+            raise
+
+    def _add_backing_ref(self, name, moref_value, instance_uuid):
+        with self._backing_ref_lock:
+            self._backing_ref_cache.add(name, moref_value,
+                                        instance_uuid=instance_uuid)
+            if self._backing_ref_changes is not None:
+                self._backing_ref_changes.append(
+                    (moref_value, (name, instance_uuid)))
+
+    def invalidate_backing(self, backing):
+        """Remove the given backing from the backing ref cache.
+
+        :param backing: Managed object reference to the backing
+        """
+        with self._backing_ref_lock:
+            self._backing_ref_cache.remove(backing.value)
+            if self._backing_ref_changes is not None:
+                self._backing_ref_changes.append((backing.value, None))
+        self._backing_refs_checked.pop(backing.value, None)
+
     def get_backing_by_uuid(self, uuid):
         LOG.debug("Get ref by UUID: %s.", uuid)
         result = self._session.invoke_api(
@@ -329,22 +601,33 @@ class VMwareVolumeOps(object):
         if result:
             return result[0]
 
-    def build_backing_ref_cache(self, name_regex=None):
+    def build_backing_ref_cache(self, name_regex=None, background=False):
+        """Build the cache of backing names to references.
+
+        If a backing index file is configured, the cache is first filled
+        from the saved index and the index is then reconciled with vCenter,
+        either inline or in a background thread if background is True.
+
+        :param name_regex: only cache backings whose name matches
+        :param background: reconcile the saved index in a background thread
+        """
+        if self._backing_index is not None:
+            self._build_backing_ref_cache_from_index(name_regex, background)
+            return
 
         LOG.debug("Building backing ref cache.")
-        result = self._session.invoke_api(
-            vim_util,
-            'get_objects',
-            self._session.vim,
+        pages = retrieval.retrieve_pages(
+            self._session,
             'VirtualMachine',
             self._max_objects,
             properties_to_collect=[
                 'name',
                 'config.instanceUuid',
-                'config.extraConfig["cinder.volume.id"]'])
+                'config.extraConfig["cinder.volume.id"]'],
+            page_sizer=self._page_sizer)
 
-        while result:
-            for backing in result.objects:
+        for page in pages:
+            for backing in page.objects:
                 instance_uuid = None
                 vol_id = None
 
@@ -359,15 +642,71 @@ class VMwareVolumeOps(object):
                 if name_regex and not name_regex.match(name):
                     continue
 
-                if instance_uuid and instance_uuid == vol_id:
-                    # no need to cache backing with UUID set to volume ID
-                    continue
-
-                self._backing_ref_cache[name] = backing.obj
+                self._backing_ref_cache.add(name, backing.obj.value,
+                                            instance_uuid=instance_uuid,
+                                            volume_id=vol_id)
 
-            result = self.continue_retrieval(result)
+            # Release the page as soon as it is processed.
+            del page.objects[:]
+        self._set_backing_refs_confirmed()
         LOG.debug("Backing ref cache size: %d.", len(self._backing_ref_cache))
 
+    def _build_backing_ref_cache_from_index(self, name_regex, background):
+        def _fill(confirmed=True):
+            cache = backing_index.BackingRefCache()
+            for record in self._backing_index.records():
+                if name_regex and not name_regex.match(record.name):
+                    continue
+                cache.add(record.name, record.moref_value,
+                          instance_uuid=record.instance_uuid,
+                          volume_id=record.volume_id)
+            with self._backing_ref_lock:
+                if self._backing_ref_changes is not None:
+                    # The index may have been read before these changes.
+                    for moref_value, keys in self._backing_ref_changes:
+                        if keys is None:
+                            cache.remove(moref_value)
+                        else:
+                            cache.add(keys[0], moref_value,
+                                      instance_uuid=keys[1])
+                    self._backing_ref_changes = None
+                # Swap in the new cache so that readers never see a partial
+                # one.
+                self._backing_ref_cache = cache
+            if confirmed:
+                self._set_backing_refs_confirmed()
+            LOG.debug("Backing ref cache size: %d.", len(cache))
+
+        def _refresh():
+            try:
+                self._backing_index.refresh(self._session, self._max_objects)
+            except Exception:
+                LOG.exception("Error refreshing backing index.")
+                with self._backing_ref_lock:
+                    self._backing_ref_changes = None
+                return
+            _fill()
+
+        if not self._backing_index.load(self._session):
+            LOG.debug("Building backing index.")
+            self._backing_index.refresh(self._session, self._max_objects)
+            _fill()
+        elif background:
+            # Serve lookups from the saved index while it is reconciled; its
+            # references are checked on use until then.
+            _fill(confirmed=False)
+            with self._backing_ref_lock:
+                self._backing_ref_changes = []
+            thread = threading.Thread(target=_refresh,
+                                      name='backing-index-refresh')
+            thread.daemon = True
+            thread.start()
+            self._backing_index_thread = thread
+        else:
+            self._backing_index.refresh(self._session, self._max_objects)
+            _fill()
+
+    @_waits_for_tasks
     def delete_backing(self, backing):
         """Delete the backing.
 
@@ -377,9 +716,30 @@ class VMwareVolumeOps(object):
         task = self._session.invoke_api(self._session.vim, 'Destroy_Task',
                                         backing)
         LOG.debug("Initiated deletion of VM backing: %s.", backing)
-        self._session.wait_for_task(task)
+        yield task
+        self.invalidate_backing(backing)
+        self._device_cache.invalidate(backing.value)
+        self._snapshot_cache.invalidate(backing.value)
         LOG.info("Deleted the VM backing: %s.", backing)
 
+    def run_batch(self, operations, max_workers=batch.DEFAULT_MAX_WORKERS,
+                  per_host_limit=None, per_datastore_limit=None):
+        """Run many operations of this class concurrently.
+
+        :param operations: iterable of batch.BatchOperation
+        :param max_workers: maximum number of operations in flight
+        :param per_host_limit: maximum number of operations in flight per
+                               host
+        :param per_datastore_limit: maximum number of operations in flight
+                                    per datastore
+        :return: tuple of the list of batch.BatchResult, in the order of the
+                 operations, and batch.BatchStats
+        """
+        executor = batch.BatchExecutor(
+            self, max_workers=max_workers, per_host_limit=per_host_limit,
+            per_datastore_limit=per_datastore_limit)
+        return executor.run(operations)
+
     def reload_backing(self, backing):
         """Reload the backing.
 
@@ -498,6 +858,9 @@ class VMwareVolumeOps(object):
     def _get_parent(self, child, parent_type):
         """Get immediate parent of given type via 'parent' property.
 
+        The whole parent chain is read with one call through the ancestry
+        resolver, which caches the folder and datacenter hierarchy.
+
         :param child: Child entity reference
         :param parent_type: Entity type of the parent
         :return: Immediate parent of specific type up the hierarchy via
@@ -506,18 +869,17 @@ class VMwareVolumeOps(object):
 
         if not child:
             return None
-        if child._type == parent_type:
-            return child
-        parent = self._session.invoke_api(vim_util, 'get_object_property',
-                                          self._session.vim, child, 'parent')
-        return self._get_parent(parent, parent_type)
+        return self._ancestry.get_parents([child], parent_type)[0]
 
     def get_dc(self, child):
         """Get parent datacenter up the hierarchy via 'parent' property.
 
-        :param child: Reference of the child entity
-        :return: Parent Datacenter of the param child entity
+        :param child: Reference of the child entity, or list of references
+        :return: Parent Datacenter of the param child entity, or list of the
+                 datacenters of the given entities, looked up together
         """
+        if isinstance(child, (list, tuple)):
+            return self._ancestry.get_parents(child, 'Datacenter')
         return self._get_parent(child, 'Datacenter')
 
     def get_vmfolder(self, datacenter):
@@ -532,23 +894,13 @@ class VMwareVolumeOps(object):
 
     def _get_child_folder(self, parent_folder, child_folder_name):
         LOG.debug("Finding child folder: %s.", child_folder_name)
-        # Get list of child entities for the parent folder
-        prop_val = self._session.invoke_api(vim_util, 'get_object_property',
-                                            self._session.vim, parent_folder,
-                                            'childEntity')
-
-        if prop_val and hasattr(prop_val, 'ManagedObjectReference'):
-            child_entities = prop_val.ManagedObjectReference
-
-            # Return if the child folder with input name is already present
-            for child_entity in child_entities:
-                if child_entity._type != 'Folder':
-                    continue
-                child_entity_name = self.get_entity_name(child_entity)
-                if (child_entity_name
-                    and (urllib.parse.unquote(child_entity_name)
-                         == child_folder_name)):
-                    return child_entity
+        # Read the names of all child folders with one retrieval instead of
+        # one call per child entity.
+        for child_folder, name, _parent in folder_tree.fetch_folders(
+                self._session, parent_folder, self._max_objects,
+                recursive=False):
+            if name == child_folder_name:
+                return child_folder
 
     def create_folder(self, parent_folder, child_folder_name):
         """Creates child folder under the given parent folder.
@@ -576,10 +928,26 @@ class VMwareVolumeOps(object):
                                                   child_folder_name)
         return child_folder
 
+    def _get_folder_tree(self, datacenter):
+        with self._folder_trees_lock:
+            tree = self._folder_trees.get(datacenter.value)
+            if tree is None:
+                tree = folder_tree.FolderTree(self.get_vmfolder(datacenter))
+                tree.load(self._session, self._max_objects)
+                self._folder_trees[datacenter.value] = tree
+            return tree
+
+    def invalidate_folder_trees(self):
+        """Drop the folder trees, to be reloaded on next use."""
+        with self._folder_trees_lock:
+            self._folder_trees.clear()
+
     def create_vm_inventory_folder(self, datacenter, path_comp):
         """Create and return a VM inventory folder.
 
-        This method caches references to inventory folders returned.
+        The VM folder tree of the datacenter is loaded with one retrieval on
+        first use, so existing folders are found without calling vCenter.
+        Folders missing from the tree are created and added to it.
 
         :param datacenter: Reference to datacenter
         :param path_comp: Path components as a list
@@ -588,26 +956,24 @@ class VMwareVolumeOps(object):
                   "of datacenter: %(datacenter)s.",
                   {'path_comp': path_comp,
                    'datacenter': datacenter})
-        path = "/" + datacenter.value
-        parent = self._folder_cache.get(path)
-        if not parent:
-            parent = self.get_vmfolder(datacenter)
-            self._folder_cache[path] = parent
+        tree = self._get_folder_tree(datacenter)
+        parent = tree.root
 
         folder = None
         for folder_name in path_comp:
-            path = "/".join([path, folder_name])
-            folder = self._folder_cache.get(path)
+            folder = tree.get_child(parent, folder_name)
             if not folder:
                 folder = self.create_folder(parent, folder_name)
-                self._folder_cache[path] = folder
+                if folder:
+                    tree.add(parent, folder_name, folder)
             parent = folder
 
         LOG.debug("Inventory folder for path: %(path)s is %(folder)s.",
-                  {'path': path,
+                  {'path': "/".join([datacenter.value] + list(path_comp)),
                    'folder': folder})
         return folder
 
+    @_waits_for_tasks
     def extend_virtual_disk(self, requested_size_in_gb, path, dc_ref,
                             eager_zero=False):
         """Extend the virtual disk to the requested size.
@@ -632,7 +998,10 @@ class VMwareVolumeOps(object):
                                         datacenter=dc_ref,
                                         newCapacityKb=size_in_kb,
                                         eagerZero=eager_zero)
-        self._session.wait_for_task(task)
+        yield task
+        # The disk is given by path, so the backing whose cached devices
+        # hold the old capacity is not known.
+        self._device_cache.clear()
         LOG.info("Successfully extended virtual disk: %(path)s to "
                  "%(size)s GB.",
                  {'path': path, 'size': requested_size_in_gb})
@@ -652,15 +1021,11 @@ class VMwareVolumeOps(object):
         size_in_kb = requested_size_in_gb * units.Mi
         config_spec = cf.create('ns0:VirtualMachineConfigSpec')
         disk = None
-        devices = self._session.invoke_api(vim_util,
-                                           'get_object_property',
-                                           self._session.vim,
-                                           vm_ref,
-                                           'config.hardware.device')
-        for device in devices['VirtualDevice']:
+        devices = self._get_hardware_devices(vm_ref)
+        for device in devices:
             if device.__class__.__name__ == "VirtualDisk" and \
                     device.backing.fileName == path:
-                disk = device
+                disk = copy.deepcopy(device)
                 break
         else:
             msg = str.format("Error during online-resize of disk: %(path)s to "
@@ -677,11 +1042,7 @@ class VMwareVolumeOps(object):
         devspec.device = disk
         device_change.append(devspec)
         config_spec.deviceChange = device_change
-        task = self._session.invoke_api(self._session.vim,
-                                        "ReconfigVM_Task",
-                                        vm_ref,
-                                        spec=config_spec)
-        self._session.wait_for_task(task)
+        self._reconfigure_backing(vm_ref, config_spec)
         LOG.info("Successfully extended virtual disk: %(path)s to "
                  "%(size)s GB.",
                  {'path': path, 'size': requested_size_in_gb})
@@ -903,17 +1264,19 @@ class VMwareVolumeOps(object):
             size_kb, disk_type, adapter_type, profile_id)
         return create_spec
 
+    @_waits_for_tasks
     def _create_backing_int(self, folder, resource_pool, host, create_spec):
         """Helper for create backing methods."""
         LOG.debug("Creating volume backing with spec: %s.", create_spec)
         task = self._session.invoke_api(self._session.vim, 'CreateVM_Task',
                                         folder, config=create_spec,
                                         pool=resource_pool, host=host)
-        task_info = self._session.wait_for_task(task)
+        task_info = yield task
         backing = task_info.result
         LOG.info("Successfully created volume backing: %s.", backing)
         return backing
 
+    @_waits_for_tasks
     def create_backing(self, name, size_kb, disk_type, folder, resource_pool,
                        host, ds_name, profileId=None, adapter_type='lsiLogic',
                        extra_config=None):
@@ -947,9 +1310,10 @@ class VMwareVolumeOps(object):
         create_spec = self.get_create_spec(
             name, size_kb, disk_type, ds_name, profile_id=profileId,
             adapter_type=adapter_type, extra_config=extra_config)
-        return self._create_backing_int(folder, resource_pool, host,
-                                        create_spec)
+        return (yield from self._create_backing_int.steps(
+            self, folder, resource_pool, host, create_spec))
 
+    @_waits_for_tasks
     def create_backing_disk_less(self, name, folder, resource_pool,
                                  host, ds_name, profileId=None,
                                  extra_config=None):
@@ -979,8 +1343,8 @@ class VMwareVolumeOps(object):
 
         create_spec = self._get_create_spec_disk_less(
             name, ds_name, profileId=profileId, extra_config=extra_config)
-        return self._create_backing_int(folder, resource_pool, host,
-                                        create_spec)
+        return (yield from self._create_backing_int.steps(
+            self, folder, resource_pool, host, create_spec))
 
     def get_datastore(self, backing):
         """Get datastore where the backing resides.
@@ -1059,6 +1423,7 @@ class VMwareVolumeOps(object):
 
         return service_locator
 
+    @_waits_for_tasks
     def relocate_backing(
             self, backing, datastore, resource_pool, host, disk_type=None,
             service=None):
@@ -1097,14 +1462,19 @@ class VMwareVolumeOps(object):
                                                 disk_move_type, disk_type,
                                                 disk_device, service=service)
 
-        task = self._session.invoke_api(self._session.vim, 'RelocateVM_Task',
-                                        backing, spec=relocate_spec)
-        LOG.debug("Initiated relocation of volume backing: %s.", backing)
-        self._session.wait_for_task(task)
+        try:
+            task = self._session.invoke_api(self._session.vim,
+                                            'RelocateVM_Task', backing,
+                                            spec=relocate_spec)
+            LOG.debug("Initiated relocation of volume backing: %s.", backing)
+            yield task
+        finally:
+            self._device_cache.invalidate(backing.value)
         LOG.info("Successfully relocated volume backing: %(backing)s "
                  "to datastore: %(ds)s and resource pool: %(rp)s.",
                  {'backing': backing, 'ds': datastore, 'rp': resource_pool})
 
+    @_waits_for_tasks
     def move_backing_to_folder(self, backing, folder):
         """Move the volume backing to the folder.
 
@@ -1118,11 +1488,12 @@ class VMwareVolumeOps(object):
                                         list=[backing])
         LOG.debug("Initiated move of volume backing: %(backing)s into the "
                   "folder: %(fol)s.", {'backing': backing, 'fol': folder})
-        self._session.wait_for_task(task)
+        yield task
         LOG.info("Successfully moved volume "
                  "backing: %(backing)s into the "
                  "folder: %(fol)s.", {'backing': backing, 'fol': folder})
 
+    @_waits_for_tasks
     def create_snapshot(self, backing, name, description, quiesce=False):
         """Create snapshot of the backing with given name and description.
 
@@ -1134,41 +1505,40 @@ class VMwareVolumeOps(object):
         """
         LOG.debug("Snapshoting backing: %(backing)s with name: %(name)s.",
                   {'backing': backing, 'name': name})
-        task = self._session.invoke_api(self._session.vim,
-                                        'CreateSnapshot_Task',
-                                        backing, name=name,
-                                        description=description,
-                                        memory=False, quiesce=quiesce)
-        LOG.debug("Initiated snapshot of volume backing: %(backing)s "
-                  "named: %(name)s.", {'backing': backing, 'name': name})
-        task_info = self._session.wait_for_task(task)
+        try:
+            task = self._session.invoke_api(self._session.vim,
+                                            'CreateSnapshot_Task',
+                                            backing, name=name,
+                                            description=description,
+                                            memory=False, quiesce=quiesce)
+            LOG.debug("Initiated snapshot of volume backing: %(backing)s "
+                      "named: %(name)s.", {'backing': backing, 'name': name})
+            task_info = yield task
+        finally:
+            # The disks of the backing now point to the new delta disks.
+            self._device_cache.invalidate(backing.value)
+            self._snapshot_cache.invalidate(backing.value)
         snapshot = task_info.result
         LOG.info("Successfully created snapshot: %(snap)s for volume "
                  "backing: %(backing)s.",
                  {'snap': snapshot, 'backing': backing})
         return snapshot
 
-    @staticmethod
-    def _get_snapshot_from_tree(name, root):
-        """Get snapshot by name from the snapshot tree root.
+    def get_snapshot_index(self, backing):
+        """Get the index of the snapshot tree of the backing.
 
-        :param name: Snapshot name
-        :param root: Current root node in the snapshot tree
-        :return: None in the snapshot tree with given snapshot name
+        The 'snapshot' property is read once and the index is reused until
+        the snapshots of the backing are changed through this class or the
+        cached index expires.
+
+        :param backing: Reference to the backing entity
+        :return: SnapshotIndex; callers must not modify it
         """
-        if not root:
-            return None
-        if root.name == name:
-            return root.snapshot
-        if (not hasattr(root, 'childSnapshotList') or
-                not root.childSnapshotList):
-            # When root does not have children, the childSnapshotList attr
-            # is missing sometime. Adding an additional check.
-            return None
-        for node in root.childSnapshotList:
-            snapshot = VMwareVolumeOps._get_snapshot_from_tree(name, node)
-            if snapshot:
-                return snapshot
+        def _fetch():
+            snapshot_info = self._get_backing_property(backing, 'snapshot')
+            return snapshot_index.SnapshotIndex(snapshot_info)
+
+        return self._snapshot_cache.get(backing.value, _fetch)
 
     def get_snapshot(self, backing, name):
         """Get snapshot of the backing with given name.
@@ -1177,23 +1547,13 @@ class VMwareVolumeOps(object):
         :param name: Snapshot name
         :return: Snapshot entity of the backing with given name
         """
-        snapshot = self._session.invoke_api(vim_util, 'get_object_property',
-                                            self._session.vim, backing,
-                                            'snapshot')
-        if not snapshot or not snapshot.rootSnapshotList:
-            return None
-        for root in snapshot.rootSnapshotList:
-            return VMwareVolumeOps._get_snapshot_from_tree(name, root)
+        return self.get_snapshot_index(backing).get(name)
 
     def snapshot_exists(self, backing):
         """Check if the given backing contains snapshots."""
-        snapshot = self._session.invoke_api(vim_util, 'get_object_property',
-                                            self._session.vim, backing,
-                                            'snapshot')
-        if snapshot is None or snapshot.rootSnapshotList is None:
-            return False
-        return len(snapshot.rootSnapshotList) != 0
+        return len(self.get_snapshot_index(backing)) != 0
 
+    @_waits_for_tasks
     def delete_snapshot(self, backing, name):
         """Delete a given snapshot from volume backing.
 
@@ -1209,16 +1569,66 @@ class VMwareVolumeOps(object):
                      "%(backing)s. Need not delete anything.",
                      {'name': name, 'backing': backing})
             return
-        task = self._session.invoke_api(self._session.vim,
-                                        'RemoveSnapshot_Task',
-                                        snapshot, removeChildren=False)
-        LOG.debug("Initiated snapshot: %(name)s deletion for backing: "
-                  "%(backing)s.",
-                  {'name': name, 'backing': backing})
-        self._session.wait_for_task(task)
+        try:
+            task = self._session.invoke_api(self._session.vim,
+                                            'RemoveSnapshot_Task',
+                                            snapshot, removeChildren=False)
+            LOG.debug("Initiated snapshot: %(name)s deletion for backing: "
+                      "%(backing)s.",
+                      {'name': name, 'backing': backing})
+            yield task
+        finally:
+            self._device_cache.invalidate(backing.value)
+            self._snapshot_cache.invalidate(backing.value)
         LOG.info("Successfully deleted snapshot: %(name)s of backing: "
                  "%(backing)s.", {'backing': backing, 'name': name})
 
+    def delete_snapshots(self, backing, names):
+        """Delete the given snapshots from volume backing, one at a time.
+
+        :param backing: Reference to the backing entity
+        :param names: Snapshot names, in the order of deletion
+        """
+        for name in names:
+            self.delete_snapshot(backing, name)
+
+    def scan_stale_snapshots(self, max_age=None, max_depth=None):
+        """Find old snapshots and deep snapshot chains of all VMs.
+
+        See snapshot_scanner.scan_stale_snapshots for the parameters.
+
+        :return: iterator over snapshot_scanner.StaleSnapshot
+        """
+        return snapshot_scanner.scan_stale_snapshots(
+            self._session, self._max_objects, max_age=max_age,
+            max_depth=max_depth, page_sizer=self._page_sizer)
+
+    def delete_stale_snapshots(self, stale_snapshots,
+                               max_workers=batch.DEFAULT_MAX_WORKERS,
+                               per_host_limit=1):
+        """Delete snapshots found by scan_stale_snapshots concurrently.
+
+        The snapshots of a VM are deleted one after the other, and at most
+        per_host_limit VMs per host are worked on at a time, since every
+        deletion consolidates disks on the host. The snapshots of a VM are
+        deleted as soon as the scan moves past it, while the scan goes on.
+
+        :param stale_snapshots: iterable of snapshot_scanner.StaleSnapshot,
+                                grouped by VM as scan_stale_snapshots yields
+                                them
+        :param max_workers: maximum number of VMs worked on at a time
+        :param per_host_limit: maximum number of VMs per host worked on at a
+                               time
+        :return: tuple of the list of batch.BatchResult, one per VM, and
+                 batch.BatchStats
+        """
+        operations = snapshot_scanner.iter_delete_operations(stale_snapshots)
+        results, stats = self.run_batch(operations, max_workers=max_workers,
+                                        per_host_limit=per_host_limit)
+        LOG.info("Processed stale snapshots of %d backings.", len(results))
+        return results, stats
+
+    @_waits_for_tasks
     def revert_to_snapshot(self, backing, name):
         LOG.debug("Revert to snapshot: %(name)s of backing: %(backing)s.",
                   {'name': name, 'backing': backing})
@@ -1228,10 +1638,14 @@ class VMwareVolumeOps(object):
             raise vmdk_exceptions.SnapshotNotFoundException(
                 name=name)
 
-        task = self._session.invoke_api(self._session.vim,
-                                        'RevertToSnapshot_Task',
-                                        snapshot)
-        self._session.wait_for_task(task)
+        try:
+            task = self._session.invoke_api(self._session.vim,
+                                            'RevertToSnapshot_Task',
+                                            snapshot)
+            yield task
+        finally:
+            self._device_cache.invalidate(backing.value)
+            self._snapshot_cache.invalidate(backing.value)
 
     def _get_folder(self, backing):
         """Get parent folder of the backing.
@@ -1266,6 +1680,21 @@ class VMwareVolumeOps(object):
         relocate_spec = self._get_relocate_spec(datastore, resource_pool, host,
                                                 disk_move_type, disk_type,
                                                 disk_device)
+        return self._create_clone_spec(relocate_spec, snapshot,
+                                       extra_config=extra_config,
+                                       device_changes=device_changes)
+
+    def _create_clone_spec(self, relocate_spec, snapshot, extra_config=None,
+                           device_changes=None):
+        """Create a clone spec from the given relocate spec.
+
+        :param relocate_spec: Relocate spec of the clone
+        :param snapshot: Reference to snapshot
+        :param extra_config: Key-value pairs to be written to backing's
+                             extra-config
+        :param device_changes: Device changes to be applied during cloning
+        :return: Clone spec
+        """
         cf = self._session.vim.client.factory
         clone_spec = cf.create('ns0:VirtualMachineCloneSpec')
         clone_spec.location = relocate_spec
@@ -1302,14 +1731,7 @@ class VMwareVolumeOps(object):
 
     def _get_vif_devices(self, vm):
         vif_devices = []
-        hardware_devices = self._session.invoke_api(vim_util,
-                                                    'get_object_property',
-                                                    self._session.vim,
-                                                    vm,
-                                                    'config.hardware.device')
-
-        if hardware_devices.__class__.__name__ == "ArrayOfVirtualDevice":
-            hardware_devices = hardware_devices.VirtualDevice
+        hardware_devices = self._get_hardware_devices(vm)
 
         for device in hardware_devices:
             if hasattr(device, 'macAddress'):
@@ -1326,6 +1748,7 @@ class VMwareVolumeOps(object):
 
         return device_change
 
+    @_waits_for_tasks
     def clone_backing(self, name, backing, snapshot, clone_type, datastore,
                       disk_type=None, host=None, resource_pool=None,
                       extra_config=None, folder=None, device_changes=None):
@@ -1369,40 +1792,179 @@ class VMwareVolumeOps(object):
             resource_pool=resource_pool, extra_config=extra_config,
             device_changes=device_changes)
 
-        task = self._session.invoke_api(self._session.vim, 'CloneVM_Task',
-                                        backing, folder=folder, name=name,
-                                        spec=clone_spec)
-        LOG.debug("Initiated clone of backing: %s.", name)
-        task_info = self._session.wait_for_task(task)
+        try:
+            task = self._session.invoke_api(self._session.vim,
+                                            'CloneVM_Task', backing,
+                                            folder=folder, name=name,
+                                            spec=clone_spec)
+            LOG.debug("Initiated clone of backing: %s.", name)
+            task_info = yield task
+        finally:
+            self._device_cache.invalidate(backing.value)
         new_backing = task_info.result
         LOG.info("Successfully created clone: %s.", new_backing)
         return new_backing
 
+    def clone_backings(self, names, backing, snapshot, clone_type,
+                       datastores, disk_type=None, host=None,
+                       resource_pool=None, extra_configs=None, folder=None,
+                       max_in_flight=10, max_in_flight_per_datastore=4,
+                       return_exceptions=False):
+        """Create many clones of a backing from one snapshot.
+
+        The folder, disk device and relocate spec per datastore are fetched
+        or built once for all clones and the CloneVM_Task calls are issued
+        concurrently, at most max_in_flight in total and
+        max_in_flight_per_datastore per datastore.
+
+        :param names: Names of the clones
+        :param backing: Reference to the backing entity
+        :param snapshot: Snapshot point from which the clones should be done
+        :param clone_type: Whether full or linked clones are to be made
+        :param datastores: Reference to the datastore entity of all clones,
+                           or list of references, one per clone
+        :param disk_type: Disk type of the clones
+        :param host: Target host
+        :param resource_pool: Target resource pool
+        :param extra_configs: List of key-value pairs to be written to the
+                              extra-config of each clone
+        :param folder: The location of the clones
+        :param max_in_flight: Maximum number of clone tasks in flight
+        :param max_in_flight_per_datastore: Maximum number of clone tasks in
+                                            flight per datastore
+        :param return_exceptions: If True, a failed clone is returned as its
+                                  exception instead of raising it once all
+                                  tasks in flight have completed; if False,
+                                  the clones created so far are deleted
+                                  before the error is raised
+        :return: List of references to the clones, in the order of names
+        """
+        if max_in_flight < 1 or max_in_flight_per_datastore < 1:
+            raise ValueError("max_in_flight and max_in_flight_per_datastore "
+                             "must be positive.")
+        if not isinstance(datastores, (list, tuple)):
+            datastores = [datastores] * len(names)
+        extra_configs = extra_configs or [None] * len(names)
+
+        if folder is None:
+            folder = self._get_folder(backing)
+        if clone_type == LINKED_CLONE_TYPE:
+            disk_move_type = 'createNewChildDiskBacking'
+        else:
+            disk_move_type = 'moveAllDiskBackingsAndDisallowSharing'
+        disk_device = None
+        if disk_type is not None:
+            disk_device = self._get_disk_device(backing)
+
+        relocate_specs = {}
+        for datastore in datastores:
+            if datastore.value not in relocate_specs:
+                relocate_specs[datastore.value] = self._get_relocate_spec(
+                    datastore, resource_pool, host, disk_move_type,
+                    disk_type, disk_device)
+
+        LOG.debug("Creating %(count)d clones of backing: %(back)s from "
+                  "snapshot: %(snap)s on %(ds_count)d datastores.",
+                  {'count': len(names), 'back': backing, 'snap': snapshot,
+                   'ds_count': len(relocate_specs)})
+
+        # TaskTracker defines __len__, so an idle tracker is falsy.
+        task_tracker = self._task_tracker
+        if task_tracker is None:
+            task_tracker = tasks.TaskTracker(self._session)
+        results = [None] * len(names)
+        pending = list(range(len(names)))
+        in_flight = {}
+        ds_in_flight = collections.Counter()
+        error = None
+        while (pending and error is None) or in_flight:
+            for index in list(pending):
+                if error is not None or len(in_flight) >= max_in_flight:
+                    break
+                ds_value = datastores[index].value
+                if ds_in_flight[ds_value] >= max_in_flight_per_datastore:
+                    continue
+                pending.remove(index)
+                extra_config = extra_configs[index]
+                # Any error stops new clones, while the tasks in flight are
+                # still waited for so that their clones can be deleted.
+                try:
+                    clone_spec = self._create_clone_spec(
+                        relocate_specs[ds_value], snapshot,
+                        extra_config=(dict(extra_config) if extra_config
+                                      else None))
+                    task = self._session.invoke_api(
+                        self._session.vim, 'CloneVM_Task', backing,
+                        folder=folder, name=names[index], spec=clone_spec)
+                except Exception as exc:
+                    results[index] = exc
+                    if not return_exceptions:
+                        error = exc
+                    continue
+                LOG.debug("Initiated clone of backing: %s.", names[index])
+                in_flight[task_tracker.submit(task)] = index
+                ds_in_flight[ds_value] += 1
+
+            if not in_flight:
+                continue
+            done, _ = futures.wait(list(in_flight),
+                                   return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                index = in_flight.pop(future)
+                ds_in_flight[datastores[index].value] -= 1
+                try:
+                    results[index] = future.result().result
+                    LOG.info("Successfully created clone: %s.",
+                             results[index])
+                except Exception as exc:
+                    results[index] = exc
+                    if not return_exceptions and error is None:
+                        error = exc
+
+        self._device_cache.invalidate(backing.value)
+        if error is not None:
+            LOG.error("Error creating clones of backing: %s.", backing)
+            self._delete_clones(results)
+            raise error
+        return results
+
+    def _delete_clones(self, clones):
+        """Delete the clones created by a failed clone_backings call."""
+        for clone in clones:
+            if clone is None or isinstance(clone, Exception):
+                continue
+            try:
+                self.delete_backing(clone)
+            except Exception:
+                LOG.exception("Error deleting clone: %s.", clone)
+
+    @_waits_for_tasks
     def _reconfigure_backing(self, backing, reconfig_spec):
         """Reconfigure backing VM with the given spec."""
         LOG.debug("Reconfiguring backing VM: %(backing)s with spec: %(spec)s.",
                   {'backing': backing,
                    'spec': reconfig_spec})
-        reconfig_task = self._session.invoke_api(self._session.vim,
-                                                 "ReconfigVM_Task",
-                                                 backing,
-                                                 spec=reconfig_spec)
-        LOG.debug("Task: %s created for reconfiguring backing VM.",
-                  reconfig_task)
-        self._session.wait_for_task(reconfig_task)
+        try:
+            reconfig_task = self._session.invoke_api(self._session.vim,
+                                                     "ReconfigVM_Task",
+                                                     backing,
+                                                     spec=reconfig_spec)
+            LOG.debug("Task: %s created for reconfiguring backing VM.",
+                      reconfig_task)
+            yield reconfig_task
+        finally:
+            # The reconfigure changes the devices of the backing.
+            self._device_cache.invalidate(backing.value)
 
     def _get_controller(self, backing, adapter_type):
-        devices = self._session.invoke_api(vim_util,
-                                           'get_object_property',
-                                           self._session.vim,
-                                           backing,
-                                           'config.hardware.device')
+        devices = self._get_hardware_devices(backing)
 
         controller_type = ControllerType.get_controller_type(adapter_type)
         for device in devices:
             if device.__class__.__name__ == controller_type:
                 return device
 
+    @_waits_for_tasks
     def attach_disk_to_backing(self, backing, size_in_kb, disk_type,
                                adapter_type, profile_id, vmdk_ds_file_path):
         """Attach an existing virtual disk to the backing VM.
@@ -1442,7 +2004,8 @@ class VMwareVolumeOps(object):
                 profile_id,
                 vmdk_ds_file_path=vmdk_ds_file_path)
         reconfig_spec.deviceChange = specs
-        self._reconfigure_backing(backing, reconfig_spec)
+        yield from self._reconfigure_backing.steps(self, backing,
+                                                   reconfig_spec)
         LOG.debug("Backing VM: %s reconfigured with new disk.", backing)
 
     def _create_spec_for_device_remove(self, disk_device):
@@ -1456,12 +2019,13 @@ class VMwareVolumeOps(object):
         cf = self._session.vim.client.factory
         disk_spec = cf.create('ns0:VirtualDeviceConfigSpec')
         disk_spec.operation = 'edit'
-        disk_spec.device = disk_device
+        disk_spec.device = copy.deepcopy(disk_device)
         disk_spec.device.capacityInKB = new_size_in_kb
         disk_spec.device.capacityInBytes = (
             disk_spec.device.capacityInKB * units.Ki)
         return disk_spec
 
+    @_waits_for_tasks
     def detach_disk_from_backing(self, backing, disk_device):
         """Detach the given disk from backing."""
 
@@ -1473,8 +2037,10 @@ class VMwareVolumeOps(object):
         reconfig_spec = cf.create('ns0:VirtualMachineConfigSpec')
         spec = self._create_spec_for_device_remove(disk_device)
         reconfig_spec.deviceChange = [spec]
-        self._reconfigure_backing(backing, reconfig_spec)
+        yield from self._reconfigure_backing.steps(self, backing,
+                                                   reconfig_spec)
 
+    @_waits_for_tasks
     def rename_backing(self, backing, new_name):
         """Rename backing VM.
 
@@ -1489,11 +2055,25 @@ class VMwareVolumeOps(object):
                                                backing,
                                                newName=new_name)
         LOG.debug("Task: %s created for renaming VM.", rename_task)
-        self._session.wait_for_task(rename_task)
+        yield rename_task
         LOG.info("Backing VM: %(backing)s renamed to %(new_name)s.",
                  {'backing': backing,
                   'new_name': new_name})
 
+    def reconfigure_transaction(self, backing):
+        """Start collecting changes to apply to the backing at once.
+
+        Use as a context manager, which commits the changes on exit::
+
+            with vops.reconfigure_transaction(backing) as txn:
+                txn.update_disk_uuid(disk_uuid)
+                txn.change_profile(profile_id)
+
+        :param backing: Reference to backing VM
+        :return: ReconfigTransaction
+        """
+        return ReconfigTransaction(self, backing)
+
     def change_backing_profile(self, backing, profile_id):
         """Change storage profile of the backing VM.
 
@@ -1503,25 +2083,8 @@ class VMwareVolumeOps(object):
                   " %(profile)s.",
                   {'backing': backing,
                    'profile': profile_id})
-        cf = self._session.vim.client.factory
-
-        if profile_id is None:
-            vm_profile = cf.create('ns0:VirtualMachineEmptyProfileSpec')
-        else:
-            vm_profile = cf.create('ns0:VirtualMachineDefinedProfileSpec')
-            vm_profile.profileId = profile_id.uniqueId
-
-        reconfig_spec = cf.create('ns0:VirtualMachineConfigSpec')
-        reconfig_spec.vmProfile = [vm_profile]
-
-        disk_device = self._get_disk_device(backing)
-        disk_spec = cf.create('ns0:VirtualDeviceConfigSpec')
-        disk_spec.device = disk_device
-        disk_spec.operation = 'edit'
-        disk_spec.profile = [vm_profile]
-        reconfig_spec.deviceChange = [disk_spec]
-
-        self._reconfigure_backing(backing, reconfig_spec)
+        with self.reconfigure_transaction(backing) as txn:
+            txn.change_profile(profile_id)
         LOG.debug("Backing VM: %(backing)s reconfigured with new profile: "
                   "%(profile)s.",
                   {'backing': backing,
@@ -1537,46 +2100,29 @@ class VMwareVolumeOps(object):
                   "to: %(disk_uuid)s.",
                   {'backing': backing,
                    'disk_uuid': disk_uuid})
-
-        disk_device = self._get_disk_device(backing)
-        disk_device.backing.uuid = disk_uuid
-
-        cf = self._session.vim.client.factory
-        disk_spec = cf.create('ns0:VirtualDeviceConfigSpec')
-        disk_spec.device = disk_device
-        disk_spec.operation = 'edit'
-
-        reconfig_spec = cf.create('ns0:VirtualMachineConfigSpec')
-        reconfig_spec.deviceChange = [disk_spec]
-        self._reconfigure_backing(backing, reconfig_spec)
-
+        with self.reconfigure_transaction(backing) as txn:
+            txn.update_disk_uuid(disk_uuid)
         LOG.debug("Backing VM: %(backing)s reconfigured with new disk UUID: "
                   "%(disk_uuid)s.",
                   {'backing': backing,
                    'disk_uuid': disk_uuid})
 
     def update_backing_extra_config(self, backing, extra_config):
-        cf = self._session.vim.client.factory
-        reconfig_spec = cf.create('ns0:VirtualMachineConfigSpec')
-        if BACKING_UUID_KEY in extra_config:
-            reconfig_spec.instanceUuid = extra_config.pop(BACKING_UUID_KEY)
-        reconfig_spec.extraConfig = self._get_extra_config_option_values(
-            extra_config)
-        self._reconfigure_backing(backing, reconfig_spec)
+        with self.reconfigure_transaction(backing) as txn:
+            txn.update_extra_config(extra_config)
         LOG.debug("Backing: %(backing)s reconfigured with extra config: "
                   "%(extra_config)s.",
                   {'backing': backing,
                    'extra_config': extra_config})
 
     def update_backing_uuid(self, backing, uuid):
-        cf = self._session.vim.client.factory
-        reconfig_spec = cf.create('ns0:VirtualMachineConfigSpec')
-        reconfig_spec.instanceUuid = uuid
-        self._reconfigure_backing(backing, reconfig_spec)
+        with self.reconfigure_transaction(backing) as txn:
+            txn.update_uuid(uuid)
         LOG.debug("Backing: %(backing)s reconfigured with uuid: %(uuid)s.",
                   {'backing': backing,
                    'uuid': uuid})
 
+    @_waits_for_tasks
     def delete_file(self, file_path, datacenter=None):
         """Delete file or folder on the datastore.
 
@@ -1591,7 +2137,7 @@ class VMwareVolumeOps(object):
                                         name=file_path,
                                         datacenter=datacenter)
         LOG.debug("Initiated deletion via task: %s.", task)
-        self._session.wait_for_task(task)
+        yield task
         LOG.info("Successfully deleted file: %s.", file_path)
 
     def create_datastore_folder(self, ds_name, folder_path, datacenter):
@@ -1635,15 +2181,28 @@ class VMwareVolumeOps(object):
         return self._session.invoke_api(vim_util, 'get_object_property',
                                         self._session.vim, entity, 'name')
 
+    def _get_hardware_devices(self, backing):
+        """Get the virtual devices of the backing.
+
+        The devices are shared with other callers through the device cache
+        and must not be modified; devices edited for a spec are copied with
+        copy.deepcopy first.
+
+        :param backing: Reference to the backing
+        :return: list of virtual devices
+        """
+        def _fetch():
+            devices = self._get_backing_property(backing,
+                                                 'config.hardware.device')
+            if devices.__class__.__name__ == "ArrayOfVirtualDevice":
+                devices = devices.VirtualDevice
+            return devices or []
+
+        return self._device_cache.get(backing.value, _fetch)
+
     def _get_disk_device(self, backing):
         """Get the virtual device corresponding to disk."""
-        hardware_devices = self._session.invoke_api(vim_util,
-                                                    'get_object_property',
-                                                    self._session.vim,
-                                                    backing,
-                                                    'config.hardware.device')
-        if hardware_devices.__class__.__name__ == "ArrayOfVirtualDevice":
-            hardware_devices = hardware_devices.VirtualDevice
+        hardware_devices = self._get_hardware_devices(backing)
         for device in hardware_devices:
             if device.__class__.__name__ == "VirtualDisk":
                 return device
@@ -1688,6 +2247,7 @@ class VMwareVolumeOps(object):
         spec.diskType = VirtualDiskType.get_virtual_disk_type(disk_type)
         return spec
 
+    @_waits_for_tasks
     def create_virtual_disk(self, dc_ref, vmdk_ds_file_path, size_in_kb,
                             adapter_type='busLogic', disk_type='preallocated'):
         """Create virtual disk with the given settings.
@@ -1710,7 +2270,7 @@ class VMwareVolumeOps(object):
                                         datacenter=dc_ref,
                                         spec=virtual_disk_spec)
         LOG.debug("Task: %s created for virtual disk creation.", task)
-        self._session.wait_for_task(task)
+        yield task
         LOG.debug("Created virtual disk with spec: %s.", virtual_disk_spec)
 
     def create_flat_extent_virtual_disk_descriptor(
@@ -1740,6 +2300,7 @@ class VMwareVolumeOps(object):
         LOG.debug("Created descriptor: %s.",
                   path.get_descriptor_ds_file_path())
 
+    @_waits_for_tasks
     def copy_vmdk_file(self, src_dc_ref, src_vmdk_file_path,
                        dest_vmdk_file_path, dest_dc_ref=None):
         """Copy contents of the src vmdk file to dest vmdk file.
@@ -1766,10 +2327,11 @@ class VMwareVolumeOps(object):
                                         force=True)
 
         LOG.debug("Initiated copying disk data via task: %s.", task)
-        self._session.wait_for_task(task)
+        yield task
         LOG.info("Successfully copied disk at: %(src)s to: %(dest)s.",
                  {'src': src_vmdk_file_path, 'dest': dest_vmdk_file_path})
 
+    @_waits_for_tasks
     def move_vmdk_file(self, src_dc_ref, src_vmdk_file_path,
                        dest_vmdk_file_path, dest_dc_ref=None):
         """Move the given vmdk file to another datastore location.
@@ -1793,8 +2355,9 @@ class VMwareVolumeOps(object):
                                         destName=dest_vmdk_file_path,
                                         destDatacenter=dest_dc_ref,
                                         force=True)
-        self._session.wait_for_task(task)
+        yield task
 
+    @_waits_for_tasks
     def copy_datastore_file(self, vsphere_url, dest_dc_ref, dest_ds_file_path):
         """Copy file to datastore location.
 
@@ -1819,8 +2382,9 @@ class VMwareVolumeOps(object):
             sourceDatacenter=src_dc_ref,
             destinationName=dest_ds_file_path,
             destinationDatacenter=dest_dc_ref)
-        self._session.wait_for_task(task)
+        yield task
 
+    @_waits_for_tasks
     def delete_vmdk_file(self, vmdk_file_path, dc_ref):
         """Delete given vmdk files.
 
@@ -1835,29 +2399,43 @@ class VMwareVolumeOps(object):
                                         name=vmdk_file_path,
                                         datacenter=dc_ref)
         LOG.debug("Initiated deleting vmdk file via task: %s.", task)
-        self._session.wait_for_task(task)
+        yield task
         LOG.info("Deleted vmdk file: %s.", vmdk_file_path)
 
     def _get_all_clusters(self):
         clusters = {}
-        retrieve_result = self._session.invoke_api(vim_util, 'get_objects',
-                                                   self._session.vim,
-                                                   'ClusterComputeResource',
-                                                   self._max_objects)
-        while retrieve_result:
-            if retrieve_result.objects:
-                for cluster in retrieve_result.objects:
-                    name = urllib.parse.unquote(cluster.propSet[0].val)
-                    clusters[name] = cluster.obj
-            retrieve_result = self.continue_retrieval(retrieve_result)
+        for cluster in retrieval.retrieve_objects(
+                self._session, 'ClusterComputeResource', self._max_objects,
+                page_sizer=self._page_sizer):
+            name = urllib.parse.unquote(cluster.propSet[0].val)
+            clusters[name] = cluster.obj
         return clusters
 
+    def build_inventory_snapshot(self):
+        """Fetch clusters, custom attributes and hosts in one query.
+
+        Once built, get_cluster_refs, get_cluster_custom_attributes and
+        get_cluster_hosts are answered from the snapshot instead of querying
+        vCenter per cluster.
+
+        :return: InventorySnapshot
+        """
+        self._inventory = inventory.build_inventory_snapshot(
+            self._session, self._max_objects, page_sizer=self._page_sizer)
+        return self._inventory
+
+    def clear_inventory_snapshot(self):
+        self._inventory = None
+
     def get_cluster_refs(self, names):
         """Get references to given clusters.
 
         :param names: list of cluster names
         :return: Dictionary of cluster names to references
         """
+        if self._inventory is not None:
+            return self._inventory.get_cluster_refs(names)
+
         clusters_ref = {}
         clusters = self._get_all_clusters()
         for name in names:
@@ -1869,29 +2447,23 @@ class VMwareVolumeOps(object):
         return clusters_ref
 
     def get_cluster_custom_attributes(self, cluster):
+        if (self._inventory is not None and
+                self._inventory.has_cluster(cluster)):
+            return self._inventory.get_cluster_custom_attributes(cluster)
+
         retrieve_fields = self._session.invoke_api(vim_util,
                                                    'get_object_property',
                                                    self._session.vim,
                                                    cluster,
                                                    'availableField')
         if retrieve_fields:
-            custom_fields = {}
-            for field in retrieve_fields:
-                for v in field[1]:
-                    custom_fields[v.key] = v.name
-
             retrieve_result = self._session.invoke_api(vim_util,
                                                        'get_object_property',
                                                        self._session.vim,
                                                        cluster,
                                                        'customValue')
-            if retrieve_result:
-                custom_attributes = {}
-                for val in retrieve_result:
-                    for i in val[1]:
-                        custom_attributes[custom_fields[i.key]] = {"value": i.value, 'id': i.key}
-
-                return custom_attributes
+            return inventory.parse_custom_attributes(retrieve_fields,
+                                                     retrieve_result)
 
     def get_cluster_hosts(self, cluster):
         """Get hosts in the given cluster.
@@ -1899,6 +2471,10 @@ class VMwareVolumeOps(object):
         :param cluster: cluster reference
         :return: references to hosts in the cluster
         """
+        if (self._inventory is not None and
+                self._inventory.has_cluster(cluster)):
+            return self._inventory.get_cluster_hosts(cluster)
+
         hosts = self._session.invoke_api(vim_util,
                                          'get_object_property',
                                          self._session.vim,
@@ -1929,14 +2505,7 @@ class VMwareVolumeOps(object):
 
     def _get_disk_devices(self, vm):
         disk_devices = []
-        hardware_devices = self._session.invoke_api(vim_util,
-                                                    'get_object_property',
-                                                    self._session.vim,
-                                                    vm,
-                                                    'config.hardware.device')
-
-        if hardware_devices.__class__.__name__ == "ArrayOfVirtualDevice":
-            hardware_devices = hardware_devices.VirtualDevice
+        hardware_devices = self._get_hardware_devices(vm)
 
         for device in hardware_devices:
             if device.__class__.__name__ == "VirtualDisk":
@@ -1977,6 +2546,7 @@ class VMwareVolumeOps(object):
         profile_spec.profileId = profile_id
         return profile_spec
 
+    @_waits_for_tasks
     def create_fcd(self, name, size_mb, ds_ref, disk_type, profile_id=None):
         cf = self._session.vim.client.factory
         spec = cf.create('ns0:VslmCreateSpec')
@@ -1995,11 +2565,12 @@ class VMwareVolumeOps(object):
                                         'CreateDisk_Task',
                                         vstorage_mgr,
                                         spec=spec)
-        task_info = self._session.wait_for_task(task)
+        task_info = yield task
         fcd_loc = FcdLocation.create(task_info.result.config.id, ds_ref)
         LOG.debug("Created fcd: %s.", fcd_loc)
         return fcd_loc
 
+    @_waits_for_tasks
     def delete_fcd(self, fcd_location):
         cf = self._session.vim.client.factory
         vstorage_mgr = self._session.vim.service_content.vStorageObjectManager
@@ -2009,8 +2580,9 @@ class VMwareVolumeOps(object):
                                         vstorage_mgr,
                                         id=fcd_location.id(cf),
                                         datastore=fcd_location.ds_ref())
-        self._session.wait_for_task(task)
+        yield task
 
+    @_waits_for_tasks
     def clone_fcd(
             self, name, fcd_location, dest_ds_ref, disk_type, profile_id=None):
         cf = self._session.vim.client.factory
@@ -2035,12 +2607,13 @@ class VMwareVolumeOps(object):
                                         id=fcd_location.id(cf),
                                         datastore=fcd_location.ds_ref(),
                                         spec=spec)
-        task_info = self._session.wait_for_task(task)
+        task_info = yield task
         dest_fcd_loc = FcdLocation.create(task_info.result.config.id,
                                           dest_ds_ref)
         LOG.debug("Clone fcd: %s.", dest_fcd_loc)
         return dest_fcd_loc
 
+    @_waits_for_tasks
     def extend_fcd(self, fcd_location, new_size_mb):
         cf = self._session.vim.client.factory
         vstorage_mgr = self._session.vim.service_content.vStorageObjectManager
@@ -2052,7 +2625,7 @@ class VMwareVolumeOps(object):
                                         id=fcd_location.id(cf),
                                         datastore=fcd_location.ds_ref(),
                                         newCapacityInMB=new_size_mb)
-        self._session.wait_for_task(task)
+        yield task
 
     def register_disk(self, vmdk_url, name, ds_ref):
         vstorage_mgr = self._session.vim.service_content.vStorageObjectManager
@@ -2066,6 +2639,7 @@ class VMwareVolumeOps(object):
         LOG.debug("Created fcd: %s.", fcd_loc)
         return fcd_loc
 
+    @_waits_for_tasks
     def attach_fcd(self, backing, fcd_location):
         cf = self._session.vim.client.factory
 
@@ -2073,27 +2647,36 @@ class VMwareVolumeOps(object):
         spec = self._create_controller_config_spec(
             VirtualDiskAdapterType.LSI_LOGIC)
         reconfig_spec.deviceChange = [spec]
-        self._reconfigure_backing(backing, reconfig_spec)
+        yield from self._reconfigure_backing.steps(self, backing,
+                                                   reconfig_spec)
 
         LOG.debug("Attaching fcd: %(fcd_loc)s to %(backing)s.",
                   {'fcd_loc': fcd_location, 'backing': backing})
-        task = self._session.invoke_api(self._session.vim,
-                                        "AttachDisk_Task",
-                                        backing,
-                                        diskId=fcd_location.id(cf),
-                                        datastore=fcd_location.ds_ref())
-        self._session.wait_for_task(task)
-
+        try:
+            task = self._session.invoke_api(self._session.vim,
+                                            "AttachDisk_Task",
+                                            backing,
+                                            diskId=fcd_location.id(cf),
+                                            datastore=fcd_location.ds_ref())
+            yield task
+        finally:
+            self._device_cache.invalidate(backing.value)
+
+    @_waits_for_tasks
     def detach_fcd(self, backing, fcd_location):
         cf = self._session.vim.client.factory
         LOG.debug("Detaching fcd: %(fcd_loc)s from %(backing)s.",
                   {'fcd_loc': fcd_location, 'backing': backing})
-        task = self._session.invoke_api(self._session.vim,
-                                        "DetachDisk_Task",
-                                        backing,
-                                        diskId=fcd_location.id(cf))
-        self._session.wait_for_task(task)
-
+        try:
+            task = self._session.invoke_api(self._session.vim,
+                                            "DetachDisk_Task",
+                                            backing,
+                                            diskId=fcd_location.id(cf))
+            yield task
+        finally:
+            self._device_cache.invalidate(backing.value)
+
+    @_waits_for_tasks
     def create_fcd_snapshot(self, fcd_location, description):
         LOG.debug("Creating fcd snapshot for %s.", fcd_location)
 
@@ -2105,12 +2688,13 @@ class VMwareVolumeOps(object):
                                         id=fcd_location.id(cf),
                                         datastore=fcd_location.ds_ref(),
                                         description=description)
-        task_info = self._session.wait_for_task(task)
+        task_info = yield task
         fcd_snap_loc = FcdSnapshotLocation(fcd_location, task_info.result.id)
 
         LOG.debug("Created fcd snapshot: %s.", fcd_snap_loc)
         return fcd_snap_loc
 
+    @_waits_for_tasks
     def delete_fcd_snapshot(self, fcd_snap_loc):
         LOG.debug("Deleting fcd snapshot: %s.", fcd_snap_loc)
 
@@ -2123,8 +2707,9 @@ class VMwareVolumeOps(object):
             id=fcd_snap_loc.fcd_loc.id(cf),
             datastore=fcd_snap_loc.fcd_loc.ds_ref(),
             snapshotId=fcd_snap_loc.id(cf))
-        self._session.wait_for_task(task)
+        yield task
 
+    @_waits_for_tasks
     def create_fcd_from_snapshot(self, fcd_snap_loc, name, profile_id=None):
         LOG.debug("Creating fcd with name: %(name)s from fcd snapshot: "
                   "%(snap)s.", {'name': name, 'snap': fcd_snap_loc})
@@ -2144,13 +2729,14 @@ class VMwareVolumeOps(object):
             snapshotId=fcd_snap_loc.id(cf),
             name=name,
             profile=profile)
-        task_info = self._session.wait_for_task(task)
+        task_info = yield task
         fcd_loc = FcdLocation.create(task_info.result.config.id,
                                      fcd_snap_loc.fcd_loc.ds_ref())
 
         LOG.debug("Created fcd: %s.", fcd_loc)
         return fcd_loc
 
+    @_waits_for_tasks
     def update_fcd_policy(self, fcd_location, profile_id):
         LOG.debug("Changing fcd: %(fcd_loc)s storage policy to %(policy)s.",
                   {'fcd_loc': fcd_location, 'policy': profile_id})
@@ -2168,7 +2754,7 @@ class VMwareVolumeOps(object):
             id=fcd_location.id(cf),
             datastore=fcd_location.ds_ref(),
             profile=[profile_spec])
-        self._session.wait_for_task(task)
+        yield task
 
         LOG.debug("Updated fcd storage policy to %s.", profile_id)
 
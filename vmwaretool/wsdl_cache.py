@@ -0,0 +1,222 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Persistent cache of parsed WSDL definitions.
+"""
+
+import contextlib
+import gc
+import json
+import os
+import pickle
+import platform
+import shutil
+import stat
+import threading
+
+from oslo_log import log as logging
+import oslo_vmware
+from oslo_vmware import service
+import suds
+from suds import cache
+
+try:
+    from importlib import metadata
+except ImportError:
+    metadata = None
+
+
+LOG = logging.getLogger(__name__)
+
+_VERSIONS_FILE = 'server_versions.json'
+_UNKNOWN_VERSION = 'unknown'
+
+# Serializes the replacement of the suds client class of oslo.vmware.
+_install_lock = threading.RLock()
+
+
+def _package_version(name, module):
+    version = getattr(module, '__version__', None)
+    if version is None and metadata is not None:
+        try:
+            version = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            pass
+    return version or _UNKNOWN_VERSION
+
+
+def _library_key():
+    # Pickled definitions are only readable by the libraries that wrote
+    # them.
+    return "py%s_suds-%s_oslo.vmware-%s" % (
+        '.'.join(platform.python_version_tuple()[:2]),
+        _package_version('suds-community', suds),
+        _package_version('oslo.vmware', oslo_vmware))
+
+
+def _make_private_dir(path):
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    # The directory may have been created by an older version.
+    os.chmod(path, 0o700)
+
+
+class _DefinitionsCache(cache.ObjectCache):
+    """suds object cache of parsed WSDL definitions which never expire.
+
+    Since unpickling runs arbitrary code, the files are created readable
+    only by their owner in a directory only the owner can enter, and files
+    which other users could have written are ignored.
+    """
+
+    protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location):
+        _make_private_dir(location)
+        super(_DefinitionsCache, self).__init__(location)
+        # FileCache writes its version file with the default mode.
+        os.chmod(os.path.join(location, 'version'), 0o600)
+
+    def _getf(self, id):
+        cache_file = super(_DefinitionsCache, self)._getf(id)
+        if cache_file is None:
+            return None
+        st = os.fstat(cache_file.fileno())
+        if (st.st_uid != os.getuid() or
+                st.st_mode & (stat.S_IRWXG | stat.S_IRWXO)):
+            LOG.warning("Ignoring cached WSDL %s since it is accessible by "
+                        "other users.", cache_file.name)
+            cache_file.close()
+            return None
+        return cache_file
+
+    def get(self, id):
+        # The definitions are a graph of hundreds of thousands of objects;
+        # collecting while unpickling them doubles the load time.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return super(_DefinitionsCache, self).get(id)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def put(self, id, object):
+        try:
+            data = pickle.dumps(object, self.protocol)
+            # FileCache would create the file with the default mode.
+            path = self._FileCache__filename(id)
+            tmp_path = "%s.%d.tmp" % (path, os.getpid())
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         0o600)
+            with os.fdopen(fd, 'wb') as cache_file:
+                cache_file.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            LOG.warning("Error caching parsed WSDL.", exc_info=True)
+        return object
+
+
+class WsdlCache(object):
+    """Parsed WSDL definitions of a vCenter server kept on disk.
+
+    Parsing the VIM WSDL takes about a second of CPU time on every session
+    construction. While installed, suds clients created by oslo.vmware load
+    the pickled definitions instead and only parse the WSDL on a miss.
+
+    Entries are keyed by the Python, suds and oslo.vmware versions and by
+    the server's API version and build, which is recorded after each login
+    by update_server_version. If the server has been upgraded since the
+    last run, the stale entries are dropped and the next run parses the new
+    WSDL.
+    """
+
+    def __init__(self, base_dir, host, port):
+        self._base_dir = os.path.join(base_dir, _library_key())
+        self._server = "%s:%s" % (host, port)
+        self._server_version = self._read_versions().get(self._server,
+                                                         _UNKNOWN_VERSION)
+
+    def _versions_path(self):
+        return os.path.join(self._base_dir, _VERSIONS_FILE)
+
+    def _read_versions(self):
+        try:
+            with open(self._versions_path()) as versions_file:
+                return json.load(versions_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _location(self, server_version):
+        name = "%s_%s" % (self._server, server_version)
+        return os.path.join(self._base_dir, name.replace(os.sep, '_'))
+
+    @contextlib.contextmanager
+    def installed(self):
+        """Make oslo.vmware suds clients use the cache within the block."""
+        _make_private_dir(self._base_dir)
+        definitions_cache = _DefinitionsCache(
+            self._location(self._server_version))
+        original_client = service.CompatibilitySudsClient
+
+        class CachingSudsClient(original_client):
+
+            def __init__(self, *args, **kwargs):
+                kwargs['cache'] = definitions_cache
+                kwargs['cachingpolicy'] = 1
+                super(CachingSudsClient, self).__init__(*args, **kwargs)
+
+        with _install_lock:
+            service.CompatibilitySudsClient = CachingSudsClient
+            try:
+                yield
+            finally:
+                service.CompatibilitySudsClient = original_client
+
+    def update_server_version(self, about):
+        """Record the version of the server the cache was used with.
+
+        :param about: AboutInfo of the service content
+        """
+        version = "%s-%s" % (about.apiVersion, about.build)
+        if version == self._server_version:
+            return
+
+        old_location = self._location(self._server_version)
+        if self._server_version == _UNKNOWN_VERSION:
+            # The definitions were just parsed from this server.
+            try:
+                os.replace(old_location, self._location(version))
+            except OSError:
+                shutil.rmtree(old_location, ignore_errors=True)
+        else:
+            LOG.info("vCenter server version of %(server)s changed from "
+                     "%(old)s to %(new)s, dropping cached WSDL.",
+                     {'server': self._server,
+                      'old': self._server_version,
+                      'new': version})
+            shutil.rmtree(old_location, ignore_errors=True)
+        versions = self._read_versions()
+        versions[self._server] = version
+        try:
+            _make_private_dir(self._base_dir)
+            tmp_path = "%s.%d.tmp" % (self._versions_path(), os.getpid())
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         0o600)
+            with os.fdopen(fd, 'w') as versions_file:
+                json.dump(versions, versions_file)
+            os.replace(tmp_path, self._versions_path())
+        except OSError:
+            LOG.warning("Error recording vCenter server version.",
+                        exc_info=True)
+            return
+        self._server_version = version